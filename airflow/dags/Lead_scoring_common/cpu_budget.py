@@ -0,0 +1,113 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+import math
+import os
+from contextlib import contextmanager
+
+from threadpoolctl import threadpool_limits
+
+###############################################################################
+# Define the functions sharing the cores of the worker between the LightGBM
+# tasks running at once
+# ##############################################################################
+
+# environment variables read by the OpenMP and BLAS runtimes, which are set to
+# the budget for the processes started by a task (e.g. the tuning trials)
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+
+def cgroup_cores():
+    '''
+    Returns the number of cores the cgroup of the process may use (its cpu
+    quota divided by its period, cgroup v2 or v1), None if it is not limited.
+    '''
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        return None if quota == 'max' else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def available_cores():
+    '''
+    Returns the number of cores the process can run on: the cores of its cpu
+    affinity, or fewer if its cgroup quota is lower (e.g. the cpu limit of a
+    container), at least 1.
+    '''
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    quota = cgroup_cores()
+    if quota is not None:
+        cores = min(cores, math.ceil(quota))
+    return max(cores, 1)
+
+
+def thread_budget(pool_slots=1, max_threads=None):
+    '''
+    This function returns the number of threads a task may use so that the
+    tasks running at once do not use more threads than there are cores: the
+    available_cores are shared by the 'pool_slots' tasks which may run at
+    once, e.g. the slots of the airflow pool the task runs in.
+
+
+    INPUTS
+        pool_slots : number of tasks sharing the cores
+        max_threads : cap of the number of threads, None for no cap
+
+
+    OUTPUT
+        Number of threads, at least 1
+
+
+    SAMPLE USAGE
+        threads = thread_budget(pool_slots=4)
+    '''
+    threads = max(available_cores() // max(pool_slots, 1), 1)
+    return threads if max_threads is None else max(min(threads, max_threads), 1)
+
+
+@contextmanager
+def cpu_budget(pool_slots=1, max_threads=None):
+    '''
+    This context manager limits the OpenMP (LightGBM) and BLAS thread pools
+    of the process to the thread_budget while the block runs, and sets the
+    THREAD_ENV_VARS for the processes it starts. The threads are also
+    returned, to be passed as the 'num_threads' (n_jobs) of LightGBM, which
+    otherwise uses all the cores.
+
+
+    INPUTS
+        pool_slots, max_threads : see thread_budget
+
+
+    OUTPUT
+        Number of threads of the budget
+
+
+    SAMPLE USAGE
+        with cpu_budget(CPU_POOL_SLOTS, MAX_THREADS_PER_TASK) as threads:
+            booster = lgb.train({**params, 'n_jobs': threads}, train_set)
+    '''
+    threads = thread_budget(pool_slots, max_threads)
+    previous = {variable: os.environ.get(variable) for variable in THREAD_ENV_VARS}
+    os.environ.update({variable: str(threads) for variable in THREAD_ENV_VARS})
+    try:
+        with threadpool_limits(limits=threads):
+            yield threads
+    finally:
+        for variable, value in previous.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
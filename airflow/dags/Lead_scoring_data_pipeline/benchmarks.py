@@ -0,0 +1,650 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+import copy
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+from Lead_scoring_data_pipeline.connection import get_connection, write_table
+from Lead_scoring_data_pipeline.constants import INTERACTION_MAPPING, INDEX_COLUMNS_TRAINING, INDEX_COLUMNS_INFERENCE
+from Lead_scoring_data_pipeline.schema import raw_data_schema, interaction_columns, numeric_dtypes, categorical_dtypes, model_input_schema, encoding_dtypes
+from Lead_scoring_data_pipeline.mapping.significant_categorical_level import *
+from Lead_scoring_data_pipeline.transforms import transform_categorical_vars, transform_interactions, compact_dtypes, collapse_rare_levels, transform_city_tier, build_model_input, required_columns
+from Lead_scoring_data_pipeline.mapping.city_tier_mapping import city_tier_mapping
+from Lead_scoring_data_pipeline.sql_transforms import pushdown
+from Lead_scoring_data_pipeline.staging import SqliteStagingBackend, ArrowStagingBackend
+from Lead_scoring_data_pipeline.partitions import month_partitions, transform_partitions
+from Lead_scoring_data_pipeline.dedup_index import create_dedup_index, deduplicate
+from Lead_scoring_data_pipeline.encoding import OneHotEncoder
+from Lead_scoring_data_pipeline.feature_store import publish_matrix, publish_sparse_matrix, open_matrix
+
+###############################################################################
+# Define helpers used by the benchmarks
+# ##############################################################################
+
+
+def make_leads(n_rows, seed=42, compact=False):
+    '''
+    Builds a synthetic dataframe shaped like the 'city_tier_mapped' table with
+    n_rows leads, levels 'Level0' to 'Level49' in the categorical columns and
+    sparse 0/1 interaction flags. If compact is set the numeric columns have
+    the dtypes of numeric_dtypes, the missing flags being 0, as in the tables
+    from 'loaded_data' onwards.
+    '''
+    rng = np.random.default_rng(seed)
+    data = {'created_date': pd.Series(pd.date_range('2021-01-01', periods=n_rows, freq='min').astype(str)),
+            'city_tier': rng.integers(1, 4, n_rows).astype('float64'),
+            'total_leads_droppped': rng.integers(0, 5, n_rows).astype('float64'),
+            'referred_lead': rng.integers(0, 2, n_rows).astype('float64')}
+    for column in ['first_platform_c', 'first_utm_medium_c', 'first_utm_source_c']:
+        data[column] = np.array([f'Level{i}' for i in range(50)], dtype=object)[rng.integers(0, 50, n_rows)]
+    for column in raw_data_schema:
+        if column not in data and column != 'city_mapped':
+            flags = rng.random(n_rows) < 0.05
+            data[column] = flags.astype(np.int16) if compact else np.where(flags, 1.0, np.nan)
+    data['app_complete_flag'] = rng.integers(0, 2, n_rows).astype('float64')
+    df = pd.DataFrame(data)
+    return compact_dtypes(df, numeric_dtypes) if compact else df
+
+
+def measure(function, *args):
+    '''
+    Runs function(*args) twice and returns the wall clock time in seconds of
+    the first run and the peak memory allocated while the second one ran in
+    MB. The first run is not traced, as tracemalloc slows down the functions
+    allocating many small objects many times over. Every run gets its own
+    copy of the arguments, which some of the functions change in place.
+    '''
+    run_args = copy.deepcopy(args)
+    start = time.perf_counter()
+    function(*run_args)
+    elapsed = time.perf_counter() - start
+    run_args = copy.deepcopy(args)
+    tracemalloc.start()
+    function(*run_args)
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return elapsed, peak
+
+###############################################################################
+# Define the benchmark of the categorical level collapsing
+# ##############################################################################
+
+
+def legacy_collapse_levels(df):
+    '''
+    Split/concat level collapsing map_categorical_vars used before the
+    vectorized collapse_rare_levels, kept as the benchmark baseline.
+    '''
+    new_df=df[~df['first_platform_c'].isin(list_platform)]
+    new_df['first_platform_c']="others"
+    old_df = df[df['first_platform_c'].isin(list_platform)]
+    df = pd.concat([new_df,old_df])
+
+    new_df=df[~df['first_utm_medium_c'].isin(list_medium)]
+    new_df['first_utm_medium_c']="others"
+    old_df = df[df['first_utm_medium_c'].isin(list_medium)]
+    df = pd.concat([new_df,old_df])
+
+    new_df=df[~df['first_utm_source_c'].isin(list_source)]
+    new_df['first_utm_source_c']="others"
+    old_df = df[df['first_utm_source_c'].isin(list_source)]
+    df = pd.concat([new_df,old_df])
+    return df
+
+
+def legacy_transform_categorical_vars(df):
+    '''
+    map_categorical_vars before the vectorized collapse_rare_levels: the
+    split/concat level collapsing followed by drop_duplicates.
+    '''
+    df = legacy_collapse_levels(df)
+    df = df.drop_duplicates()
+    return df
+
+
+# implementations compared by benchmark_categorical_vars: the level
+# collapsing alone and the whole transform, which adds drop_duplicates
+categorical_vars_implementations = {
+    'legacy collapse': legacy_collapse_levels,
+    'vectorized collapse': lambda df: collapse_rare_levels(df, categorical_dtypes),
+    'legacy transform': legacy_transform_categorical_vars,
+    'vectorized transform': transform_categorical_vars}
+
+
+def run_categorical_vars(name, n_rows):
+    '''
+    Runs one of categorical_vars_implementations on n_rows synthetic leads
+    with the compact dtypes of 'city_tier_mapped', once untraced and once
+    traced by tracemalloc, building the leads again rather than copying them
+    so that only one copy is in memory. Returns the time in seconds and the
+    peak memory allocated in MB. It is run in a process of its own by
+    benchmark_categorical_vars.
+    '''
+    function = categorical_vars_implementations[name]
+    df = make_leads(n_rows, compact=True)
+    start = time.perf_counter()
+    function(df)
+    elapsed = time.perf_counter() - start
+    df = make_leads(n_rows, compact=True)
+    tracemalloc.start()
+    function(df)
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def benchmark_categorical_vars(row_counts=(10_000, 100_000, 1_000_000, 10_000_000)):
+    '''
+    This function compares the time and peak memory of the legacy split/concat
+    level collapsing with collapse_rare_levels, alone and followed by the
+    drop_duplicates of map_categorical_vars, on synthetic leads with the
+    compact dtypes of 'city_tier_mapped'. Every run is made in a process of
+    its own, a run killed for lack of memory is reported as such.
+
+    Results on a 1 cpu / 5 GB machine (time, peak memory):
+
+        leads   legacy collapse   vectorized collapse   legacy transform   vectorized transform
+        10k     0.03s,   2 MB     0.01s,   1 MB         0.04s,   5 MB      0.02s,   4 MB
+        100k    0.08s,  25 MB     0.05s,   7 MB         0.16s,  46 MB      0.13s,  38 MB
+        1M      0.68s, 249 MB     0.53s,  70 MB         1.96s, 467 MB      1.34s, 387 MB
+        10M     out of memory     6.87s, 704 MB         out of memory      out of memory
+
+    The vectorized collapsing is faster at every size, but the gain shrinks
+    from 100k leads up as the full-width drop_duplicates, which factorizes
+    all the columns at once (~360 B/lead), takes most of the time and
+    memory of the transform: at 10M leads it does not fit in 5 GB with either
+    collapsing. Timed under tracemalloc the vectorized collapsing looks
+    several times slower than the legacy one from 10k leads up, as the cast to
+    the categorical dtype allocates many small objects, which is why the
+    times are taken in a run which is not traced.
+
+
+    INPUTS
+        row_counts : number of leads to benchmark with
+
+
+    OUTPUT
+        Prints one line per implementation and row count
+
+
+    SAMPLE USAGE
+        benchmark_categorical_vars(row_counts=[1_000_000])
+    '''
+    for n_rows in row_counts:
+        for name in categorical_vars_implementations:
+            try:
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    elapsed, peak = executor.submit(run_categorical_vars, name, n_rows).result()
+            except BrokenProcessPool:
+                print(f'{name:>20} categorical vars {n_rows:>10} rows: out of memory')
+                continue
+            print(f'{name:>20} categorical vars {n_rows:>10} rows: {elapsed:7.2f}s, peak {peak:8.1f} MB')
+
+###############################################################################
+# Define the benchmark of the interaction aggregation
+# ##############################################################################
+
+
+def legacy_transform_interactions(df):
+    '''
+    melt/merge/pivot_table implementation interactions_mapping used before
+    the matrix product, kept as the benchmark baseline.
+    '''
+    df = df.drop_duplicates()
+    df_event_mapping = pd.read_csv(INTERACTION_MAPPING,index_col=[0])
+    df_unpivot=pd.melt(df,id_vars=INDEX_COLUMNS_TRAINING,var_name='interaction_type',value_name='interaction_value')
+    df_unpivot['interaction_value'] = df_unpivot['interaction_value'].fillna(0)
+    df=pd.merge(df_unpivot,df_event_mapping,how='left',on='interaction_type')
+    df = df.drop('interaction_type',axis=1)
+    df_pivot = df.pivot_table(values='interaction_value', index=INDEX_COLUMNS_INFERENCE, columns='interaction_mapping', aggfunc='sum')
+    df_pivot = df_pivot.reset_index()
+    return df_pivot
+
+
+def benchmark_interactions(row_counts=(100_000, 250_000)):
+    '''
+    This function compares the time and peak memory of the legacy
+    melt/merge/pivot_table interaction aggregation with transform_interactions
+    on synthetic leads.
+
+
+    INPUTS
+        row_counts : number of leads to benchmark with
+
+
+    OUTPUT
+        Prints one line per implementation and row count
+
+
+    SAMPLE USAGE
+        benchmark_interactions(row_counts=[100_000])
+    '''
+    for n_rows in row_counts:
+        df = make_leads(n_rows)
+        for name, function in [('legacy', legacy_transform_interactions),
+                               ('matrix', transform_interactions)]:
+            elapsed, peak = measure(function, df.copy())
+            print(f'{name:>10} interactions {n_rows:>10} rows: {elapsed:7.2f}s, peak {peak:8.1f} MB')
+
+###############################################################################
+# Define the benchmark of the sqlite writes and reads
+# ##############################################################################
+
+
+def legacy_write(db_file_path, df):
+    '''
+    Default connection and DataFrame.to_sql, i.e. how the tables were written
+    before connection.py, kept as the benchmark baseline.
+    '''
+    conn = sqlite3.connect(db_file_path)
+    df.to_sql('loaded_data', con=conn, if_exists='replace', index=False)
+    pd.read_sql('select * from loaded_data', conn)
+    conn.close()
+
+
+def tuned_write(db_file_path, df):
+    '''
+    Tuned connection of get_connection and the executemany bulk writer.
+    '''
+    with get_connection(db_file_path) as conn:
+        write_table(conn, 'loaded_data', df)
+        pd.read_sql('select * from loaded_data', conn)
+
+
+def benchmark_sqlite_writes(row_counts=(250_000, 1_000_000)):
+    '''
+    This function compares the throughput of writing and reading back
+    synthetic leads with a default sqlite connection and to_sql against the
+    tuned connection and bulk writer of connection.py. Every run uses a new
+    db file in a temporary directory.
+
+
+    INPUTS
+        row_counts : number of leads to benchmark with
+
+
+    OUTPUT
+        Prints one line per implementation and row count
+
+
+    SAMPLE USAGE
+        benchmark_sqlite_writes(row_counts=[250_000])
+    '''
+    for n_rows in row_counts:
+        df = make_leads(n_rows)
+        for name, function in [('to_sql', legacy_write), ('tuned', tuned_write)]:
+            with tempfile.TemporaryDirectory() as directory:
+                start = time.perf_counter()
+                function(os.path.join(directory, 'benchmark.db'), df)
+                elapsed = time.perf_counter() - start
+            print(f'{name:>10} sqlite write+read {n_rows:>10} rows: {elapsed:7.2f}s, '
+                  f'{n_rows / elapsed:10.0f} rows/sec')
+
+###############################################################################
+# Define the benchmark of the compact dtypes
+# ##############################################################################
+
+
+def legacy_encode(df):
+    '''
+    get_dummies on the object/float64 columns, as encode_features did before
+    the compact dtypes.
+    '''
+    return [pd.get_dummies(df[feature]).add_prefix(feature+'_') for feature in encoding_dtypes]
+
+
+def compact_encode(df):
+    '''
+    get_dummies on the categorical codes, as encode_features did before the
+    OneHotEncoder of encoding.py.
+    '''
+    return [pd.get_dummies(df[feature].astype(dtype), prefix=feature, dtype='int8')
+            for feature, dtype in encoding_dtypes.items()]
+
+
+def benchmark_dtypes(row_counts=(1_000_000,)):
+    '''
+    This function compares the memory per lead of the 'categorical_variables_mapped'
+    and 'model_input' tables and the time taken to one hot encode model_input
+    with the legacy object/float64 columns and with the compact dtypes of
+    schema.py, on synthetic leads.
+
+
+    INPUTS
+        row_counts : number of leads to benchmark with
+
+
+    OUTPUT
+        Prints one line per dtype policy and row count
+
+
+    SAMPLE USAGE
+        benchmark_dtypes(row_counts=[100_000])
+    '''
+    for n_rows in row_counts:
+        df = make_leads(n_rows)
+        df[interaction_columns] = df[interaction_columns].fillna(0)
+        legacy = legacy_transform_categorical_vars(df.copy()).reset_index(drop=True)
+        compact = collapse_rare_levels(compact_dtypes(df, numeric_dtypes), categorical_dtypes)
+        for name, table in [('legacy', legacy), ('compact', compact)]:
+            table_bytes = table.memory_usage(deep=True).sum() / n_rows
+            model_input = table[model_input_schema]
+            model_input_bytes = model_input.memory_usage(deep=True).sum() / n_rows
+            encode = legacy_encode if name == 'legacy' else compact_encode
+            elapsed, peak = measure(encode, model_input)
+            print(f'{name:>10} dtypes {n_rows:>10} rows: {table_bytes:6.0f} B/lead, '
+                  f'model_input {model_input_bytes:5.0f} B/lead, encode {elapsed:6.2f}s, peak {peak:7.1f} MB')
+
+###############################################################################
+# Define the benchmark of the sql pushdown execution mode
+# ##############################################################################
+
+
+def pandas_stages(conn):
+    '''
+    map_city_tier, map_categorical_vars and interactions_mapping with the
+    'pandas' EXECUTION_MODE and the sqlite staging backend.
+    '''
+    stage = SqliteStagingBackend(conn)
+    stage.write('city_tier_mapped', transform_city_tier(compact_dtypes(stage.read('loaded_data'), numeric_dtypes)))
+    stage.write('categorical_variables_mapped', transform_categorical_vars(
+        compact_dtypes(stage.read('city_tier_mapped'), numeric_dtypes)))
+    df = compact_dtypes(stage.read('categorical_variables_mapped', columns=required_columns(model_input_schema)[1:]),
+                        numeric_dtypes)
+    write_table(conn, 'model_input', build_model_input(transform_interactions(df, columns=model_input_schema)))
+
+
+def sql_stages(conn):
+    '''
+    The same tables built with the 'sql' EXECUTION_MODE.
+    '''
+    pushdown(conn, 'loaded_data', 'city_tier_mapped')
+    pushdown(conn, 'city_tier_mapped', 'categorical_variables_mapped')
+    pushdown(conn, 'categorical_variables_mapped', 'model_input')
+    conn.commit()
+
+
+def benchmark_sql_pushdown(row_counts=(250_000, 1_000_000)):
+    '''
+    This function compares the time taken to build 'city_tier_mapped',
+    'categorical_variables_mapped' and 'model_input' from a 'loaded_data'
+    table of synthetic leads with the pandas transforms and with the
+    INSERT ... SELECT statements of sql_transforms.py, in a temporary db.
+
+
+    INPUTS
+        row_counts : number of leads to benchmark with
+
+
+    OUTPUT
+        Prints one line per execution mode and row count
+
+
+    SAMPLE USAGE
+        benchmark_sql_pushdown(row_counts=[250_000])
+    '''
+    for n_rows in row_counts:
+        df = make_leads(n_rows).drop('city_tier', axis=1)
+        cities = np.array(list(city_tier_mapping) + ['unknown city'], dtype=object)
+        df.insert(1, 'city_mapped', cities[np.random.default_rng(0).integers(0, len(cities), n_rows)])
+        df[interaction_columns] = df[interaction_columns].fillna(0)
+        df = compact_dtypes(df, numeric_dtypes)
+        with tempfile.TemporaryDirectory() as directory:
+            with get_connection(os.path.join(directory, 'benchmark.db')) as conn:
+                write_table(conn, 'loaded_data', df)
+                for name, function in [('pandas', pandas_stages), ('sql', sql_stages)]:
+                    start = time.perf_counter()
+                    function(conn)
+                    elapsed = time.perf_counter() - start
+                    rows = conn.execute('SELECT COUNT(*) FROM model_input').fetchone()[0]
+                    print(f'{name:>10} execution {n_rows:>10} rows: {elapsed:7.2f}s, {rows} model_input rows')
+
+
+###############################################################################
+# Define the benchmark of the date-partitioned transforms
+# ##############################################################################
+
+
+def benchmark_partitions(n_rows=1_000_000, worker_counts=(1, 2, 4)):
+    '''
+    This function measures the time taken by transform_partitions to build
+    the month partitions of 'city_tier_mapped', 'categorical_variables_mapped'
+    and model_input from a 'loaded_data' table of synthetic leads (about 23
+    months for 1M leads) with a growing number of worker processes, in a
+    temporary parquet staging directory. The speedup is bounded by the number
+    of cpus of the machine.
+
+
+    INPUTS
+        n_rows : number of leads to benchmark with
+        worker_counts : numbers of worker processes to benchmark with
+
+
+    OUTPUT
+        Prints one line per number of workers
+
+
+    SAMPLE USAGE
+        benchmark_partitions(worker_counts=[1, 8])
+    '''
+    df = make_leads(n_rows).drop('city_tier', axis=1)
+    cities = np.array(list(city_tier_mapping) + ['unknown city'], dtype=object)
+    df.insert(1, 'city_mapped', cities[np.random.default_rng(0).integers(0, len(cities), n_rows)])
+    df[interaction_columns] = df[interaction_columns].fillna(0)
+    df = compact_dtypes(df, numeric_dtypes)
+    months = month_partitions(df['created_date'])
+    with tempfile.TemporaryDirectory() as directory:
+        stage = ArrowStagingBackend(directory, 'parquet')
+        for month in months:
+            stage.write_partition('loaded_data', month, df[df['created_date'].str.startswith(month)])
+        baseline = None
+        for workers in worker_counts:
+            start = time.perf_counter()
+            transform_partitions(stage, months, workers=workers)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f'{workers:>3} workers {len(months):>3} months {n_rows:>10} rows: '
+                  f'{elapsed:7.2f}s, speedup {baseline / elapsed:4.2f}x ({os.cpu_count()} cpus)')
+
+
+###############################################################################
+# Define the benchmark of the deduplication of the leads
+# ##############################################################################
+
+
+def benchmark_dedup(loaded_rows=(250_000, 1_000_000), batch_rows=50_000):
+    '''
+    This function compares the time taken to deduplicate a batch of new leads
+    when 'loaded_rows' leads are already loaded: with a full-width
+    drop_duplicates over all the raw leads, and with a lookup of the
+    fingerprints of the batch in the dedup index, in a temporary db.
+
+
+    INPUTS
+        loaded_rows : numbers of leads already loaded
+        batch_rows : number of leads of the new batch, 1% of them duplicated
+
+
+    OUTPUT
+        Prints one line per implementation and number of leads loaded
+
+
+    SAMPLE USAGE
+        benchmark_dedup(loaded_rows=[250_000])
+    '''
+    for n_rows in loaded_rows:
+        df = make_leads(n_rows + batch_rows).drop('city_tier', axis=1)
+        df.insert(1, 'city_mapped', 'mumbai')
+        df[interaction_columns] = df[interaction_columns].fillna(0)
+        df = compact_dtypes(df, numeric_dtypes)
+        loaded, batch = df.iloc[:n_rows], df.iloc[n_rows:]
+        batch = pd.concat([batch, batch.iloc[:batch_rows // 100]], ignore_index=True)
+        with tempfile.TemporaryDirectory() as directory:
+            with get_connection(os.path.join(directory, 'benchmark.db')) as conn:
+                create_dedup_index(conn, replace=True)
+                for start in range(0, n_rows, batch_rows):
+                    deduplicate(conn, loaded.iloc[start:start + batch_rows])
+                conn.commit()
+                timings = [('drop_duplicates', lambda: pd.concat([loaded, batch]).drop_duplicates()),
+                           ('index', lambda: deduplicate(conn, batch))]
+                for name, function in timings:
+                    start = time.perf_counter()
+                    rows = function().shape[0]
+                    elapsed = time.perf_counter() - start
+                    print(f'{name:>15} dedup {n_rows:>10} loaded + {batch.shape[0]} new rows: '
+                          f'{elapsed:7.2f}s, {rows} rows kept')
+                conn.rollback()
+
+
+###############################################################################
+# Define the benchmark of the one hot encoding of encode_features
+# ##############################################################################
+
+
+def legacy_encode_features(df, features_to_encode, encoded_columns):
+    '''
+    get_dummies/concat per feature and column by column copy into an empty
+    dataframe, as encode_features did before the OneHotEncoder, kept as the
+    benchmark baseline.
+    '''
+    df_encoded = pd.DataFrame(columns=encoded_columns)
+    df_placeholder= pd.DataFrame()
+    for feature in features_to_encode:
+        encode = pd.get_dummies(df[feature].astype(encoding_dtypes[feature]), prefix=feature, dtype='int8')
+        df_placeholder = pd.concat([df_placeholder,encode],axis=1)
+    for feature in encoded_columns:
+        if feature in df_placeholder.columns:
+            df_encoded[feature]= df_placeholder[feature]
+        if feature in df.columns:
+            df_encoded[feature]=df[feature]
+    return df_encoded.fillna(0)
+
+
+def benchmark_one_hot(row_counts=(100_000, 1_000_000)):
+    '''
+    This function compares the time and peak memory of the legacy one hot
+    encoding loop with OneHotEncoder.transform on a synthetic model_input,
+    whose levels are the categories of encoding_dtypes, and checks that both
+    return the same values.
+
+
+    INPUTS
+        row_counts : number of leads to benchmark with
+
+
+    OUTPUT
+        Prints one line per implementation and row count
+
+
+    SAMPLE USAGE
+        benchmark_one_hot(row_counts=[100_000])
+    '''
+    rng = np.random.default_rng(0)
+    features_to_encode = list(encoding_dtypes)
+    numeric_columns = ['total_leads_droppped', 'referred_lead', 'app_complete_flag']
+    encoded_columns = numeric_columns + [f'{feature}_{level}' for feature, dtype in encoding_dtypes.items()
+                                         for level in dtype.categories]
+    encoder = OneHotEncoder(features_to_encode, encoded_columns)
+    for n_rows in row_counts:
+        df = pd.DataFrame({column: rng.integers(0, 2, n_rows).astype('int8') for column in numeric_columns})
+        for feature, dtype in encoding_dtypes.items():
+            df[feature] = pd.Categorical.from_codes(rng.integers(0, len(dtype.categories), n_rows), dtype=dtype)
+        df = compact_dtypes(df, numeric_dtypes)
+        legacy = legacy_encode_features(df, features_to_encode, encoded_columns)
+        equal = np.array_equal(legacy.to_numpy(dtype='int16'), encoder.encode(df))
+        for name, function in [('legacy', legacy_encode_features), ('encoder', None)]:
+            if function is None:
+                elapsed, peak = measure(encoder.transform, df)
+            else:
+                elapsed, peak = measure(function, df, features_to_encode, encoded_columns)
+            print(f'{name:>10} one hot {n_rows:>10} rows: {elapsed:7.2f}s, peak {peak:8.1f} MB, '
+                  f'{len(encoded_columns)} columns, same values {equal}')
+
+
+###############################################################################
+# Define the benchmark of the sparse feature matrices
+# ##############################################################################
+
+
+def benchmark_sparse_features(n_rows=200_000, level_counts=(None, 250)):
+    '''
+    This function compares the size of the encoded features of a synthetic
+    model_input stored as a dense 'features' table of the db, as a dense .npy
+    matrix and as a CSR matrix (see feature_store.py), and the time taken to
+    encode and publish them. The features have the levels of encoding_dtypes
+    or, to show how the sizes grow with the vocabulary, 'level_counts' levels
+    each.
+
+
+    INPUTS
+        n_rows : number of leads to benchmark with
+        level_counts : number of levels of every encoded feature, None for
+                       the levels of encoding_dtypes
+
+
+    OUTPUT
+        Prints one line per storage and number of levels
+
+
+    SAMPLE USAGE
+        benchmark_sparse_features(level_counts=[1000])
+    '''
+    rng = np.random.default_rng(0)
+    numeric_columns = ['total_leads_droppped', 'referred_lead']
+    for level_count in level_counts:
+        dtypes = encoding_dtypes if level_count is None else \
+            {feature: pd.CategoricalDtype([f'Level{i}' for i in range(level_count)]) for feature in encoding_dtypes}
+        encoded_columns = numeric_columns + [f'{feature}_{level}' for feature, dtype in dtypes.items()
+                                             for level in dtype.categories]
+        encoder = OneHotEncoder(list(dtypes), encoded_columns, dtypes)
+        df = pd.DataFrame({'total_leads_droppped': rng.integers(0, 20, n_rows).astype('int16'),
+                           'referred_lead': rng.integers(0, 2, n_rows).astype('int8')})
+        for feature, dtype in dtypes.items():
+            df[feature] = pd.Categorical.from_codes(rng.integers(0, len(dtype.categories), n_rows), dtype=dtype)
+        with tempfile.TemporaryDirectory() as directory:
+            def dense_table():
+                with get_connection(os.path.join(directory, 'benchmark.db')) as conn:
+                    write_table(conn, 'features', encoder.transform(df).astype('float64'))
+                return os.path.getsize(os.path.join(directory, 'benchmark.db'))
+
+            def dense_matrix():
+                publish_matrix('dense', encoder.transform(df), directory)
+                return open_matrix('dense', directory)[0].nbytes
+
+            def sparse_matrix():
+                publish_sparse_matrix('sparse', encoder.encode_sparse(df), encoder.columns, directory)
+                matrix = open_matrix('sparse', directory)[0]
+                return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+            storages = [('dense table', dense_table), ('dense npy', dense_matrix), ('csr npy', sparse_matrix)]
+            if len(encoded_columns) > 1000:
+                storages = storages[1:]
+            for name, function in storages:
+                start = time.perf_counter()
+                size = function()
+                elapsed = time.perf_counter() - start
+                print(f'{name:>12} {len(encoded_columns):>5} columns {n_rows:>8} rows: {elapsed:6.2f}s, '
+                      f'{size / 2 ** 20:8.1f} MB, {size / n_rows:6.1f} B/lead')
+
+
+if __name__ == '__main__':
+    benchmark_categorical_vars()
+    benchmark_interactions()
+    benchmark_sqlite_writes()
+    benchmark_dtypes()
+    benchmark_sql_pushdown()
+    benchmark_partitions()
+    benchmark_dedup()
+    benchmark_one_hot()
+    benchmark_sparse_features()
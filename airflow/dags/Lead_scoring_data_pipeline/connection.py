@@ -0,0 +1,135 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+import os
+import sqlite3
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from Lead_scoring_data_pipeline.constants import DB_PATH, DB_FILE_NAME, SQLITE_PRAGMAS
+
+###############################################################################
+# Define the connection factory shared by the data, training and inference
+# pipelines
+# ##############################################################################
+
+# the values of the nullable dtypes (e.g. app_complete_flag) are numpy scalars,
+# stored as integers, and pd.NA, stored as NULL
+for numpy_type in (np.int8, np.int16, np.int32, np.int64):
+    sqlite3.register_adapter(numpy_type, int)
+sqlite3.register_adapter(type(pd.NA), lambda value: None)
+
+
+@contextmanager
+def get_connection(db_file_path=None):
+    '''
+    This function opens a connection to the sqlite db with the pragmas of
+    SQLITE_PRAGMAS applied and closes it when the block exits, even if the
+    block raises. Changes which are not committed are rolled back.
+
+
+    INPUTS
+        db_file_path : path of the db file, DB_PATH/DB_FILE_NAME by default
+        SQLITE_PRAGMAS : dictionary of pragma -> value set on the connection
+
+
+    OUTPUT
+        Yields the open sqlite3 connection
+
+
+    SAMPLE USAGE
+        with get_connection() as conn:
+            df = pd.read_sql('select * from model_input', conn)
+    '''
+    if db_file_path is None:
+        db_file_path = os.path.join(DB_PATH, DB_FILE_NAME)
+    conn = sqlite3.connect(db_file_path)
+    try:
+        for pragma, value in SQLITE_PRAGMAS.items():
+            conn.execute(f'PRAGMA {pragma}={value}')
+        yield conn
+    finally:
+        conn.close()
+
+###############################################################################
+# Define the bulk writers
+# ##############################################################################
+
+
+def table_exists(conn, table_name):
+    '''
+    Returns True if the table is present in the db.
+    '''
+    query = "SELECT name FROM sqlite_master WHERE type='table' AND name=?"
+    return conn.execute(query, (table_name,)).fetchone() is not None
+
+
+@contextmanager
+def table_writer(conn, table_name, append=False):
+    '''
+    This function yields a function that writes a chunk (dataframe) to the
+    table with a single executemany per chunk. All the chunks are written in
+    one explicit transaction which is committed when the block exits and
+    rolled back if anything fails, so the table is either fully written or
+    left as it was. The table is replaced unless append is set, in which case
+    it is created from the first chunk if it does not exist yet.
+
+
+    INPUTS
+        conn : connection returned by get_connection
+        table_name : name of the table to write
+        append : if True the chunks are appended to the table
+
+
+    OUTPUT
+        Yields a function taking a dataframe
+
+
+    SAMPLE USAGE
+        with table_writer(conn, 'loaded_data') as write_chunk:
+            for chunk in pd.read_csv(path, chunksize=50000):
+                write_chunk(chunk)
+    '''
+    created = append and table_exists(conn, table_name)
+
+    def write_chunk(chunk):
+        nonlocal created
+        if not created:
+            conn.execute(pd.io.sql.get_schema(chunk, table_name, con=conn))
+            created = True
+        placeholders = ','.join(['?'] * chunk.shape[1])
+        conn.executemany(f'INSERT INTO "{table_name}" VALUES ({placeholders})',
+                         chunk.itertuples(index=False, name=None))
+
+    try:
+        if not conn.in_transaction:
+            conn.execute('BEGIN')
+        if not append:
+            conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+        yield write_chunk
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def write_table(conn, table_name, df, append=False):
+    '''
+    Writes the dataframe to the table in a single transaction, replacing the
+    table unless append is set. Used instead of DataFrame.to_sql.
+    '''
+    with table_writer(conn, table_name, append=append) as write_chunk:
+        write_chunk(df)
+
+
+def drop_table(conn, table_name):
+    '''
+    Drops the table if it exists, e.g. a table an earlier run wrote which the
+    current configuration no longer writes, so that it is not read as current.
+    '''
+    conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+    conn.commit()
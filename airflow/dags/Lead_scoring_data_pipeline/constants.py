@@ -4,7 +4,55 @@ DB_FILE_NAME = 'utils_output.db'
 UNIT_TEST_DB_FILE_NAME = '/home/airflow/dags/Lead_scoring_data_pipeline/unit_test_cases.db'
 DATA_DIRECTORY = "/home/airflow/dags/Lead_scoring_data_pipeline/data/"
 LEAD_SCORING_CSV = 'leadscoring_inference.csv'
+# backend used to store the intermediate tables of the pipeline: 'sqlite', 'parquet' or 'arrow'
+STAGING_BACKEND = 'parquet'
+STAGING_DIRECTORY = '/home/airflow/dags/Lead_scoring_data_pipeline/staging/'
+# directory of the encoded feature matrices (.npy files and their json manifests)
+# published by the encode_features tasks, see feature_store.py
+FEATURE_STORE_DIRECTORY = '/home/airflow/dags/Lead_scoring_data_pipeline/features/'
+# 'pandas' runs the transforms of transforms.py on dataframes, 'sql' runs the
+# equivalent INSERT ... SELECT statements of sql_transforms.py inside the db so
+# the data never leaves sqlite. 'sql' requires STAGING_BACKEND = 'sqlite'
+EXECUTION_MODE = 'pandas'
+# run map_city_tier, map_categorical_vars and interactions_mapping as a single task
+FUSED_TRANSFORMS = False
+# save the output of every transform when they are run as a single task
+EMIT_INTERMEDIATE_TABLES = True
+# save 'interactions_mapped' on every run. If False it is only built when it
+# is requested with get_interactions_mapped() and the interaction types, which
+# model_input does not use, are not computed
+MATERIALIZE_INTERACTIONS = False
+# run the transforms of every month of leads (by 'created_date') in a process
+# pool, writing every table of the staging backend by month (see partitions.py).
+# Requires STAGING_BACKEND = 'parquet' or 'arrow'
+PARTITIONED_TRANSFORMS = False
+# number of processes of the pool, None means one per cpu
+PARTITION_WORKERS = None
+# only process the leads created after the watermark (latest 'created_date'
+# processed) of every table and append them, instead of skipping the tables
+# which already exist
+INCREMENTAL_MODE = False
+# in INCREMENTAL_MODE the leads created up to this many days before the
+# watermark of 'loaded_data' are read again, and those which are not loaded
+# yet (see dedup_index.py) are loaded, so that the leads reaching the csv late
+# are not dropped. The tables built from 'loaded_data' are then built again
+# from scratch. None reads all the leads of the csv
+INCREMENTAL_LOOKBACK_DAYS = 7
+# number of rows read from the csv and written to the db at a time
+LOAD_CHUNK_SIZE = 50000
+# number of rows, picked at random, whose values are checked by
+# data_validation_checks.py. None checks all the rows in a single streaming
+# pass of LOAD_CHUNK_SIZE rows at a time
+VALIDATION_SAMPLE_SIZE = 10000
+# pragmas set on every connection opened with connection.get_connection. WAL
+# lets the inference tasks read while a writer is active, NORMAL only syncs at
+# checkpoints (safe with WAL), cache_size is in KB when negative (64MB) and
+# mmap_size in bytes (256MB)
+SQLITE_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -65536,
+                  'mmap_size': 268435456, 'temp_store': 'MEMORY'}
 INTERACTION_MAPPING = '/home/airflow/dags/Lead_scoring_data_pipeline/mapping/interaction_mapping.csv'
+CITY_TIER_MAPPING = '/home/airflow/dags/Lead_scoring_data_pipeline/mapping/city_tier_mapping.py'
+SIGNIFICANT_CATEGORICAL_LEVEL = '/home/airflow/dags/Lead_scoring_data_pipeline/mapping/significant_categorical_level.py'
 INDEX_COLUMNS_TRAINING = ['created_date', 'first_platform_c',
        'first_utm_medium_c', 'first_utm_source_c', 'total_leads_droppped', 'city_tier',
        'referred_lead', 'app_complete_flag']
@@ -14,7 +62,5 @@ INDEX_COLUMNS_INFERENCE = ['created_date', 'city_tier', 'first_platform_c',
 NOT_FEATURES = ['created_date', 'assistance_interaction', 'career_interaction',
                 'payment_interaction', 'social_interaction', 'syllabus_interaction']
 
-SCHEMA = './schema.py'
-
 # LEAD_SCORING_CSV = 'leadscoring.csv'
 
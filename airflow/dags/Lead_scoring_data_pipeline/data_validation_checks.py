@@ -1,80 +1,239 @@
 """
 Import necessary modules
-############################################################################## 
+##############################################################################
 """
 
 
+import os
+import time
+
 import pandas as pd
-import sqlite3
-from Lead_scoring_data_pipeline.constants import DB_FILE_NAME, DB_PATH, DATA_DIRECTORY, INTERACTION_MAPPING,NOT_FEATURES, INDEX_COLUMNS_TRAINING, INDEX_COLUMNS_INFERENCE, SCHEMA
+from Lead_scoring_data_pipeline.constants import DATA_DIRECTORY, LEAD_SCORING_CSV, LOAD_CHUNK_SIZE, VALIDATION_SAMPLE_SIZE
+from Lead_scoring_data_pipeline.schema import raw_data_schema, optional_columns, loaded_data_types, model_input_types, raw_data_expectations, model_input_expectations
+from Lead_scoring_data_pipeline.connection import get_connection
+from Lead_scoring_data_pipeline.staging import get_staging_backend, SqliteStagingBackend
+###############################################################################
+# Define the validation engine used by the checks. The column names and types
+# are read from the table metadata (or the csv header) and the values are
+# checked on a sample, so a check does not depend on the size of the table
+# ##############################################################################
+
+
+def column_violations(source, columns, expected_types, column_types=None):
+    '''
+    Compares the columns of a table (or csv) with the ones of its schema. The
+    columns of optional_columns may be missing.
+
+
+    INPUTS
+        source : name of the table or file, used in the messages
+        columns : columns present in the table
+        expected_types : dictionary of column name -> expected type affinity
+        column_types : dictionary of column name -> type affinity of the
+                       table, None if the types are not known (csv)
+
+
+    OUTPUT
+        List of the violations found, as messages
+
+
+    SAMPLE USAGE
+        violations = column_violations('model_input', stage.columns('model_input'), model_input_types)
+    '''
+    violations = []
+    missing = [column for column in expected_types if column not in columns and column not in optional_columns]
+    unexpected = [column for column in columns if column not in expected_types]
+    if missing:
+        violations.append(f'{source}: missing columns {missing}')
+    if unexpected:
+        violations.append(f'{source}: unexpected columns {unexpected}')
+    if column_types is not None:
+        for column, expected_type in expected_types.items():
+            if column in column_types and column_types[column] != expected_type:
+                violations.append(f"{source}: '{column}' is stored as {column_types[column]}, expected {expected_type}")
+    return violations
+
+
+def update_value_stats(stats, df, expectations):
+    '''
+    Adds the rows of the dataframe to the running statistics of every column
+    having expectations: number of rows and nulls, min, max and the values
+    which are not allowed. Called once on a sample or once per chunk of a
+    streaming pass.
+
+
+    INPUTS
+        stats : dictionary of column name -> statistics, updated in place
+        df : rows to add
+        expectations : dictionary of column name -> expectations, see
+                       raw_data_expectations in schema.py
+
+
+    OUTPUT
+        The updated stats
+
+
+    SAMPLE USAGE
+        stats = update_value_stats({}, df, model_input_expectations)
+    '''
+    for column, expectation in expectations.items():
+        if column not in df.columns:
+            continue
+        column_stats = stats.setdefault(column, {'rows': 0, 'nulls': 0, 'min': None, 'max': None, 'unexpected': set()})
+        values = df[column]
+        column_stats['rows'] += values.shape[0]
+        column_stats['nulls'] += int(values.isna().sum())
+        values = values.dropna()
+        if values.empty:
+            continue
+        if 'levels' in expectation:
+            column_stats['unexpected'].update(set(values.unique()) - set(expectation['levels']))
+        if 'min' in expectation or 'max' in expectation:
+            low, high = values.min(), values.max()
+            column_stats['min'] = low if column_stats['min'] is None else min(column_stats['min'], low)
+            column_stats['max'] = high if column_stats['max'] is None else max(column_stats['max'], high)
+    return stats
+
+
+def value_violations(source, stats, expectations):
+    '''
+    Returns the violations, as messages, of the expectations by the statistics
+    built with update_value_stats.
+    '''
+    violations = []
+    for column, column_stats in stats.items():
+        expectation = expectations[column]
+        null_rate = column_stats['nulls'] / max(column_stats['rows'], 1)
+        if null_rate > expectation.get('max_null_rate', 1.0):
+            violations.append(f"{source}: {null_rate:.2%} of '{column}' is null, "
+                              f"at most {expectation['max_null_rate']:.2%} is allowed")
+        if column_stats['unexpected']:
+            levels = sorted(map(str, column_stats['unexpected']))
+            violations.append(f"{source}: unexpected values of '{column}' {levels[:10]}")
+        if 'min' in expectation and column_stats['min'] is not None and column_stats['min'] < expectation['min']:
+            violations.append(f"{source}: '{column}' has values below {expectation['min']} ({column_stats['min']})")
+        if 'max' in expectation and column_stats['max'] is not None and column_stats['max'] > expectation['max']:
+            violations.append(f"{source}: '{column}' has values above {expectation['max']} ({column_stats['max']})")
+    return violations
+
+
+def validate_table(stage, name, expected_types, expectations, sample_size=VALIDATION_SAMPLE_SIZE,
+                   chunksize=LOAD_CHUNK_SIZE):
+    '''
+    This function validates a table of a staging backend. The column names
+    and types are read from the table metadata, the values are checked on
+    sample_size rows picked at random or, if sample_size is None, on all the
+    rows in a single streaming pass of chunksize rows at a time.
+
+
+    INPUTS
+        stage : staging backend holding the table
+        name : name of the table
+        expected_types : dictionary of column name -> expected type affinity
+        expectations : dictionary of column name -> value expectations
+        sample_size : number of rows to check, None for all of them
+        chunksize : number of rows read at a time when all of them are checked
+
+
+    OUTPUT
+        List of the violations found, as messages
+
+
+    SAMPLE USAGE
+        violations = validate_table(stage, 'loaded_data', loaded_data_types, raw_data_expectations)
+    '''
+    column_types = stage.column_types(name)
+    violations = column_violations(name, list(column_types), expected_types, column_types)
+    chunks = stage.scan(name, chunksize) if sample_size is None else [stage.sample(name, sample_size)]
+    stats = {}
+    for chunk in chunks:
+        update_value_stats(stats, chunk, expectations)
+    return violations + value_violations(name, stats, expectations)
+
+
+def report_violations(violations, data_name, elapsed):
+    '''
+    Prints that the data is in line with schema.py, or raises a ValueError
+    listing the violations so that the task fails.
+    '''
+    if violations:
+        raise ValueError(f'{data_name} schema is NOT in line with the schema present in schema.py:\n'
+                         + '\n'.join(violations))
+    print(f'{data_name} schema is in line with the schema present in schema.py ({elapsed * 1000:.0f}ms)')
+
 ###############################################################################
 # Define function to validate raw data's schema
-# ############################################################################## 
+# ##############################################################################
 
-def raw_data_schema_check():
+def raw_data_schema_check(sample_size=VALIDATION_SAMPLE_SIZE):
     '''
     This function check if all the columns mentioned in schema.py are present in
-    leadscoring.csv file or not.
+    leadscoring.csv file or not, reading only the header of the file, and
+    validates the types and values of the 'loaded_data' table built from it.
+
 
-   
     INPUTS
-        DATA_DIRECTORY : path of the directory where 'leadscoring.csv' 
+        DATA_DIRECTORY : path of the directory where 'leadscoring.csv'
                         file is present
-        raw_data_schema : schema of raw data in the form oa list/tuple as present 
+        raw_data_schema : schema of raw data in the form oa list/tuple as present
                           in 'schema.py'
+        loaded_data_types, raw_data_expectations : expected types and values
+                          of 'loaded_data' as present in 'schema.py'
+        sample_size : number of rows whose values are checked, None for all
 
     OUTPUT
-        If the schema is in line then prints 
-        'Raw datas schema is in line with the schema present in schema.py' 
-        else prints
-        'Raw datas schema is NOT in line with the schema present in schema.py'
+        If the schema is in line then prints
+        'Raw datas schema is in line with the schema present in schema.py'
+        else raises a ValueError listing the violations found, e.g.
+        'loaded_data: missing columns [...]'
+
 
-    
     SAMPLE USAGE
-        raw_data_schema_check
+        raw_data_schema_check()
     '''
-    conn = sqlite3.connect(DB_PATH+DB_FILE_NAME)
-    if conn:
-        df = pd.read_sql("select * from loaded_data",conn)
-        if(set(df.columns)==set(SCHEMA)):
-            print("Raw datas schema is in line with the schema present in schema.py")
-        else:
-            print("Raw datas schema is NOT in line with the schema present in schema.py")
+    start = time.perf_counter()
+    header = pd.read_csv(os.path.join(DATA_DIRECTORY, LEAD_SCORING_CSV), index_col=[0], nrows=0).columns
+    violations = column_violations(LEAD_SCORING_CSV, list(header), {column: None for column in raw_data_schema})
+    with get_connection() as conn:
+        violations += validate_table(get_staging_backend(conn), 'loaded_data', loaded_data_types,
+                                     raw_data_expectations, sample_size)
+    report_violations(violations, 'Raw datas', time.perf_counter() - start)
+
 
-   
 
 ###############################################################################
 # Define function to validate model's input schema
-# ############################################################################## 
+# ##############################################################################
 
-def model_input_schema_check():
+def model_input_schema_check(sample_size=VALIDATION_SAMPLE_SIZE):
     '''
-    This function check if all the columns mentioned in model_input_schema in 
-    schema.py are present in table named in 'model_input' in db file.
+    This function check if all the columns mentioned in model_input_schema in
+    schema.py are present in table named in 'model_input' in db file, reading
+    only the table metadata, and validates the types and values of the table.
+
 
-   
     INPUTS
         DB_FILE_NAME : Name of the database file
         DB_PATH : path where the db file should be present
-        model_input_schema : schema of models input data in the form oa list/tuple
-                          present as in 'schema.py'
+        model_input_types, model_input_expectations : expected types and
+                          values of the columns of model_input_schema as
+                          present in 'schema.py'
+        sample_size : number of rows whose values are checked, None for all
 
     OUTPUT
-        If the schema is in line then prints 
+        If the schema is in line then prints
         'Models input schema is in line with the schema present in schema.py'
-        else prints
-        'Models input schema is NOT in line with the schema present in schema.py'
-    
+        else raises a ValueError listing the violations found, e.g.
+        "model_input: unexpected values of 'city_tier' ['4']"
+
     SAMPLE USAGE
-        raw_data_schema_check
+        model_input_schema_check()
     '''
-    conn = sqlite3.connect(DB_PATH+DB_FILE_NAME)
-    if conn:
-        df = pd.read_sql("select * from model_input",conn)
-        if(set(df.columns)==set(SCHEMA)):
-            print("Models input schema is in line with the schema present in schema.p")
-        else:
-            print("Models input schema is NOT in line with the schema present in schema.py")
-
-    
-    
+    start = time.perf_counter()
+    with get_connection() as conn:
+        violations = validate_table(SqliteStagingBackend(conn), 'model_input', model_input_types,
+                                    model_input_expectations, sample_size)
+    report_violations(violations, 'Models input', time.perf_counter() - start)
+
+
+
@@ -0,0 +1,96 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+import json
+
+import pandas as pd
+
+DEDUP_INDEX_TABLE = 'lead_fingerprints'
+
+###############################################################################
+# Define the functions to fingerprint the leads and keep the fingerprints of
+# the leads loaded so far in the db
+# ##############################################################################
+
+
+def lead_fingerprints(df):
+    '''
+    This function returns a 64-bit fingerprint of every lead, computed with
+    a vectorized hash of all its columns. The leads are hashed as they are
+    loaded, before any mapping, so only the leads which are loaded twice are
+    dropped and the index does not depend on the mapping files. The leads
+    which only differ before 'city_mapped' and the insignificant levels are
+    mapped are dropped by map_categorical_vars.
+
+
+    INPUTS
+        df : leads as they are loaded into 'loaded_data', with the compact
+             dtypes of numeric_dtypes
+
+
+    OUTPUT
+        Series of int64 fingerprints, with the index of df
+
+
+    SAMPLE USAGE
+        fingerprints = lead_fingerprints(chunk)
+    '''
+    return pd.util.hash_pandas_object(df, index=False).astype('int64')
+
+
+def create_dedup_index(conn, replace=False):
+    '''
+    Creates the table holding the fingerprint of every lead of 'loaded_data'
+    if it does not exist. The fingerprint is the rowid of the table, so a
+    lookup is a single b-tree search. If replace is set the fingerprints
+    recorded so far are dropped, as 'loaded_data' is loaded from scratch. The
+    change is not committed so that it is part of the same transaction as
+    the data loaded.
+    '''
+    if not conn.in_transaction:
+        conn.execute('BEGIN')
+    if replace:
+        conn.execute(f'DROP TABLE IF EXISTS {DEDUP_INDEX_TABLE}')
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {DEDUP_INDEX_TABLE} (fingerprint INTEGER PRIMARY KEY)')
+
+
+def deduplicate(conn, df):
+    '''
+    This function drops the leads of the batch which are duplicates of an
+    earlier lead of the batch or of a lead already loaded, and records the
+    fingerprints of the remaining ones in the index. Only the fingerprints
+    of the batch are looked up, so the cost grows with the size of the batch
+    and not with the number of leads loaded so far. The change is not
+    committed, like create_dedup_index.
+
+
+    INPUTS
+        conn : connection returned by connection.get_connection
+        df : batch of leads to load, see lead_fingerprints
+
+
+    OUTPUT
+        The leads of the batch which were not loaded yet, in their order
+
+
+    SAMPLE USAGE
+        create_dedup_index(conn)
+        chunk = deduplicate(conn, chunk)
+    '''
+    if df.shape[0] == 0:
+        return df
+    fingerprints = lead_fingerprints(df)
+    new = ~fingerprints.duplicated().to_numpy()
+    # the fingerprints are passed as a single json parameter so that the
+    # statement is the same for every batch and compiled once, instead of
+    # caching one statement per batch
+    values = json.dumps(fingerprints[new].tolist())
+    loaded = {row[0] for row in conn.execute(f'SELECT fingerprint FROM {DEDUP_INDEX_TABLE} '
+                                             f'WHERE fingerprint IN (SELECT value FROM json_each(?))',
+                                             (values,))}
+    if loaded:
+        new &= ~fingerprints.isin(loaded).to_numpy()
+    conn.executemany(f'INSERT INTO {DEDUP_INDEX_TABLE} VALUES (?)', ((int(value),) for value in fingerprints[new]))
+    return df[new]
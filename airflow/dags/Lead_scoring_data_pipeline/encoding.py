@@ -0,0 +1,174 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from Lead_scoring_data_pipeline.schema import encoding_dtypes
+
+###############################################################################
+# Define the one hot encoder shared by the training and inference pipelines
+# ##############################################################################
+
+
+class OneHotEncoder:
+    '''
+    Fixed-vocabulary one hot encoder of the encode_features tasks. The
+    output columns are fixed when the encoder is built: every level of the
+    categories of 'dtypes' is mapped once to the index of its column
+    '<feature>_<level>' in 'encoded_columns', or to -1 if the column is not
+    part of the output. Encoding a dataframe then fills a preallocated array
+    with a single scatter of the category codes. Columns of 'encoded_columns'
+    present in the dataframe (e.g. 'total_leads_droppped') are copied as
+    they are, the other columns are 0, like get_dummies followed by fillna(0).
+
+
+    INPUTS
+        features_to_encode : features to one hot encode, FEATURES_TO_ENCODE
+        encoded_columns : columns of the output, ONE_HOT_ENCODED_FEATURES
+        dtypes : dictionary of feature -> CategoricalDtype holding its levels
+
+
+    SAMPLE USAGE
+        encoder = OneHotEncoder(FEATURES_TO_ENCODE, ONE_HOT_ENCODED_FEATURES)
+        df_encoded = encoder.transform(model_input_data)
+    '''
+    def __init__(self, features_to_encode, encoded_columns, dtypes=encoding_dtypes):
+        self.columns = list(encoded_columns)
+        self.dtypes = {feature: dtypes[feature] for feature in features_to_encode}
+        column_index = {column: j for j, column in enumerate(self.columns)}
+        # category code -> index of the output column, -1 if not in the output
+        self.lookups = {feature: np.array([column_index.get(f'{feature}_{level}', -1) for level in dtype.categories],
+                                          dtype=np.intp)
+                        for feature, dtype in self.dtypes.items()}
+        encoded = {column for feature, lookup in self.lookups.items() for column in
+                   (self.columns[j] for j in lookup if j >= 0)}
+        self.passthrough = [(j, column) for j, column in enumerate(self.columns) if column not in encoded]
+
+    def one_hot_positions(self, df):
+        '''
+        Returns the row and column indexes of the ones of the one hot encoded
+        features of the dataframe, as two arrays.
+        '''
+        rows, columns = [np.zeros(0, dtype=np.intp)], [np.zeros(0, dtype=np.intp)]
+        for feature, lookup in self.lookups.items():
+            if feature not in df.columns:
+                print("feature not found")
+                continue
+            codes = df[feature].astype(self.dtypes[feature]).cat.codes.to_numpy()
+            targets = np.where(codes >= 0, lookup[codes], -1)
+            rows.append(np.flatnonzero(targets >= 0))
+            columns.append(targets[targets >= 0])
+        return np.concatenate(rows), np.concatenate(columns)
+
+    def encode(self, df):
+        '''
+        Returns the encoded 2d array of the dataframe, with one column per
+        column of encoded_columns. Its dtype is the smallest integer dtype
+        holding the copied columns.
+        '''
+        passthrough = [(j, column) for j, column in self.passthrough if column in df.columns]
+        dtype = np.result_type(np.int8, *[df[column].dtype for j, column in passthrough])
+        encoded = np.zeros((df.shape[0], len(self.columns)), dtype=dtype)
+        for j, column in passthrough:
+            encoded[:, j] = df[column].fillna(0).to_numpy()
+        rows, columns = self.one_hot_positions(df)
+        # scatter into the flat view of the row-major array
+        encoded.reshape(-1)[rows * len(self.columns) + columns] = 1
+        return encoded
+
+    def encode_sparse(self, df):
+        '''
+        Returns the encoded scipy.sparse CSR matrix of the dataframe, with the
+        same values as encode but only the non-zero ones stored. The values
+        are float32, which LightGBM reads without a copy.
+        '''
+        rows, columns = self.one_hot_positions(df)
+        rows, columns, values = [rows], [columns], [np.ones(rows.shape[0], dtype='float32')]
+        for j, column in self.passthrough:
+            if column in df.columns:
+                column_values = df[column].fillna(0).to_numpy()
+                nonzero = np.flatnonzero(column_values)
+                rows.append(nonzero)
+                columns.append(np.full(nonzero.shape[0], j))
+                values.append(column_values[nonzero].astype('float32'))
+        encoded = sparse.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))),
+                                    shape=(df.shape[0], len(self.columns)))
+        encoded.sort_indices()
+        return encoded
+
+    def transform(self, df):
+        '''
+        Returns the encoded dataframe of the dataframe, see encode. The
+        dataframe is a view of the encoded array, it is not copied.
+        '''
+        return pd.DataFrame(self.encode(df), columns=self.columns, copy=False)
+
+
+class CategoricalEncoder:
+    '''
+    Encoder of the native categorical mode of the encode_features tasks.
+    Instead of one column per level, every feature of 'features_to_encode'
+    is kept as a single column holding the code of its level in a fixed code
+    dictionary, which LightGBM splits on as a categorical feature. Levels
+    missing from the dictionary, and missing values, are coded -1, which
+    LightGBM treats as missing. The 'passthrough_columns' are copied as they
+    are, with their missing values filled with 0.
+
+    The code dictionaries are those of 'dtypes' unless 'categories' is given:
+    a model must be scored with the dictionaries it was trained with, so the
+    training pipeline logs them with the model and the inference pipeline
+    builds its encoder from them (see code_dictionaries).
+
+
+    INPUTS
+        features_to_encode : features to code, FEATURES_TO_ENCODE
+        passthrough_columns : columns copied as they are, e.g.
+                              'total_leads_droppped'
+        categories : dictionary of feature -> list of its levels, the
+                     position of a level being its code
+        dtypes : dictionary of feature -> CategoricalDtype holding its levels,
+                 used if categories is None
+
+
+    SAMPLE USAGE
+        encoder = CategoricalEncoder(FEATURES_TO_ENCODE, ['total_leads_droppped', 'referred_lead'])
+        df_encoded = encoder.transform(model_input_data)
+    '''
+    def __init__(self, features_to_encode, passthrough_columns, categories=None, dtypes=encoding_dtypes):
+        if categories is None:
+            categories = {feature: list(dtypes[feature].categories) for feature in features_to_encode}
+        self.categorical_features = list(features_to_encode)
+        self.dtypes = {feature: pd.CategoricalDtype(categories[feature]) for feature in features_to_encode}
+        self.columns = list(passthrough_columns) + self.categorical_features
+
+    def code_dictionaries(self):
+        '''
+        Returns the categorical features and the levels of each of them, in
+        the order of their codes, as a json serializable dictionary. It is
+        also added to the manifest of the published matrix.
+        '''
+        return {'categorical_features': self.categorical_features,
+                'categories': {feature: [level.item() if isinstance(level, np.generic) else level
+                                         for level in dtype.categories]
+                               for feature, dtype in self.dtypes.items()}}
+
+    def transform(self, df):
+        '''
+        Returns the encoded dataframe of the dataframe, with the columns of
+        self.columns. The codes are int8 (or int16 for more than 127 levels).
+        '''
+        df_encoded = pd.DataFrame(index=df.index)
+        for column in self.columns:
+            if column not in df.columns:
+                print("feature not found")
+                df_encoded[column] = np.int8(-1 if column in self.dtypes else 0)
+            elif column in self.dtypes:
+                codes = df[column].astype(self.dtypes[column]).cat.codes
+                df_encoded[column] = codes.astype(np.result_type(codes.dtype, np.int8))
+            else:
+                df_encoded[column] = df[column].fillna(0)
+        return df_encoded.reset_index(drop=True)
@@ -0,0 +1,218 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+import hashlib
+import json
+import os
+
+import numpy as np
+from scipy import sparse
+
+from Lead_scoring_data_pipeline.constants import FEATURE_STORE_DIRECTORY
+
+###############################################################################
+# Define the functions that hand the encoded features over to the training and
+# inference pipelines as memory-mapped numpy matrices
+# ##############################################################################
+
+# arrays of a CSR matrix, each of them is stored in its own .npy file
+SPARSE_ARRAYS = ['data', 'indices', 'indptr']
+
+
+def matrix_paths(name, directory=FEATURE_STORE_DIRECTORY):
+    '''
+    Returns the paths of the .npy file and of the json manifest of a matrix.
+    '''
+    return os.path.join(directory, f'{name}.npy'), os.path.join(directory, f'{name}.json')
+
+
+def sparse_paths(name, directory=FEATURE_STORE_DIRECTORY):
+    '''
+    Returns the paths of the .npy files of the arrays of a CSR matrix.
+    '''
+    return {array: os.path.join(directory, f'{name}.{array}.npy') for array in SPARSE_ARRAYS}
+
+
+def write_manifest(name, manifest, directory, stale_paths):
+    '''
+    Writes the manifest of a matrix whose files are in place and removes
+    the files of the other format the matrix may have been published in.
+    '''
+    manifest_path = matrix_paths(name, directory)[1]
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    for path in stale_paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def matrix_dtype(df):
+    '''
+    Returns uint8 if all the values of the dataframe are integers between 0
+    and 255 (the one hot encoded columns and the flags), else float32.
+    '''
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if values.dtype.kind not in 'biu' or (values.size and (values.min() < 0 or values.max() > 255)):
+            return np.dtype('float32')
+    return np.dtype('uint8')
+
+
+def publish_matrix(name, df, directory=FEATURE_STORE_DIRECTORY, metadata=None):
+    '''
+    This function writes the dataframe as a row-major .npy matrix, with the
+    dtype of matrix_dtype, and a json manifest holding its columns, dtype,
+    shape and the sha256 of its content, plus the entries of metadata. Both
+    files are written to temporary paths and renamed into place, the manifest
+    last, so that a reader never sees a partially written matrix.
+
+
+    INPUTS
+        name : name of the matrix, e.g. 'features'
+        df : dataframe (or series) of numeric columns
+        directory : directory of the matrices, FEATURE_STORE_DIRECTORY by default
+        metadata : dictionary added to the manifest, e.g. the code
+                   dictionaries of the categorical features
+
+
+    OUTPUT
+        The manifest, as a dictionary
+
+
+    SAMPLE USAGE
+        publish_matrix('features', df_features)
+    '''
+    if df.ndim == 1:
+        df = df.to_frame()
+    os.makedirs(directory, exist_ok=True)
+    matrix_path, manifest_path = matrix_paths(name, directory)
+    dtype = matrix_dtype(df)
+    matrix = np.lib.format.open_memmap(matrix_path + '.tmp', mode='w+', dtype=dtype, shape=df.shape)
+    for j, column in enumerate(df.columns):
+        matrix[:, j] = df[column].to_numpy()
+    matrix.flush()
+    manifest = {'format': 'dense', 'columns': [str(column) for column in df.columns], 'dtype': dtype.name,
+                'shape': list(df.shape), 'sha256': hashlib.sha256(matrix).hexdigest(), **(metadata or {})}
+    del matrix
+    os.replace(matrix_path + '.tmp', matrix_path)
+    write_manifest(name, manifest, directory, sparse_paths(name, directory).values())
+    return manifest
+
+
+def publish_sparse_matrix(name, matrix, columns, directory=FEATURE_STORE_DIRECTORY):
+    '''
+    This function writes a scipy.sparse CSR matrix as its data, indices and
+    indptr arrays, one .npy file each, and a json manifest like
+    publish_matrix does. Only the non-zero values are stored.
+
+
+    INPUTS
+        name : name of the matrix, e.g. 'features'
+        matrix : CSR matrix, e.g. returned by OneHotEncoder.encode_sparse
+        columns : names of the columns of the matrix
+        directory : directory of the matrices, FEATURE_STORE_DIRECTORY by default
+
+
+    OUTPUT
+        The manifest, as a dictionary
+
+
+    SAMPLE USAGE
+        publish_sparse_matrix('features', encoder.encode_sparse(df), encoder.columns)
+    '''
+    os.makedirs(directory, exist_ok=True)
+    paths = sparse_paths(name, directory)
+    digest = hashlib.sha256()
+    for array in SPARSE_ARRAYS:
+        values = np.ascontiguousarray(getattr(matrix, array))
+        digest.update(values)
+        with open(paths[array] + '.tmp', 'wb') as f:
+            np.save(f, values)
+    manifest = {'format': 'csr', 'columns': [str(column) for column in columns], 'dtype': matrix.dtype.name,
+                'shape': list(matrix.shape), 'nnz': int(matrix.nnz), 'sha256': digest.hexdigest()}
+    for array in SPARSE_ARRAYS:
+        os.replace(paths[array] + '.tmp', paths[array])
+    write_manifest(name, manifest, directory, [matrix_paths(name, directory)[0]])
+    return manifest
+
+
+def prefix_sha256(matrix, n_rows):
+    '''
+    This function returns the sha256 the manifest of a matrix made of the
+    first n_rows rows of the matrix would hold, for a matrix opened with
+    open_matrix. It tells whether a matrix only grew by new rows since a
+    manifest was written, hashing the first n_rows rows only.
+
+
+    INPUTS
+        matrix : memory-mapped matrix or CSR matrix returned by open_matrix
+        n_rows : number of rows hashed
+
+
+    OUTPUT
+        The sha256, as an hexadecimal string
+
+
+    SAMPLE USAGE
+        grown = prefix_sha256(X, previous_rows) == previous_manifest['sha256']
+    '''
+    digest = hashlib.sha256()
+    if sparse.issparse(matrix):
+        nnz = int(matrix.indptr[n_rows])
+        for values in [matrix.data[:nnz], matrix.indices[:nnz], matrix.indptr[:n_rows + 1]]:
+            digest.update(np.ascontiguousarray(values))
+    else:
+        digest.update(np.ascontiguousarray(matrix[:n_rows]))
+    return digest.hexdigest()
+
+
+def open_matrix(name, directory=FEATURE_STORE_DIRECTORY, verify=False):
+    '''
+    This function opens a matrix written by publish_matrix as a read-only
+    memory map, i.e. without reading or copying it, and checks its shape and
+    dtype against the manifest. A matrix written by publish_sparse_matrix is
+    returned as a CSR matrix over the memory maps of its arrays. The sha256
+    of the content is only checked if verify is set, as it reads the whole
+    matrix.
+
+
+    INPUTS
+        name : name of the matrix, e.g. 'features'
+        directory : directory of the matrices, FEATURE_STORE_DIRECTORY by default
+        verify : if True the content is checked against the manifest
+
+
+    OUTPUT
+        Tuple of (memory-mapped matrix or CSR matrix, manifest). Raises a
+        ValueError if the matrix does not match its manifest
+
+
+    SAMPLE USAGE
+        X, manifest = open_matrix('features')
+    '''
+    matrix_path, manifest_path = matrix_paths(name, directory)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('format', 'dense') == 'csr':
+        arrays = {array: np.load(path, mmap_mode='r') for array, path in sparse_paths(name, directory).items()}
+        if arrays['data'].shape[0] != manifest['nnz'] or arrays['indptr'].shape[0] != manifest['shape'][0] + 1 \
+                or arrays['data'].dtype.name != manifest['dtype']:
+            raise ValueError(f"'{name}' matrix does not match its manifest, publish it again")
+        content = [arrays[array] for array in SPARSE_ARRAYS]
+        matrix = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                   shape=tuple(manifest['shape']), copy=False)
+    else:
+        matrix = np.load(matrix_path, mmap_mode='r')
+        if list(matrix.shape) != manifest['shape'] or matrix.dtype.name != manifest['dtype']:
+            raise ValueError(f"'{name}' matrix does not match its manifest, publish it again")
+        content = [matrix]
+    if verify:
+        digest = hashlib.sha256()
+        for values in content:
+            digest.update(values)
+        if digest.hexdigest() != manifest['sha256']:
+            raise ValueError(f"content of the '{name}' matrix does not match its manifest, publish it again")
+    return matrix, manifest
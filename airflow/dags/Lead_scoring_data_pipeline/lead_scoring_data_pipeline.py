@@ -50,23 +50,37 @@ checking_raw_data_schema= PythonOperator(task_id='checking_raw_data_schema',pyth
 loading_data = PythonOperator(task_id='loading_data',python_callable=load_data_into_db,dag = ML_data_cleaning_dag)
 
 ###############################################################################
-# Create a task for map_city_tier() function with task_id 'mapping_city_tier'
+# Create the tasks for the transforms. If PARTITIONED_TRANSFORMS is set a single
+# task for run_partitioned_transforms() with task_id 'running_partitioned_transforms'
+# is created, if FUSED_TRANSFORMS is set a single task for run_fused_transforms()
+# with task_id 'running_transforms', else one task per transform
 # ##############################################################################
 
-mapping_city_tier = PythonOperator(task_id='mapping_city_tier',python_callable=map_city_tier,dag = ML_data_cleaning_dag)
+if PARTITIONED_TRANSFORMS:
+    running_partitioned_transforms = PythonOperator(task_id='running_partitioned_transforms',python_callable=run_partitioned_transforms,dag=ML_data_cleaning_dag)
+    transform_tasks = [running_partitioned_transforms]
+elif FUSED_TRANSFORMS:
+    running_transforms = PythonOperator(task_id='running_transforms',python_callable=run_fused_transforms,dag=ML_data_cleaning_dag)
+    transform_tasks = [running_transforms]
+else:
+    ###########################################################################
+    # Create a task for map_city_tier() function with task_id 'mapping_city_tier'
+    # ##########################################################################
 
+    mapping_city_tier = PythonOperator(task_id='mapping_city_tier',python_callable=map_city_tier,dag = ML_data_cleaning_dag)
 
-###############################################################################
-# Create a task for map_categorical_vars() function with task_id 'mapping_categorical_vars'
-# ##############################################################################
+    ###########################################################################
+    # Create a task for map_categorical_vars() function with task_id 'mapping_categorical_vars'
+    # ##########################################################################
 
-mapping_categorical_vars = PythonOperator(task_id='mapping_categorical_vars',python_callable=map_categorical_vars,dag = ML_data_cleaning_dag)
+    mapping_categorical_vars = PythonOperator(task_id='mapping_categorical_vars',python_callable=map_categorical_vars,dag = ML_data_cleaning_dag)
 
-###############################################################################
-# Create a task for interactions_mapping() function with task_id 'mapping_interactions'
-# ##############################################################################
+    ###########################################################################
+    # Create a task for interactions_mapping() function with task_id 'mapping_interactions'
+    # ##########################################################################
 
-mapping_interactions = PythonOperator(task_id='mapping_interactions',python_callable=interactions_mapping,dag=ML_data_cleaning_dag)
+    mapping_interactions = PythonOperator(task_id='mapping_interactions',python_callable=interactions_mapping,dag=ML_data_cleaning_dag)
+    transform_tasks = [mapping_city_tier, mapping_categorical_vars, mapping_interactions]
 
 ###############################################################################
 # Create a task for model_input_schema_check() function with task_id 'checking_model_inputs_schema'
@@ -82,8 +96,8 @@ checking_model_inputs_schema=PythonOperator(task_id='checking_model_inputs_schem
 
 building_db.set_downstream(loading_data)
 loading_data.set_downstream(checking_raw_data_schema)
-checking_raw_data_schema.set_downstream(mapping_city_tier)
-mapping_city_tier.set_downstream(mapping_categorical_vars)
-mapping_categorical_vars.set_downstream(mapping_interactions)
-mapping_interactions.set_downstream(checking_model_inputs_schema)
+checking_raw_data_schema.set_downstream(transform_tasks[0])
+for upstream_task, downstream_task in zip(transform_tasks, transform_tasks[1:]):
+    upstream_task.set_downstream(downstream_task)
+transform_tasks[-1].set_downstream(checking_model_inputs_schema)
 
@@ -0,0 +1,99 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+from concurrent.futures import ProcessPoolExecutor
+
+from Lead_scoring_data_pipeline.schema import consumer_columns, numeric_dtypes
+from Lead_scoring_data_pipeline.transforms import compact_dtypes, required_columns, run_transforms, build_model_input
+
+# staged table holding the model_input of every month, 'model_input' in the
+# db is the concatenation of its partitions
+PARTITIONED_MODEL_INPUT = 'model_input_partitioned'
+
+###############################################################################
+# Define the functions that run the transforms month by month
+# ##############################################################################
+
+
+def month_partitions(created_dates):
+    '''
+    Returns the sorted months ('YYYY-MM') of the given 'created_date' values.
+    Leads without 'created_date' do not belong to any month.
+    '''
+    return sorted(created_dates.dropna().str[:7].unique())
+
+
+def transform_partition(stage, month, emit_intermediate=True, materialize=False):
+    '''
+    This function runs all the transforms of transforms.py on the leads of
+    'loaded_data' created in the given month and writes the output of every
+    stage to the partition of that month of its table. Every month is
+    independent of the others: the duplicated leads, which are dropped, and
+    the leads summed up in 'interactions_mapped' share their 'created_date'.
+    It is run in the worker processes of transform_partitions.
+
+
+    INPUTS
+        stage : ArrowStagingBackend holding 'loaded_data'
+        month : month to process, 'YYYY-MM'
+        emit_intermediate : if True 'city_tier_mapped' and
+                            'categorical_variables_mapped' are written too
+        materialize : if True 'interactions_mapped' is computed and written
+
+
+    OUTPUT
+        Number of leads processed
+
+
+    SAMPLE USAGE
+        transform_partition(stage, '2021-07')
+    '''
+    columns = None if materialize else consumer_columns['model_input']
+    read_columns = None if emit_intermediate else required_columns(columns)
+    if read_columns is not None:
+        read_columns = [column for column in stage.columns('loaded_data') if column in read_columns]
+    df = compact_dtypes(stage.read('loaded_data', columns=read_columns, partition=month), numeric_dtypes)
+
+    def emit(table_name, df):
+        if (table_name == 'interactions_mapped' and materialize) or \
+                (table_name != 'interactions_mapped' and emit_intermediate):
+            stage.write_partition(table_name, month, df)
+
+    df_pivot = run_transforms(df, emit=emit, columns=columns)
+    stage.write_partition(PARTITIONED_MODEL_INPUT, month, build_model_input(df_pivot))
+    return df.shape[0]
+
+
+def transform_partitions(stage, months, workers=None, emit_intermediate=True, materialize=False):
+    '''
+    This function runs transform_partition for every month in a pool of
+    'workers' processes. All the months are processed even if some of them
+    fail, so that only the failed ones have to be run again.
+
+
+    INPUTS
+        stage : ArrowStagingBackend holding 'loaded_data'
+        months : months to process, 'YYYY-MM'
+        workers : number of processes, None means one per cpu
+        emit_intermediate, materialize : see transform_partition
+
+
+    OUTPUT
+        Dictionary of month -> number of leads processed. Raises a
+        RuntimeError listing the failed months if any
+
+
+    SAMPLE USAGE
+        transform_partitions(stage, ['2021-07', '2021-08'], workers=4)
+    '''
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {month: executor.submit(transform_partition, stage, month, emit_intermediate, materialize)
+                   for month in months}
+    failed = [month for month, future in futures.items() if future.exception() is not None]
+    if failed:
+        raise RuntimeError(f'The transforms failed for the months {failed}, '
+                           f'run them again with run_partitioned_transforms(months={failed})') \
+            from futures[failed[0]].exception()
+    return {month: future.result() for month, future in futures.items()}
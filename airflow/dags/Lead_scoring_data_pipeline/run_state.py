@@ -0,0 +1,139 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+import hashlib
+import inspect
+from datetime import datetime
+
+RUN_STATE_TABLE = 'pipeline_run_state'
+FINGERPRINT_TABLE = 'stage_fingerprints'
+
+###############################################################################
+# Define the functions to read and update the high-water mark of every table
+# ##############################################################################
+
+
+def create_run_state_table(conn):
+    '''
+    Creates the run-state table in the db if it does not exist. It holds, for
+    every table of the pipeline, the latest 'created_date' that has been
+    processed into it (the watermark) and when it was last updated.
+    '''
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {RUN_STATE_TABLE} '
+                 '(table_name TEXT PRIMARY KEY, watermark TEXT, updated_at TEXT)')
+
+
+def get_watermark(conn, table_name):
+    '''
+    Returns the watermark of the table, or None if the table has never been
+    processed.
+    '''
+    create_run_state_table(conn)
+    row = conn.execute(f'SELECT watermark FROM {RUN_STATE_TABLE} WHERE table_name=?',
+                       (table_name,)).fetchone()
+    return row[0] if row else None
+
+
+def set_watermark(conn, table_name, watermark):
+    '''
+    Sets the watermark of the table. The change is not committed so that it
+    can be part of the same transaction as the data written to the table.
+    '''
+    create_run_state_table(conn)
+    conn.execute(f'INSERT OR REPLACE INTO {RUN_STATE_TABLE} (table_name, watermark, updated_at) '
+                 'VALUES (?, ?, ?)', (table_name, watermark, datetime.now().isoformat()))
+
+
+def max_created_date(df, watermark=None):
+    '''
+    Returns the latest 'created_date' of the dataframe, or the given watermark
+    if it is later or the dataframe holds no dates.
+    '''
+    dates = df['created_date'].dropna()
+    latest = dates.max() if dates.shape[0] else None
+    if latest is None or (watermark is not None and watermark > latest):
+        return watermark
+    return latest
+
+###############################################################################
+# Define the functions to fingerprint the inputs of every table
+# ##############################################################################
+
+
+def file_fingerprint(path):
+    '''
+    Returns the sha256 of the content of the file, read in blocks of 1MB.
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2 ** 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def code_fingerprint(*objects):
+    '''
+    Returns the sha256 of the source code of the given functions, other
+    objects (e.g. lists of columns) are fingerprinted through their repr.
+    '''
+    digest = hashlib.sha256()
+    for obj in objects:
+        digest.update((inspect.getsource(obj) if callable(obj) else repr(obj)).encode())
+    return digest.hexdigest()
+
+
+def combine_fingerprints(*fingerprints):
+    '''
+    Returns a single fingerprint for all the given fingerprints.
+    '''
+    return hashlib.sha256('|'.join(fingerprints).encode()).hexdigest()
+
+
+def create_fingerprint_table(conn):
+    '''
+    Creates the table holding the fingerprint of the inputs each table of the
+    pipeline was last built from, if it does not exist.
+    '''
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {FINGERPRINT_TABLE} '
+                 '(table_name TEXT PRIMARY KEY, fingerprint TEXT, updated_at TEXT)')
+
+
+def get_fingerprint(conn, table_name):
+    '''
+    Returns the fingerprint the table was last built with, or None.
+    '''
+    create_fingerprint_table(conn)
+    row = conn.execute(f'SELECT fingerprint FROM {FINGERPRINT_TABLE} WHERE table_name=?',
+                       (table_name,)).fetchone()
+    return row[0] if row else None
+
+
+def set_fingerprint(conn, table_name, fingerprint):
+    '''
+    Records the fingerprint the table was built with. The change is not
+    committed, like set_watermark.
+    '''
+    create_fingerprint_table(conn)
+    conn.execute(f'INSERT OR REPLACE INTO {FINGERPRINT_TABLE} (table_name, fingerprint, updated_at) '
+                 'VALUES (?, ?, ?)', (table_name, fingerprint, datetime.now().isoformat()))
+
+
+def invalidate(conn, table_names):
+    '''
+    Forgets the fingerprints the tables were built with, so that they are
+    built again from scratch on their next run. The change is not committed,
+    like set_watermark.
+    '''
+    create_fingerprint_table(conn)
+    conn.executemany(f'DELETE FROM {FINGERPRINT_TABLE} WHERE table_name=?',
+                     [(table_name,) for table_name in table_names])
+
+
+def record_run(conn, table_name, watermark, fingerprint):
+    '''
+    Records the watermark and the fingerprint of a table once it is built.
+    '''
+    set_watermark(conn, table_name, watermark)
+    set_fingerprint(conn, table_name, fingerprint)
@@ -1,3 +1,6 @@
+import pandas as pd
+from Lead_scoring_data_pipeline.mapping.significant_categorical_level import significant_levels
+
 raw_data_schema = ['created_date', 'city_mapped', 'first_platform_c',
            'first_utm_medium_c', 'first_utm_source_c', 'total_leads_droppped',
            'referred_lead', '1_on_1_industry_mentorship', 'call_us_button_clicked',
@@ -17,7 +20,69 @@ raw_data_schema = ['created_date', 'city_mapped', 'first_platform_c',
            'tab_career_assistance', 'tab_job_opportunities', 'tab_student_support',
            'view_programs_page', 'whatsapp_chat_click', 'app_complete_flag']
 
+# explicit dtypes used while reading the raw csv so that every chunk has the
+# same column types irrespective of the values present in it
+raw_categorical_columns = ['created_date', 'city_mapped', 'first_platform_c',
+                           'first_utm_medium_c', 'first_utm_source_c']
+raw_data_dtypes = {column: 'object' if column in raw_categorical_columns else 'float64'
+                   for column in raw_data_schema}
+
+# compact dtypes of the numeric columns, applied from 'loaded_data' onwards
+# (see transforms.compact_dtypes). The interaction columns hold click counts,
+# a missing count is loaded as 0. app_complete_flag is nullable: the leads
+# without a label are loaded and only left out of model_input
+interaction_columns = [column for column in raw_data_schema if column not in raw_categorical_columns
+                       and column not in ['total_leads_droppped', 'referred_lead', 'app_complete_flag']]
+numeric_dtypes = {**{column: 'int16' for column in interaction_columns},
+                  'total_leads_droppped': 'int16', 'referred_lead': 'int8',
+                  'app_complete_flag': 'Int8', 'city_tier': 'int8'}
+# fixed categories of the categorical columns once their insignificant levels
+# are mapped to "others", sorted so that sorting the codes sorts the levels
+categorical_dtypes = {column: pd.CategoricalDtype(sorted(set(levels) | {'others'}))
+                      for column, levels in significant_levels.items()}
+
 
 model_input_schema = ['total_leads_droppped', 'city_tier', 'referred_lead', 
                     'first_platform_c', 'first_utm_medium_c', 'first_utm_source_c', 
                     'app_complete_flag']
+
+# columns of 'interactions_mapped' read by each consumer of the data pipeline,
+# None means all of them. The FEATURES_TO_ENCODE of the training and inference
+# pipelines are all part of model_input_schema.
+consumer_columns = {'model_input': model_input_schema,
+                    'interactions_mapped': None}
+
+model_input_dtypes = {column: numeric_dtypes.get(column, categorical_dtypes.get(column))
+                      for column in model_input_schema}
+# only the leads with a label are part of model_input
+model_input_dtypes['app_complete_flag'] = 'int8'
+# levels of the features one hot encoded by the training and inference
+# pipelines. The levels of city_tier are floats so that the encoded columns keep
+# the 'city_tier_1.0' names the registered models were trained with
+encoding_dtypes = {'city_tier': pd.CategoricalDtype([1.0, 2.0, 3.0]), **categorical_dtypes}
+
+# columns of the raw csv which may be missing: the label is not present in
+# the csv of the leads to score
+optional_columns = ['app_complete_flag']
+# type affinity of the columns of 'loaded_data' and 'model_input' once they
+# are stored, as reported by PRAGMA table_info (or the arrow schema)
+loaded_data_types = {column: 'INTEGER' if column in numeric_dtypes else 'TEXT' for column in raw_data_schema}
+model_input_types = {column: 'INTEGER' if column in numeric_dtypes else 'TEXT' for column in model_input_schema}
+# value-level expectations checked by data_validation_checks.py on a sample of
+# the table. 'max_null_rate' is the highest share of nulls allowed, 'levels'
+# the allowed values and 'min'/'max' the allowed range. The nulls of the
+# numeric columns are filled while loading, but for the label of the leads
+# which have none; unknown cities, including the missing ones, are mapped to
+# tier 3
+raw_data_expectations = {'created_date': {'max_null_rate': 0.0},
+                         'city_mapped': {'max_null_rate': 0.2},
+                         'total_leads_droppped': {'max_null_rate': 0.0, 'min': 0},
+                         'referred_lead': {'max_null_rate': 0.0, 'levels': [0, 1]},
+                         'app_complete_flag': {'levels': [0, 1]},
+                         **{column: {'max_null_rate': 0.0, 'min': 0} for column in interaction_columns}}
+model_input_expectations = {'total_leads_droppped': {'max_null_rate': 0.0, 'min': 0},
+                            'city_tier': {'max_null_rate': 0.0, 'levels': [1, 2, 3]},
+                            'referred_lead': {'max_null_rate': 0.0, 'levels': [0, 1]},
+                            'app_complete_flag': {'max_null_rate': 0.0, 'levels': [0, 1]},
+                            **{column: {'max_null_rate': 0.0, 'levels': list(dtype.categories)}
+                               for column, dtype in categorical_dtypes.items()}}
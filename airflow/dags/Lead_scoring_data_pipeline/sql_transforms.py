@@ -0,0 +1,186 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+from Lead_scoring_data_pipeline.constants import INDEX_COLUMNS_INFERENCE, NOT_FEATURES
+from Lead_scoring_data_pipeline.mapping.city_tier_mapping import city_tier_mapping
+from Lead_scoring_data_pipeline.schema import categorical_dtypes
+from Lead_scoring_data_pipeline.transforms import interaction_mapping_matrix, TABLE_DEPENDENCIES
+
+CITY_TIER_TABLE = 'city_tier_lookup'
+
+###############################################################################
+# Define the SELECT statements equivalent to the transforms of transforms.py.
+# Each of them takes the name of the table (or CTE) to read from and its
+# columns and returns the statement and the columns it produces.
+# ##############################################################################
+
+
+def quote(column):
+    return f'"{column}"'
+
+
+def index_filter(columns):
+    '''
+    WHERE clause dropping the rows with a null index column, like the groupby
+    of transform_interactions does.
+    '''
+    return ' AND '.join(f'{quote(column)} IS NOT NULL' for column in columns)
+
+
+def city_tier_query(source, columns):
+    '''
+    Equivalent of transform_city_tier: joins 'city_mapped' with the lookup
+    table built from city_tier_mapping.py, unknown cities are tier 3. The
+    CAST gives the column a declared type in the tables built with CREATE
+    TABLE ... AS, like the columns written from pandas.
+    '''
+    output = [column for column in columns if column != 'city_mapped'] + ['city_tier']
+    select = ', '.join(f's.{quote(column)}' for column in output[:-1])
+    query = (f'SELECT {select}, CAST(COALESCE(t.city_tier, 3) AS INTEGER) AS city_tier FROM {quote(source)} s '
+             f'LEFT JOIN {CITY_TIER_TABLE} t ON s.city_mapped = t.city_mapped')
+    return query, output
+
+
+def categorical_vars_query(source, columns):
+    '''
+    Equivalent of transform_categorical_vars: every level which is not one of
+    the categories of categorical_dtypes is mapped to "others" with a CASE
+    WHEN ... IN (...), cast to TEXT, and the duplicated rows are dropped.
+    '''
+    select = []
+    for column in columns:
+        if column in categorical_dtypes:
+            levels = ', '.join("'" + level.replace("'", "''") + "'" for level in categorical_dtypes[column].categories)
+            select.append(f"CAST(CASE WHEN {quote(column)} IN ({levels}) THEN {quote(column)} ELSE 'others' END AS TEXT) "
+                          f"AS {quote(column)}")
+        else:
+            select.append(quote(column))
+    return f'SELECT DISTINCT {", ".join(select)} FROM {quote(source)}', list(columns)
+
+
+def interactions_query(source, columns):
+    '''
+    Equivalent of transform_interactions: sums up the interaction columns of
+    every interaction type of 'interaction_mapping.csv' per unique index.
+    '''
+    interaction_columns, interaction_types, matrix = interaction_mapping_matrix()
+    index_columns = [column for column in INDEX_COLUMNS_INFERENCE if column in columns]
+    sums = []
+    for j, interaction_type in enumerate(interaction_types):
+        mapped = [column for i, column in enumerate(interaction_columns) if matrix[i, j] and column in columns]
+        total = ' + '.join(f'COALESCE({quote(column)}, 0)' for column in mapped) or '0'
+        sums.append(f'SUM({total}) AS {quote(interaction_type)}')
+    index = ', '.join(quote(column) for column in index_columns)
+    query = (f'SELECT {index}, {", ".join(sums)} FROM {quote(source)} '
+             f'WHERE {index_filter(index_columns)} GROUP BY {index} ORDER BY {index}')
+    return query, index_columns + interaction_types
+
+
+def model_input_query(source, columns):
+    '''
+    Equivalent of build_model_input(transform_interactions(df)) for the
+    columns of model_input: one row per unique index, without NOT_FEATURES.
+    '''
+    index_columns = [column for column in INDEX_COLUMNS_INFERENCE if column in columns]
+    output = [column for column in index_columns if column not in NOT_FEATURES]
+    index = ', '.join(quote(column) for column in index_columns)
+    query = (f'SELECT {", ".join(quote(column) for column in output)} FROM {quote(source)} '
+             f'WHERE {index_filter(index_columns)} GROUP BY {index} ORDER BY {index}')
+    return query, output
+
+
+STAGE_QUERIES = {'city_tier_mapped': city_tier_query,
+                 'categorical_variables_mapped': categorical_vars_query,
+                 'interactions_mapped': interactions_query,
+                 'model_input': model_input_query}
+
+###############################################################################
+# Define the functions that run the statements inside the db
+# ##############################################################################
+
+
+def create_city_tier_table(conn):
+    '''
+    Creates the temporary lookup table of city_tier_mapping.py on the
+    connection, if it does not exist yet.
+    '''
+    conn.execute(f'CREATE TEMP TABLE IF NOT EXISTS {CITY_TIER_TABLE} (city_mapped TEXT PRIMARY KEY, city_tier INTEGER)')
+    if conn.execute(f'SELECT COUNT(*) FROM {CITY_TIER_TABLE}').fetchone()[0] == 0:
+        conn.executemany(f'INSERT INTO {CITY_TIER_TABLE} VALUES (?, ?)', city_tier_mapping.items())
+
+
+def source_watermark(conn, source, watermark=None):
+    '''
+    Returns the latest 'created_date' of the source table, created after the
+    watermark if one is given, or the watermark if no such row exists.
+    '''
+    if watermark is None:
+        latest = conn.execute(f'SELECT MAX(created_date) FROM {quote(source)}').fetchone()[0]
+    else:
+        latest = conn.execute(f'SELECT MAX(created_date) FROM {quote(source)} WHERE created_date > ?',
+                              (watermark,)).fetchone()[0]
+    return watermark if latest is None else latest
+
+
+def pushdown(conn, source, target, watermark=None):
+    '''
+    This function builds the table 'target' from the table 'source' with a
+    single INSERT ... SELECT statement, so that the data never leaves sqlite.
+    The stages between them (see TABLE_DEPENDENCIES) are inlined as CTEs, e.g.
+    pushdown(conn, 'loaded_data', 'model_input') does not materialize
+    'city_tier_mapped' and 'categorical_variables_mapped'. The statement is
+    run in a transaction which is left open, the caller commits it.
+
+
+    INPUTS
+        conn : connection returned by connection.get_connection
+        source : table to read from
+        target : table to build
+        watermark : if given only the rows of 'source' created after it are
+                    read and the result is appended to 'target', else 'target'
+                    is replaced
+
+
+    OUTPUT
+        The latest 'created_date' processed into 'target'
+
+
+    SAMPLE USAGE
+        watermark = pushdown(conn, 'loaded_data', 'city_tier_mapped')
+        conn.commit()
+    '''
+    stages = []
+    table_name = target
+    while table_name != source:
+        stages.insert(0, table_name)
+        table_name = TABLE_DEPENDENCIES[table_name][0]
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({quote(source)})')]
+    if watermark is None:
+        ctes = [('rows_to_process', f'SELECT * FROM {quote(source)}')]
+        params = ()
+    else:
+        ctes = [('rows_to_process', f'SELECT * FROM {quote(source)} WHERE created_date > ?')]
+        params = (watermark,)
+    for stage in stages:
+        query, columns = STAGE_QUERIES[stage](ctes[-1][0], columns)
+        ctes.append((f'{stage}_cte', query))
+    statement = 'WITH ' + ', '.join(f'{name} AS ({query})' for name, query in ctes[:-1]) + ' ' + ctes[-1][1]
+
+    if not conn.in_transaction:
+        conn.execute('BEGIN')
+    create_city_tier_table(conn)
+    if watermark is None:
+        conn.execute(f'DROP TABLE IF EXISTS {quote(target)}')
+        conn.execute(f'CREATE TABLE {quote(target)} AS SELECT * FROM ({statement}) LIMIT 0', params)
+    conn.execute(f'INSERT INTO {quote(target)} {statement}', params)
+    return source_watermark(conn, source, watermark)
+
+
+def materialize_code(table_name):
+    '''
+    Returns the functions the statement building the table depends on, they
+    are part of its fingerprint in the 'sql' EXECUTION_MODE.
+    '''
+    return [quote, index_filter, STAGE_QUERIES[table_name], create_city_tier_table, pushdown]
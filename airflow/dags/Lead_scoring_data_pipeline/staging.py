@@ -0,0 +1,380 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+import os
+import shutil
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    from pyarrow import fs
+except ImportError:
+    pa = None
+
+from Lead_scoring_data_pipeline.constants import STAGING_BACKEND, STAGING_DIRECTORY
+from Lead_scoring_data_pipeline.connection import table_exists, table_writer, write_table
+
+# prefix of the directories holding the partitions (months) of a table
+PARTITION_PREFIX = 'month='
+
+###############################################################################
+# Define the staging backend that keeps the intermediate tables in sqlite
+# ##############################################################################
+
+
+class SqliteStagingBackend:
+    '''
+    Stores the intermediate tables of the data pipeline as tables in the
+    sqlite db, i.e. the behaviour the pipeline always had.
+
+
+    INPUTS
+        conn : connection returned by connection.get_connection
+
+
+    SAMPLE USAGE
+        stage = SqliteStagingBackend(conn)
+        df = stage.read('loaded_data')
+    '''
+    def __init__(self, conn):
+        self.conn = conn
+
+    def exists(self, name):
+        return table_exists(self.conn, name)
+
+    def columns(self, name):
+        return [row[1] for row in self.conn.execute(f'PRAGMA table_info("{name}")')]
+
+    def column_types(self, name):
+        '''
+        Returns the type affinity of every column of the table from its
+        declared type in PRAGMA table_info, no row is read.
+        '''
+        return {row[1]: sqlite_affinity(row[2]) for row in self.conn.execute(f'PRAGMA table_info("{name}")')}
+
+    def sample(self, name, n_rows, seed=0):
+        '''
+        Reads about n_rows rows of the table picked at random by rowid, which
+        are looked up in the rowid b-tree instead of scanning the table. All
+        the rows are read if the table is not larger than n_rows.
+        '''
+        max_rowid = self.conn.execute(f'SELECT MAX(rowid) FROM "{name}"').fetchone()[0] or 0
+        if max_rowid <= n_rows:
+            return self.read(name)
+        rowids = np.sort(np.random.default_rng(seed).choice(max_rowid, n_rows, replace=False) + 1)
+        return pd.read_sql(f'select * from "{name}" where rowid in ({",".join(map(str, rowids))})', self.conn)
+
+    def scan(self, name, chunksize):
+        '''
+        Yields the rows of the table as dataframes of chunksize rows.
+        '''
+        return pd.read_sql(f'select * from "{name}"', self.conn, chunksize=chunksize)
+
+    def read(self, name, columns=None, since=None):
+        select = ', '.join(f'"{column}"' for column in columns) if columns else '*'
+        if since is None:
+            return pd.read_sql(f'select {select} from "{name}"', self.conn)
+        return pd.read_sql(f'select {select} from "{name}" where created_date > ?', self.conn, params=(since,))
+
+    def drop(self, name):
+        self.conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+
+    def write(self, name, df):
+        write_table(self.conn, name, df)
+
+    def append(self, name, df):
+        write_table(self.conn, name, df, append=True)
+
+    def writer(self, name, append=False):
+        '''
+        Yields a function that appends a chunk (dataframe) to the table, see
+        connection.table_writer.
+        '''
+        return table_writer(self.conn, name, append=append)
+
+###############################################################################
+# Define the staging backend that keeps the intermediate tables as columnar files
+# ##############################################################################
+
+
+class ArrowStagingBackend:
+    '''
+    Stores the intermediate tables of the data pipeline as columnar files in
+    STAGING_DIRECTORY, one directory per table. 'parquet' writes compressed
+    parquet files, 'arrow' writes uncompressed Arrow IPC files which are
+    memory-mapped while reading. Only the requested columns are read. The
+    tables written by month with write_partition hold one directory per month.
+
+
+    INPUTS
+        directory : directory in which the tables are stored
+        file_format : 'parquet' or 'arrow'
+
+
+    SAMPLE USAGE
+        stage = ArrowStagingBackend(STAGING_DIRECTORY, 'parquet')
+        df = stage.read('loaded_data', columns=['created_date'])
+    '''
+    EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+    def __init__(self, directory, file_format='parquet'):
+        if pa is None:
+            raise ImportError(f"pyarrow is required for the '{file_format}' staging backend")
+        if file_format not in self.EXTENSIONS:
+            raise ValueError(f'Unknown staging file format {file_format}')
+        self.directory = directory
+        self.file_format = file_format
+        self.filesystem = fs.LocalFileSystem(use_mmap=True)
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def partition_path(self, name, partition):
+        return os.path.join(self.path(name), PARTITION_PREFIX + partition)
+
+    def partitions(self, name):
+        '''
+        Returns the sorted partitions (months) of the table, or an empty list
+        if the table is not partitioned.
+        '''
+        if not os.path.isdir(self.path(name)):
+            return []
+        return sorted(entry[len(PARTITION_PREFIX):] for entry in os.listdir(self.path(name))
+                      if entry.startswith(PARTITION_PREFIX))
+
+    def exists(self, name):
+        return os.path.isdir(self.path(name)) and len(os.listdir(self.path(name))) > 0
+
+    def drop(self, name):
+        shutil.rmtree(self.path(name), ignore_errors=True)
+
+    def dataset(self, name, partition=None):
+        dataset_format = 'ipc' if self.file_format == 'arrow' else 'parquet'
+        path = self.path(name) if partition is None else self.partition_path(name, partition)
+        return ds.dataset(path, format=dataset_format, filesystem=self.filesystem)
+
+    def columns(self, name):
+        return self.dataset(name).schema.names
+
+    def column_types(self, name):
+        '''
+        Returns the sqlite type affinity of every column of the table from the
+        schema stored in the files, no row is read.
+        '''
+        return {field.name: arrow_affinity(field.type) for field in self.dataset(name).schema}
+
+    def sample(self, name, n_rows, seed=0):
+        '''
+        Reads n_rows rows of the table picked at random. The number of rows is
+        read from the file metadata and only the batches holding the picked
+        rows are read. All the rows are read if the table is not larger than
+        n_rows.
+        '''
+        dataset = self.dataset(name)
+        total_rows = dataset.count_rows()
+        if total_rows <= n_rows:
+            return dataset.to_table().to_pandas()
+        indices = np.sort(np.random.default_rng(seed).choice(total_rows, n_rows, replace=False))
+        return dataset.take(pa.array(indices)).to_pandas()
+
+    def scan(self, name, chunksize):
+        '''
+        Yields the rows of the table as dataframes of at most chunksize rows.
+        '''
+        for batch in self.dataset(name).to_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+
+    def read(self, name, columns=None, since=None, partition=None):
+        '''
+        Reads the table, or only the given columns of it. If since is given
+        only the rows created after it are read. If partition (a month) is
+        given only the rows of that month are read, from its partition if
+        the table is partitioned, else by filtering 'created_date'.
+        '''
+        row_filter = None if since is None else ds.field('created_date') > since
+        if partition is not None and partition in self.partitions(name):
+            dataset = self.dataset(name, partition)
+        else:
+            dataset = self.dataset(name)
+            if partition is not None:
+                start, end = partition_bounds(partition)
+                month_filter = (ds.field('created_date') >= start) & (ds.field('created_date') < end)
+                row_filter = month_filter if row_filter is None else row_filter & month_filter
+        return dataset.to_table(columns=columns, filter=row_filter).to_pandas()
+
+    def write(self, name, df):
+        with self.writer(name) as write_chunk:
+            write_chunk(df)
+
+    def append(self, name, df):
+        with self.writer(name, append=True) as write_chunk:
+            write_chunk(df)
+
+    def write_partition(self, name, partition, df):
+        '''
+        Replaces the partition (month) of the table by the dataframe, the other
+        partitions are left as they are.
+        '''
+        with self.writer(name, partition=partition) as write_chunk:
+            write_chunk(df)
+
+    @contextmanager
+    def writer(self, name, append=False, partition=None):
+        '''
+        Yields a function that appends a chunk (dataframe) to the table. The
+        chunks are written to a temporary location which replaces the table
+        (or only its partition if one is given) once all of them have been
+        written. If append is set the chunks are added to the table as a new
+        part file instead.
+        '''
+        if partition is None:
+            target_path = self.path(name)
+            tmp_path = target_path + '.tmp'
+        else:
+            # a single listing, the partitions of other months may be renamed
+            # into the table by concurrent workers meanwhile
+            entries = os.listdir(self.path(name)) if os.path.isdir(self.path(name)) else []
+            if any(not entry.startswith(PARTITION_PREFIX) for entry in entries):
+                raise ValueError(f"'{name}' is not partitioned, it has to be replaced as a whole")
+            target_path = self.partition_path(name, partition)
+            tmp_path = f'{self.path(name)}.{PARTITION_PREFIX}{partition}.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        part = len(os.listdir(target_path)) if append and os.path.isdir(target_path) else 0
+        file_name = f'part-{part:05d}.{self.EXTENSIONS[self.file_format]}'
+        file_path = os.path.join(tmp_path, file_name)
+        file_writer = None
+        schema = None
+
+        def write_chunk(chunk):
+            nonlocal file_writer, schema
+            if file_writer is None:
+                schema = _arrow_schema(chunk)
+                if self.file_format == 'parquet':
+                    file_writer = pq.ParquetWriter(file_path, schema)
+                else:
+                    file_writer = pa.ipc.new_file(file_path, schema)
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            file_writer.write_table(table)
+
+        try:
+            yield write_chunk
+            if file_writer is not None:
+                file_writer.close()
+        except Exception:
+            if file_writer is not None:
+                file_writer.close()
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        if file_writer is None:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if append:
+                return
+            os.makedirs(tmp_path)
+        if append:
+            os.makedirs(target_path, exist_ok=True)
+            os.rename(file_path, os.path.join(target_path, file_name))
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        else:
+            shutil.rmtree(target_path, ignore_errors=True)
+            os.makedirs(self.path(name), exist_ok=True)
+            os.rename(tmp_path, target_path)
+
+
+def partition_bounds(partition):
+    '''
+    Returns the first day of the month 'YYYY-MM' and of the next one, used to
+    filter the 'created_date' of the rows of a partition.
+    '''
+    year, month = int(partition[:4]), int(partition[5:7])
+    year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return partition, f'{year:04d}-{month:02d}'
+
+
+def sqlite_affinity(declared_type):
+    '''
+    Returns the type affinity (INTEGER, TEXT, BLOB, REAL or NUMERIC) sqlite
+    gives to a column of the declared type, following the rules of
+    https://www.sqlite.org/datatype3.html. The tables built with CREATE
+    TABLE ... AS declare e.g. INT instead of INTEGER.
+    '''
+    declared_type = declared_type.upper()
+    if 'INT' in declared_type:
+        return 'INTEGER'
+    if any(name in declared_type for name in ('CHAR', 'CLOB', 'TEXT')):
+        return 'TEXT'
+    if 'BLOB' in declared_type or not declared_type:
+        return 'BLOB'
+    if any(name in declared_type for name in ('REAL', 'FLOA', 'DOUB')):
+        return 'REAL'
+    return 'NUMERIC'
+
+
+def arrow_affinity(arrow_type):
+    '''
+    Returns the sqlite type affinity matching the arrow type, so that both
+    backends report the column types the same way.
+    '''
+    if pa.types.is_dictionary(arrow_type):
+        arrow_type = arrow_type.value_type
+    if pa.types.is_integer(arrow_type) or pa.types.is_boolean(arrow_type):
+        return 'INTEGER'
+    if pa.types.is_floating(arrow_type):
+        return 'REAL'
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return 'TEXT'
+    if pa.types.is_binary(arrow_type) or pa.types.is_large_binary(arrow_type):
+        return 'BLOB'
+    return 'NUMERIC'
+
+
+def _arrow_schema(df):
+    '''
+    Arrow schema of the dataframe. Columns which only hold nulls in the first
+    chunk are typed as string so that later chunks can be appended.
+    '''
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+    return schema
+
+###############################################################################
+# Define the function that returns the configured staging backend
+# ##############################################################################
+
+
+def get_staging_backend(conn):
+    '''
+    This function returns the staging backend configured in STAGING_BACKEND
+    which is used to read and write the intermediate tables of the data pipeline
+    i.e. 'loaded_data', 'city_tier_mapped', 'categorical_variables_mapped' and
+    'interactions_mapped'. 'model_input' is always written to the sqlite db
+    as it is read by the training and inference pipelines.
+
+
+    INPUTS
+        conn : connection returned by connection.get_connection
+        STAGING_BACKEND : 'sqlite', 'parquet' or 'arrow'
+        STAGING_DIRECTORY : directory used by the 'parquet' and 'arrow' backends
+
+
+    OUTPUT
+        Object with exists, columns, column_types, read, sample, scan, drop,
+                 write, append and writer methods
+
+
+    SAMPLE USAGE
+        stage = get_staging_backend(conn)
+    '''
+    if STAGING_BACKEND == 'sqlite':
+        return SqliteStagingBackend(conn)
+    return ArrowStagingBackend(STAGING_DIRECTORY, STAGING_BACKEND)
@@ -0,0 +1,240 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+from functools import lru_cache, partial
+
+import numpy as np
+import pandas as pd
+from Lead_scoring_data_pipeline.constants import INTERACTION_MAPPING, CITY_TIER_MAPPING, SIGNIFICANT_CATEGORICAL_LEVEL, NOT_FEATURES, INDEX_COLUMNS_INFERENCE
+from Lead_scoring_data_pipeline.schema import consumer_columns, categorical_dtypes, numeric_dtypes, model_input_dtypes
+from Lead_scoring_data_pipeline.mapping.city_tier_mapping import city_tier_mapping
+
+###############################################################################
+# Define the in-memory transforms of the data pipeline. Each of them takes the
+# output of the previous one and returns a new dataframe, no db access is done
+# here.
+# ##############################################################################
+
+
+def compact_dtypes(df, dtypes):
+    '''
+    Casts, in place, the columns of the dataframe listed in 'dtypes' which are
+    present in it to their compact dtype (see numeric_dtypes and
+    categorical_dtypes in schema.py). Values which do not fit in the integer
+    dtype of their column (nulls, unless the dtype is nullable, fractions or
+    out of range) raise a ValueError instead of being silently truncated.
+
+
+    INPUTS
+        df : dataframe to cast
+        dtypes : dictionary of column name -> dtype
+
+
+    OUTPUT
+        The same dataframe with the compact dtypes
+
+
+    SAMPLE USAGE
+        df = compact_dtypes(df, numeric_dtypes)
+    '''
+    for column, dtype in dtypes.items():
+        if column not in df.columns or df[column].dtype == dtype:
+            continue
+        values = df[column]
+        compact = values.astype(dtype)
+        if not isinstance(dtype, pd.CategoricalDtype):
+            nulls = values.isna().to_numpy()
+            if not (np.array_equal(compact.isna().to_numpy(), nulls) and
+                    np.array_equal(compact.to_numpy()[~nulls], values.to_numpy()[~nulls])):
+                raise ValueError(f"values of '{column}' do not fit in {dtype}")
+        df[column] = compact
+    return df
+
+
+def transform_city_tier(df):
+    '''
+    Maps 'city_mapped' to its tier as per city_tier_mapping.py, cities which
+    are not present in the mapping are mapped to tier 3. Returns the dataframe
+    of the 'city_tier_mapped' table.
+    '''
+    df["city_tier"] = df["city_mapped"].map(city_tier_mapping)
+    df['city_tier']=df['city_tier'].fillna(3)
+    df=df.drop('city_mapped',axis=1)
+    return compact_dtypes(df, numeric_dtypes)
+
+
+def collapse_rare_levels(df, dtypes, other_level="others"):
+    '''
+    Replaces, in place, every value of the columns in 'dtypes' which is not one
+    of the categories of its categorical dtype by 'other_level'. Casting to a
+    categorical with fixed categories already turns the unknown levels into
+    nulls, which are then filled with 'other_level', so the row order is
+    preserved and the columns are stored as small integer codes.
+
+
+    INPUTS
+        df : dataframe holding the categorical columns
+        dtypes : dictionary of column name -> CategoricalDtype whose categories
+                 are the significant levels and 'other_level'
+        other_level : value used for the insignificant levels
+
+
+    OUTPUT
+        The same dataframe with the insignificant levels collapsed
+
+
+    SAMPLE USAGE
+        collapse_rare_levels(df, categorical_dtypes)
+    '''
+    for column, dtype in dtypes.items():
+        df[column] = df[column].astype(dtype).fillna(other_level)
+    return df
+
+
+def transform_categorical_vars(df):
+    '''
+    Maps the insignificant levels of 'first_platform_c', 'first_utm_medium_c'
+    and 'first_utm_source_c' to "others" as per significant_categorical_level.py.
+    Returns the dataframe of the 'categorical_variables_mapped' table, without
+    the leads which are duplicated once mapped.
+    '''
+    df = collapse_rare_levels(df, categorical_dtypes)
+    df = df.drop_duplicates(ignore_index=True)
+    return df
+
+
+@lru_cache(maxsize=None)
+def interaction_mapping_matrix(mapping_path=INTERACTION_MAPPING):
+    '''
+    Reads 'interaction_mapping.csv' once and builds a dense 0/1 matrix of
+    shape (number of interaction columns, number of interaction types) where
+    matrix[i, j] is 1 if the i-th interaction column maps to the j-th type.
+    The types are sorted, i.e. in the order pivot_table would return them.
+
+
+    INPUTS
+        mapping_path : path of the csv file containing interaction's mappings
+
+
+    OUTPUT
+        Tuple of (interaction columns, interaction types, matrix)
+
+
+    SAMPLE USAGE
+        interaction_columns, interaction_types, matrix = interaction_mapping_matrix()
+    '''
+    df_event_mapping = pd.read_csv(mapping_path,index_col=[0])
+    interaction_columns = list(df_event_mapping.index)
+    interaction_types = sorted(df_event_mapping['interaction_mapping'].unique())
+    matrix = (df_event_mapping['interaction_mapping'].to_numpy()[:, None] == np.array(interaction_types)[None, :])
+    return interaction_columns, interaction_types, matrix.astype('float64')
+
+
+def required_columns(columns=None):
+    '''
+    Returns the columns of 'loaded_data' needed to produce the given columns
+    of 'interactions_mapped', or None if all of them are needed. When none of
+    the interaction types is requested only the index columns are needed, as
+    the rows of 'interactions_mapped' are the unique values of these columns.
+    '''
+    interaction_columns, interaction_types, matrix = interaction_mapping_matrix()
+    if columns is None or any(column in interaction_types for column in columns):
+        return None
+    return ['city_mapped'] + INDEX_COLUMNS_INFERENCE
+
+
+def transform_interactions(df, columns=None):
+    '''
+    Maps the interaction columns into the interaction types present in
+    'interaction_mapping.csv' and sums them up per lead with a single matrix
+    product of the interaction block and the mapping matrix. Leads having the
+    same values in the index columns are summed up and sorted like pivot_table
+    does. Only the interaction types listed in 'columns' are computed (all of
+    them if columns is None). Returns the dataframe of the 'interactions_mapped'
+    table.
+    '''
+    interaction_columns, interaction_types, matrix = interaction_mapping_matrix()
+    # app_complete_flag is not present while inference
+    index_columns = [column for column in INDEX_COLUMNS_INFERENCE if column in df.columns]
+    selected = [i for i, interaction_type in enumerate(interaction_types) if columns is None or interaction_type in columns]
+    if selected:
+        present = [column in df.columns for column in interaction_columns]
+        # columns read back from sqlite with only nulls are not typed as float
+        values = df[[column for column, found in zip(interaction_columns, present) if found]].to_numpy(dtype='float64', na_value=np.nan)
+        if not values.flags.writeable:
+            # zero-copy view of a memory-mapped staging file
+            values = values.copy()
+        np.nan_to_num(values, copy=False)
+        df_interactions = pd.DataFrame(values @ matrix[present][:, selected], columns=[interaction_types[i] for i in selected])
+    else:
+        df_interactions = pd.DataFrame(index=pd.RangeIndex(df.shape[0]))
+    df_pivot = pd.concat([df[index_columns].reset_index(drop=True), df_interactions], axis=1)
+    df_pivot = df_pivot.groupby(index_columns, sort=True, observed=True).sum().reset_index()
+    return df_pivot
+
+
+def build_model_input(df):
+    '''
+    Drops the features which are not required by the model from the
+    'interactions_mapped' dataframe. Returns the dataframe of the
+    'model_input' table with the dtypes of model_input_dtypes.
+    '''
+    return compact_dtypes(df.drop(NOT_FEATURES,axis=1,errors='ignore'), model_input_dtypes)
+
+
+# name of the table produced by each transform, in the order they are run
+TRANSFORM_STAGES = [('city_tier_mapped', transform_city_tier),
+                    ('categorical_variables_mapped', transform_categorical_vars),
+                    ('interactions_mapped', transform_interactions)]
+
+# table each table is built from, the mapping files and the code (or constants)
+# it depends on. Used to fingerprint the inputs of every table
+TABLE_DEPENDENCIES = {
+    'city_tier_mapped': ('loaded_data', [CITY_TIER_MAPPING], [compact_dtypes, transform_city_tier, numeric_dtypes]),
+    'categorical_variables_mapped': ('city_tier_mapped', [SIGNIFICANT_CATEGORICAL_LEVEL],
+                                     [collapse_rare_levels, transform_categorical_vars, categorical_dtypes]),
+    'interactions_mapped': ('categorical_variables_mapped', [INTERACTION_MAPPING],
+                            [interaction_mapping_matrix, transform_interactions, INDEX_COLUMNS_INFERENCE]),
+    'model_input': ('categorical_variables_mapped', [INTERACTION_MAPPING],
+                    [interaction_mapping_matrix, required_columns, transform_interactions, build_model_input,
+                     compact_dtypes, INDEX_COLUMNS_INFERENCE, NOT_FEATURES, consumer_columns['model_input'],
+                     model_input_dtypes])}
+
+###############################################################################
+# Define the fused transform engine
+# ##############################################################################
+
+
+def run_transforms(df, emit=None, columns=None):
+    '''
+    This function runs all the transforms of TRANSFORM_STAGES one after the
+    other on the same in-memory dataframe, so the data is loaded once and
+    written once instead of once per stage.
+
+
+    INPUTS
+        df : dataframe of the 'loaded_data' table
+        emit : optional function called as emit(table_name, df) with the
+               output of every stage, used to save the intermediate tables
+               for inspection and auditing
+        columns : columns of 'interactions_mapped' needed by the consumer,
+                  the interaction types which are not listed are not computed.
+                  None means all the columns
+
+
+    OUTPUT
+        Dataframe of the 'interactions_mapped' table
+
+
+    SAMPLE USAGE
+        df_interactions = run_transforms(df, emit=stage.write)
+        df_interactions = run_transforms(df, columns=model_input_schema)
+    '''
+    stages = TRANSFORM_STAGES[:-1] + [(TRANSFORM_STAGES[-1][0], partial(transform_interactions, columns=columns))]
+    for table_name, transform in stages:
+        df = transform(df)
+        if emit is not None:
+            emit(table_name, df)
+    return df
@@ -5,11 +5,17 @@
 
 import pandas as pd
 import os
-import sqlite3
-from sqlite3 import Error
-from Lead_scoring_data_pipeline.constants import DB_FILE_NAME, DB_PATH, DATA_DIRECTORY, INTERACTION_MAPPING,NOT_FEATURES, INDEX_COLUMNS_TRAINING, INDEX_COLUMNS_INFERENCE
-from Lead_scoring_data_pipeline.mapping.city_tier_mapping import city_tier_mapping
-from Lead_scoring_data_pipeline.mapping.significant_categorical_level import *
+import time
+from Lead_scoring_data_pipeline.constants import DB_FILE_NAME, DB_PATH, DATA_DIRECTORY, LEAD_SCORING_CSV, LOAD_CHUNK_SIZE, EMIT_INTERMEDIATE_TABLES, MATERIALIZE_INTERACTIONS, INCREMENTAL_MODE, INCREMENTAL_LOOKBACK_DAYS, EXECUTION_MODE, STAGING_BACKEND, PARTITION_WORKERS
+from Lead_scoring_data_pipeline.run_state import get_watermark, max_created_date, get_fingerprint, record_run, invalidate, file_fingerprint, code_fingerprint, combine_fingerprints
+from Lead_scoring_data_pipeline import schema
+from Lead_scoring_data_pipeline.schema import raw_data_dtypes, interaction_columns, numeric_dtypes, model_input_dtypes, consumer_columns
+from Lead_scoring_data_pipeline.connection import get_connection, write_table
+from Lead_scoring_data_pipeline.staging import get_staging_backend
+from Lead_scoring_data_pipeline.sql_transforms import pushdown, materialize_code
+from Lead_scoring_data_pipeline.dedup_index import create_dedup_index, deduplicate, lead_fingerprints
+from Lead_scoring_data_pipeline.partitions import PARTITIONED_MODEL_INPUT, month_partitions, transform_partitions
+from Lead_scoring_data_pipeline.transforms import compact_dtypes, transform_city_tier, transform_categorical_vars, transform_interactions, build_model_input, required_columns, run_transforms, TABLE_DEPENDENCIES
 ###############################################################################
 # Define the function to build database
 # ##############################################################################
@@ -49,8 +55,8 @@ def build_dbs():
     else:
         # Create the database file
         print('Creating Database')
-        conn = sqlite3.connect(db_file_path)
-        conn.close()
+        with get_connection(db_file_path):
+            pass
         print('New DB Created')
         return 'DB created'
 
@@ -61,44 +67,173 @@ def check_if_table_has_value(cnx,table_name):
         return True
     else:
         return False
+
+
+def loaded_data_fingerprint():
+    '''
+    Returns the fingerprint of the inputs of 'loaded_data': the content of the
+    csv file, except in INCREMENTAL_MODE where new leads are picked up through
+    the watermarks, the schema and the code loading it. Only the load task
+    hashes the csv, the other tasks start from the fingerprint it recorded
+    (see table_fingerprints).
+    '''
+    csv_path = os.path.join(DATA_DIRECTORY, LEAD_SCORING_CSV)
+    data_version = 'incremental' if INCREMENTAL_MODE else file_fingerprint(csv_path)
+    return combine_fingerprints(data_version, file_fingerprint(schema.__file__),
+                                code_fingerprint(load_data_into_db, lead_fingerprints, deduplicate))
+
+
+def table_fingerprints(conn, loaded_data=None):
+    '''
+    Returns the fingerprint of the inputs of every table of the pipeline: the
+    fingerprint of the table it is built from, the hash of the mapping files
+    and of the code it depends on (see TABLE_DEPENDENCIES). The chain starts
+    from the fingerprint 'loaded_data' was recorded with by the load task, or
+    'loaded_data' if it is given, so that the tasks downstream of the load
+    neither hash the csv again nor take a csv which was not loaded yet for
+    the content of 'loaded_data'. In the 'sql' EXECUTION_MODE the tables also
+    depend on the code generating their statements.
+    '''
+    fingerprints = {'loaded_data': loaded_data or get_fingerprint(conn, 'loaded_data') or ''}
+    for table_name, (upstream, files, code) in TABLE_DEPENDENCIES.items():
+        if EXECUTION_MODE == 'sql':
+            code = code + materialize_code(table_name)
+        fingerprints[table_name] = combine_fingerprints(fingerprints[upstream],
+                                                        *[file_fingerprint(path) for path in files],
+                                                        code_fingerprint(*code))
+    return fingerprints
+
+
+def is_current(conn, table_name, table_exists, fingerprints):
+    '''
+    Returns True if the table exists and was built from the same inputs as
+    the current ones, i.e. it does not need to be built again.
+    '''
+    return table_exists and get_fingerprint(conn, table_name) == fingerprints[table_name]
+
+
+def sql_pushdown():
+    '''
+    Returns True if the transforms are run inside the db (EXECUTION_MODE 'sql'),
+    which is only possible if the staged tables are in the db as well.
+    '''
+    if EXECUTION_MODE == 'sql' and STAGING_BACKEND != 'sqlite':
+        raise ValueError("EXECUTION_MODE 'sql' requires STAGING_BACKEND 'sqlite'")
+    return EXECUTION_MODE == 'sql'
+
+
+def lookback_start(watermark):
+    '''
+    Returns the 'created_date' after which the leads of the csv are read in
+    INCREMENTAL_MODE: INCREMENTAL_LOOKBACK_DAYS before the watermark of
+    'loaded_data', or None to read all of them.
+    '''
+    if watermark is None or INCREMENTAL_LOOKBACK_DAYS is None:
+        return None
+    return str(pd.Timestamp(watermark) - pd.Timedelta(days=INCREMENTAL_LOOKBACK_DAYS))
+
 ###############################################################################
 # Define function to load the csv file to the database
 # ##############################################################################
 
-def load_data_into_db():
+def load_data_into_db(chunksize=LOAD_CHUNK_SIZE):
     '''
     Thie function loads the data present in data directory into the db
     which was created previously.
     It also replaces any null values present in 'toal_leads_dropped' and
     'referred_lead' columns with 0.
 
+    The interaction columns are loaded with a missing click count as 0 and
+    all the numeric columns are stored with the compact dtypes of 
+    numeric_dtypes in schema.py (int16 counts, int8 flags). The leads without
+    app_complete_flag are loaded as well and counted, model_input leaves them
+    out.
+
+    The csv file is streamed in chunks of 'chunksize' rows using the dtypes
+    defined in schema.py, so the memory used by the function does not grow
+    with the size of the file. The table is only replaced once all the chunks
+    have been written, i.e. either the whole file is loaded or nothing is.
+
+    In INCREMENTAL_MODE only the leads which are not loaded yet are appended
+    to the table and the watermark of 'loaded_data' (the latest
+    'created_date' loaded so far) is moved forward. The leads created up to
+    INCREMENTAL_LOOKBACK_DAYS before the watermark are read as well, so that
+    a lead reaching the csv after later ones is not dropped. As the tables
+    built from 'loaded_data' only pick up the leads created after their own
+    watermark, they are built again from scratch on their next run when such
+    late leads are loaded.
+
+    Duplicated leads are dropped while loading: the fingerprint of every raw
+    lead is looked up in the dedup index of the db (see dedup_index.py), which
+    holds the fingerprints of all the leads loaded so far, so a lead loaded
+    again on a later run is dropped as well. The leads which are only
+    duplicated once mapped are kept, map_categorical_vars drops them.
+
 
     INPUTS
         DB_FILE_NAME : Name of the database file
         DB_PATH : path where the db file should be
         DATA_DIRECTORY : path of the directory where 'leadscoring.csv' 
                         file is present
+        chunksize : number of rows to read and write at a time
+        INCREMENTAL_MODE : if True only the new leads are loaded
         
 
     OUTPUT
-        Saves the processed dataframe in the db in a table named 'loaded_data'.
-        If the table with the same name already exsists then the function 
-        replaces it.
+        Saves the processed dataframe in a table named 'loaded_data' of the 
+        staging backend. If the table with the same name already exsists and 
+        was built from the same csv and code (see loaded_data_fingerprint) then the 
+        function does nothing, or appends the new leads in INCREMENTAL_MODE.
+        Prints the number of rows loaded and the rows/sec.
 
 
     SAMPLE USAGE
         load_data_into_db()
     '''
-    # Build connection string
-    conn_string = os.path.join(DB_PATH, DB_FILE_NAME)
-    conn = sqlite3.connect(conn_string)
-    data = pd.read_csv(os.path.join(DATA_DIRECTORY, 'leadscoring_inference.csv'), index_col=[0])
-    data['total_leads_droppped'] = data['total_leads_droppped'].fillna(0)
-    data['referred_lead']= data['referred_lead'].fillna(0)
-    if not check_if_table_has_value(conn,'loaded_data'):
-        print('test')
-        data.to_sql(name="loaded_data",con=conn,if_exists='replace',index=False)
-    conn.close()
+    with get_connection() as conn:
+        stage = get_staging_backend(conn)
+        fingerprints = table_fingerprints(conn, loaded_data_fingerprint())
+        table_exists = is_current(conn, 'loaded_data', stage.exists('loaded_data'), fingerprints)
+        if INCREMENTAL_MODE or not table_exists:
+            start = time.perf_counter()
+            rows_loaded = unlabeled_rows = late_rows = 0
+            watermark = get_watermark(conn, 'loaded_data') if INCREMENTAL_MODE and table_exists else None
+            since = lookback_start(watermark)
+            new_watermark = watermark
+            reader = pd.read_csv(os.path.join(DATA_DIRECTORY, LEAD_SCORING_CSV), index_col=[0],
+                                 dtype=raw_data_dtypes, chunksize=chunksize)
+            with stage.writer('loaded_data', append=watermark is not None) as write_chunk:
+                create_dedup_index(conn, replace=watermark is None)
+                for chunk in reader:
+                    if since is not None:
+                        chunk = chunk[chunk['created_date'] > since]
+                    chunk['total_leads_droppped'] = chunk['total_leads_droppped'].fillna(0)
+                    chunk['referred_lead'] = chunk['referred_lead'].fillna(0)
+                    chunk[interaction_columns] = chunk[interaction_columns].fillna(0)
+                    chunk = compact_dtypes(chunk, numeric_dtypes)
+                    chunk = deduplicate(conn, chunk)
+                    if chunk.shape[0]:
+                        write_chunk(chunk)
+                    rows_loaded += chunk.shape[0]
+                    if 'app_complete_flag' in chunk.columns:
+                        unlabeled_rows += int(chunk['app_complete_flag'].isna().sum())
+                    if watermark is not None:
+                        late_rows += int((chunk['created_date'] <= watermark).sum())
+                    new_watermark = max_created_date(chunk, new_watermark)
+                record_run(conn, 'loaded_data', new_watermark, fingerprints['loaded_data'])
+                if late_rows:
+                    invalidate(conn, TABLE_DEPENDENCIES)
+            conn.commit()
+            elapsed = time.perf_counter() - start
+            print(f'Loaded {rows_loaded} rows into loaded_data in {elapsed:.2f}s '
+                  f'({rows_loaded / max(elapsed, 1e-9):.0f} rows/sec)')
+            if late_rows:
+                print(f'{late_rows} of the leads loaded were created before the watermark of loaded_data, '
+                      f'the tables built from it are built again')
+            if unlabeled_rows:
+                # the aggregation of interactions_mapping drops the null keys
+                print(f'{unlabeled_rows} of the leads loaded have no app_complete_flag, '
+                      f'they are left out of model_input')
 
 ###############################################################################
 # Define function to map cities to their respective tiers
@@ -118,28 +253,36 @@ def map_city_tier():
         DB_FILE_NAME : Name of the database file
         DB_PATH : path where the db file should be
         city_tier_mapping : a dictionary that maps the cities to their tier
+        EXECUTION_MODE : 'pandas' or 'sql', in which case the table is built by
+                         an INSERT ... SELECT statement of sql_transforms.py
 
     
     OUTPUT
-        Saves the processed dataframe in the db in a table named
+        Saves the processed dataframe in the staging backend in a table named
         'city_tier_mapped'. If the table with the same name already 
-        exsists then the function replaces it.
+        exsists and its inputs did not change (see table_fingerprints) then the
+        function does nothing, or appends the leads loaded since its last run 
+        in INCREMENTAL_MODE.
 
     
     SAMPLE USAGE
         map_city_tier()
 
     '''
-    # Build connection string
-    db_file_path = f"{DB_PATH}/{DB_FILE_NAME}"
-    conn = sqlite3.connect(db_file_path)
-    if not check_if_table_has_value(conn,'city_tier_mapped'):
-        df = pd.read_sql_query("select * from loaded_data" ,conn)
-        df["city_tier"] = df["city_mapped"].map(city_tier_mapping)
-        df['city_tier']=df['city_tier'].fillna(3.0)
-        df=df.drop('city_mapped',axis=1)
-        df.to_sql(name="city_tier_mapped",con=conn,if_exists='replace',index=False)
-    conn.close()
+    with get_connection() as conn:
+        stage = get_staging_backend(conn)
+        fingerprints = table_fingerprints(conn)
+        table_exists = is_current(conn, 'city_tier_mapped', stage.exists('city_tier_mapped'), fingerprints)
+        if INCREMENTAL_MODE or not table_exists:
+            if sql_pushdown():
+                watermark = pushdown(conn, 'loaded_data', 'city_tier_mapped',
+                                     target_watermark(conn, 'city_tier_mapped', table_exists))
+            else:
+                df, append, watermark = read_source(conn, stage, 'loaded_data', 'city_tier_mapped', table_exists)
+                df = transform_city_tier(df)
+                save_stage(stage, 'city_tier_mapped', df, append)
+            record_run(conn, 'city_tier_mapped', watermark, fingerprints['city_tier_mapped'])
+            conn.commit()
 
 ###############################################################################
 # Define function to map insignificant categorial variables to "others"
@@ -166,39 +309,35 @@ def map_categorical_vars():
                  file. The significant levels are calculated by taking top 90
                  percentils of all the levels. For more information refer
                  'data_cleaning.ipynb' notebook.
-  
+        EXECUTION_MODE : 'pandas' or 'sql', in which case the table is built by
+                         an INSERT ... SELECT statement of sql_transforms.py
 
+    
     OUTPUT
-        Saves the processed dataframe in the db in a table named
+        Saves the processed dataframe in the staging backend in a table named
         'categorical_variables_mapped'. If the table with the same name already 
-        exsists then the function replaces it.
+        exsists and its inputs did not change (see table_fingerprints) then the
+        function does nothing, or appends the leads mapped since its last run 
+        in INCREMENTAL_MODE.
 
     
     SAMPLE USAGE
         map_categorical_vars()
     '''
-    db_file_path = f"{DB_PATH}/{DB_FILE_NAME}"
-    conn = sqlite3.connect(db_file_path)
-    if not check_if_table_has_value(conn,"categorical_variables_mapped"):
-            df = pd.read_sql("select * from city_tier_mapped",conn)
-            new_df=df[~df['first_platform_c'].isin(list_platform)]
-            new_df['first_platform_c']="others"
-            old_df = df[df['first_platform_c'].isin(list_platform)]
-            df = pd.concat([new_df,old_df])
-
-            new_df=df[~df['first_utm_medium_c'].isin(list_medium)]
-            new_df['first_utm_medium_c']="others"
-            old_df = df[df['first_utm_medium_c'].isin(list_medium)]
-            df = pd.concat([new_df,old_df])
-
-            new_df=df[~df['first_utm_source_c'].isin(list_source)]
-            new_df['first_utm_source_c']="others"
-            old_df = df[df['first_utm_source_c'].isin(list_source)]
-            df = pd.concat([new_df,old_df])
-            
-            df = df.drop_duplicates()
-            df.to_sql("categorical_variables_mapped",con=conn,if_exists='replace',index=False)
-    conn.close()
+    with get_connection() as conn:
+        stage = get_staging_backend(conn)
+        fingerprints = table_fingerprints(conn)
+        table_exists = is_current(conn, 'categorical_variables_mapped', stage.exists('categorical_variables_mapped'), fingerprints)
+        if INCREMENTAL_MODE or not table_exists:
+            if sql_pushdown():
+                watermark = pushdown(conn, 'city_tier_mapped', 'categorical_variables_mapped',
+                                     target_watermark(conn, 'categorical_variables_mapped', table_exists))
+            else:
+                df, append, watermark = read_source(conn, stage, 'city_tier_mapped', 'categorical_variables_mapped', table_exists)
+                df = transform_categorical_vars(df)
+                save_stage(stage, 'categorical_variables_mapped', df, append)
+            record_run(conn, 'categorical_variables_mapped', watermark, fingerprints['categorical_variables_mapped'])
+            conn.commit()
 
 ##############################################################################
 # Define function that maps interaction columns into 4 types of interactions
@@ -219,6 +358,8 @@ def interactions_mapping():
         INDEX_COLUMNS_INFERENCE: list of columns to be used as index while pivoting and
                                  unpivoting during inference
         NOT_FEATURES: Features which have less significance and needs to be dropped
+        EXECUTION_MODE : 'pandas' or 'sql', in which case the tables are built by
+                         INSERT ... SELECT statements of sql_transforms.py
                                  
         NOTE : Since while inference we will not have 'app_complete_flag' which is
         our label, we will have to exculde it from our features list. It is recommended 
@@ -229,37 +370,302 @@ def interactions_mapping():
 
     
     OUTPUT
-        Saves the processed dataframe in the db in a table named 
-        'interactions_mapped'. If the table with the same name already exsists then 
-        the function replaces it.
+        Saves the processed dataframe in the staging backend in a table named 
+        'interactions_mapped' if MATERIALIZE_INTERACTIONS is set. If the table 
+        with the same name already exsists then the function replaces it.
         
         It also drops all the features that are not requried for training model and 
-        writes it in a table named 'model_input'
+        writes it in a table named 'model_input' in the db. If 'interactions_mapped'
+        is not materialized only the columns of 'categorical_variables_mapped' that 
+        model_input needs are read and the interaction types are not computed, use
+        get_interactions_mapped() to build 'interactions_mapped' when it is needed.
+        Nothing is done if the tables exist and their inputs did not change (see
+        table_fingerprints). In INCREMENTAL_MODE only the leads mapped since the 
+        last run are processed and appended to the tables.
 
     
     SAMPLE USAGE
         interactions_mapping()
     '''
-    db_file_path = f"{DB_PATH}/{DB_FILE_NAME}"
-    conn = sqlite3.connect(db_file_path)
-    print("saving into model_input")
-    if not check_if_table_has_value(conn,'interactions_mapped'):
-            df = pd.read_sql("select * from categorical_variables_mapped",conn)
-            df = df.drop_duplicates()
-            df_event_mapping = pd.read_csv(INTERACTION_MAPPING,index_col=[0])
-            # check if app_complete_flag is in df.columns
-            df_unpivot=pd.melt(df,id_vars=INDEX_COLUMNS_TRAINING,var_name='interaction_type',value_name='interaction_value')
-            df_unpivot['interaction_value'] = df_unpivot['interaction_value'].fillna(0)
-            df=pd.merge(df_unpivot,df_event_mapping,how='left',on='interaction_type')
-            df = df.drop('interaction_type',axis=1)
-            df_pivot = df.pivot_table(values='interaction_value', index=INDEX_COLUMNS_INFERENCE, columns='interaction_mapping', aggfunc='sum')
-            df_pivot = df_pivot.reset_index()
-            df_pivot.to_sql('interactions_mapped',con=conn,if_exists='replace',index=False)     
-            df_model_input = df_pivot.drop(NOT_FEATURES,axis=1)
-            print("saving into model_input")
-            df_model_input.to_sql('model_input',con=conn,if_exists='replace',index=False)
-            
-            
-    conn.close()                              
+    with get_connection() as conn:
+        stage = get_staging_backend(conn)
+        fingerprints = table_fingerprints(conn)
+        if MATERIALIZE_INTERACTIONS:
+            table_exists = is_current(conn, 'interactions_mapped', stage.exists('interactions_mapped'), fingerprints) and \
+                           is_current(conn, 'model_input', check_if_table_has_value(conn,'model_input'), fingerprints)
+            if INCREMENTAL_MODE or not table_exists:
+                if sql_pushdown():
+                    since = target_watermark(conn, 'model_input', table_exists)
+                    pushdown(conn, 'categorical_variables_mapped', 'interactions_mapped', since)
+                    watermark = pushdown(conn, 'categorical_variables_mapped', 'model_input', since)
+                else:
+                    df, append, watermark = read_source(conn, stage, 'categorical_variables_mapped', 'model_input', table_exists)
+                    df_pivot = transform_interactions(df)
+                    save_stage(stage, 'interactions_mapped', df_pivot, append)
+                    df_model_input = build_model_input(df_pivot)
+                    print("saving into model_input")
+                    save_model_input(conn, df_model_input, append)
+                record_run(conn, 'interactions_mapped', watermark, fingerprints['interactions_mapped'])
+                record_run(conn, 'model_input', watermark, fingerprints['model_input'])
+                conn.commit()
+        else:
+            table_exists = is_current(conn, 'model_input', check_if_table_has_value(conn,'model_input'), fingerprints)
+            if INCREMENTAL_MODE or not table_exists:
+                if sql_pushdown():
+                    watermark = pushdown(conn, 'categorical_variables_mapped', 'model_input',
+                                         target_watermark(conn, 'model_input', table_exists))
+                else:
+                    columns = consumer_columns['model_input']
+                    df, append, watermark = read_source(conn, stage, 'categorical_variables_mapped', 'model_input',
+                                                        table_exists, required_columns(columns))
+                    df_model_input = build_model_input(transform_interactions(df, columns=columns))
+                    print("saving into model_input")
+                    save_model_input(conn, df_model_input, append)
+                record_run(conn, 'model_input', watermark, fingerprints['model_input'])
+                conn.commit()
+
+
+def read_required_columns(stage, table_name, columns, since=None):
+    '''
+    Reads only the given columns of a staged table, the columns which are not
+    present in the table are ignored. columns=None reads all of them. If since
+    is given only the rows created after it are read. The numeric columns are
+    returned with their compact dtypes.
+    '''
+    if columns is not None:
+        columns = [column for column in stage.columns(table_name) if column in columns]
+    # the sqlite backend does not keep the compact dtypes
+    return compact_dtypes(stage.read(table_name, columns=columns, since=since), numeric_dtypes)
 
-    
+
+def target_watermark(conn, target, target_exists):
+    '''
+    Returns the watermark of 'target' in INCREMENTAL_MODE once it exists, i.e.
+    the 'created_date' after which the rows still have to be processed, else
+    None (all the rows have to be processed).
+    '''
+    return get_watermark(conn, target) if INCREMENTAL_MODE and target_exists else None
+
+
+def read_source(conn, stage, source, target, target_exists, columns=None):
+    '''
+    Reads the rows of the staged 'source' table that still have to be processed
+    into 'target'. In INCREMENTAL_MODE, once 'target' exists, these are the rows
+    created after the watermark of 'target', otherwise all of them.
+
+
+    OUTPUT
+        Tuple of (rows to process, whether the result has to be appended to
+        'target', watermark of 'target' once the rows are processed)
+    '''
+    watermark = target_watermark(conn, target, target_exists)
+    df = read_required_columns(stage, source, columns, since=watermark)
+    print(f"{df.shape[0]} leads of {source} to process into {target}")
+    return df, watermark is not None, max_created_date(df, watermark)
+
+
+def save_stage(stage, table_name, df, append):
+    '''
+    Appends the dataframe to the staged table if append is set, else replaces
+    the table with it.
+    '''
+    if not append:
+        stage.write(table_name, df)
+    elif df.shape[0]:
+        stage.append(table_name, df)
+
+
+def save_model_input(conn, df, append):
+    '''
+    Appends the dataframe to the 'model_input' table of the db if append is
+    set, else replaces the table with it.
+    '''
+    write_table(conn, 'model_input', df, append=append)
+
+
+def get_interactions_mapped():
+    '''
+    This function returns the 'interactions_mapped' table. If it has not been
+    materialized yet it is built from 'categorical_variables_mapped' (or from
+    'loaded_data' if that is not staged either) and saved in the staging backend.
+
+
+    INPUTS
+        DB_FILE_NAME: Name of the database file
+        DB_PATH : path where the db file should be present
+
+
+    OUTPUT
+        Dataframe of the 'interactions_mapped' table
+
+
+    SAMPLE USAGE
+        df = get_interactions_mapped()
+    '''
+    with get_connection() as conn:
+        stage = get_staging_backend(conn)
+        if stage.exists('interactions_mapped'):
+            df_pivot = stage.read('interactions_mapped')
+        else:
+            if stage.exists('categorical_variables_mapped'):
+                df_pivot = transform_interactions(stage.read('categorical_variables_mapped'))
+            else:
+                df_pivot = run_transforms(stage.read('loaded_data'))
+            stage.write('interactions_mapped', df_pivot)
+    return df_pivot
+
+##############################################################################
+# Define function that runs all the transforms of the pipeline as a single task
+# #############################################################################
+def run_fused_transforms():
+    '''
+    This function runs map_city_tier, map_categorical_vars and interactions_mapping
+    as a single in-memory pipeline: 'loaded_data' is read once, all the transforms
+    of transforms.py are applied to the same dataframe and 'model_input' is 
+    written once, instead of reading and writing the full table in every stage.
+
+
+    INPUTS
+        DB_FILE_NAME: Name of the database file
+        DB_PATH : path where the db file should be present
+        EMIT_INTERMEDIATE_TABLES : if True the output of every stage is also 
+                                   saved in the staging backend under the same
+                                   table name the separate tasks use
+        MATERIALIZE_INTERACTIONS : if False 'interactions_mapped' is neither
+                                   computed nor saved, only 'model_input'
+        INCREMENTAL_MODE : if True only the leads loaded since the last run
+                           are transformed and appended to the tables
+        EXECUTION_MODE : if 'sql' the tables are built inside the db, see
+                         fused_pushdown
+
+
+    OUTPUT
+        Saves 'city_tier_mapped' and 'categorical_variables_mapped' in the staging
+        backend if EMIT_INTERMEDIATE_TABLES is set, 'interactions_mapped' if 
+        MATERIALIZE_INTERACTIONS is set and 'model_input' in the db. If 
+        'model_input' already exists and its inputs did not change (see 
+        table_fingerprints) the function does nothing, unless in
+        INCREMENTAL_MODE. When the
+        intermediate tables are not emitted only the columns of 'loaded_data' 
+        that are needed are read.
+
+
+    SAMPLE USAGE
+        run_fused_transforms()
+    '''
+    with get_connection() as conn:
+        stage = get_staging_backend(conn)
+        fingerprints = table_fingerprints(conn)
+        table_exists = is_current(conn, 'model_input', check_if_table_has_value(conn,'model_input'), fingerprints)
+        if INCREMENTAL_MODE or not table_exists:
+            if sql_pushdown():
+                watermark = fused_pushdown(conn, fingerprints, target_watermark(conn, 'model_input', table_exists))
+            else:
+                columns = None if MATERIALIZE_INTERACTIONS else consumer_columns['model_input']
+                read_columns = None if EMIT_INTERMEDIATE_TABLES else required_columns(columns)
+                df, append, watermark = read_source(conn, stage, 'loaded_data', 'model_input', table_exists, read_columns)
+
+                def emit(table_name, df):
+                    if (table_name == 'interactions_mapped' and MATERIALIZE_INTERACTIONS) or \
+                            (table_name != 'interactions_mapped' and EMIT_INTERMEDIATE_TABLES):
+                        save_stage(stage, table_name, df, append)
+                        record_run(conn, table_name, watermark, fingerprints[table_name])
+
+                df_pivot = run_transforms(df, emit=emit, columns=columns)
+                df_model_input = build_model_input(df_pivot)
+                print("saving into model_input")
+                save_model_input(conn, df_model_input, append)
+            record_run(conn, 'model_input', watermark, fingerprints['model_input'])
+            conn.commit()
+
+
+def fused_pushdown(conn, fingerprints, since=None):
+    '''
+    Builds the tables of run_fused_transforms inside the db. The tables which
+    are not emitted are not materialized, they are inlined in the statement
+    of the next table that is (see sql_transforms.pushdown). The transaction is
+    left open for the caller to record 'model_input' and commit.
+
+
+    OUTPUT
+        The latest 'created_date' processed into 'model_input'
+    '''
+    source = 'loaded_data'
+    intermediate_tables = ['city_tier_mapped', 'categorical_variables_mapped'] if EMIT_INTERMEDIATE_TABLES else []
+    for table_name in intermediate_tables + (['interactions_mapped'] if MATERIALIZE_INTERACTIONS else []):
+        watermark = pushdown(conn, source, table_name, since)
+        record_run(conn, table_name, watermark, fingerprints[table_name])
+        if table_name in intermediate_tables:
+            source = table_name
+    return pushdown(conn, source, 'model_input', since)
+
+##############################################################################
+# Define function that runs the transforms of every month in parallel
+# #############################################################################
+def run_partitioned_transforms(months=None):
+    '''
+    This function runs the transforms of run_fused_transforms on every month of
+    leads (by 'created_date') in a pool of processes. Every month is written
+    to its own partition of the staged tables, so a month which failed (or 
+    whose leads were corrected) can be run again alone. 'model_input' is then
+    rebuilt in the db from the partitions of all the months. Leads without
+    'created_date' are not processed.
+
+
+    INPUTS
+        months : list of months ('YYYY-MM') to run again. None runs all of them,
+                 or in INCREMENTAL_MODE the months of the leads loaded since
+                 the last run
+        PARTITION_WORKERS : number of processes, None means one per cpu
+        EMIT_INTERMEDIATE_TABLES : if True 'city_tier_mapped' and 
+                                   'categorical_variables_mapped' are staged
+        MATERIALIZE_INTERACTIONS : if True 'interactions_mapped' is staged
+        STAGING_BACKEND : must be 'parquet' or 'arrow'
+
+
+    OUTPUT
+        Saves the staged tables by month and 'model_input' in the db. If 
+        'model_input' already exists and its inputs did not change (see 
+        table_fingerprints) and no months are given the function does nothing,
+        unless in INCREMENTAL_MODE. Prints the number of leads of every month.
+
+
+    SAMPLE USAGE
+        run_partitioned_transforms()
+        run_partitioned_transforms(months=['2021-07'])
+    '''
+    if STAGING_BACKEND == 'sqlite':
+        raise ValueError("The partitioned transforms require STAGING_BACKEND 'parquet' or 'arrow'")
+    with get_connection() as conn:
+        stage = get_staging_backend(conn)
+        fingerprints = table_fingerprints(conn)
+        table_exists = is_current(conn, 'model_input', check_if_table_has_value(conn,'model_input'), fingerprints) \
+            and stage.exists(PARTITIONED_MODEL_INPUT)
+        created_dates = stage.read('loaded_data', columns=['created_date'])['created_date']
+        if months is None:
+            if table_exists and not INCREMENTAL_MODE:
+                return
+            watermark = target_watermark(conn, 'model_input', table_exists)
+            if watermark is None:
+                months = month_partitions(created_dates)
+                for table_name in TABLE_DEPENDENCIES.keys() | {PARTITIONED_MODEL_INPUT}:
+                    stage.drop(table_name)
+            else:
+                months = month_partitions(created_dates[created_dates > watermark])
+        elif not stage.partitions(PARTITIONED_MODEL_INPUT):
+            raise ValueError('Run all the months once before running some of them again')
+
+        tables = (['city_tier_mapped', 'categorical_variables_mapped'] if EMIT_INTERMEDIATE_TABLES else []) + \
+                 (['interactions_mapped'] if MATERIALIZE_INTERACTIONS else [])
+        rows = transform_partitions(stage, months, PARTITION_WORKERS, EMIT_INTERMEDIATE_TABLES, MATERIALIZE_INTERACTIONS)
+        for month, n_rows in rows.items():
+            print(f"{n_rows} leads of {month} processed")
+
+        df_model_input = pd.concat([stage.read(PARTITIONED_MODEL_INPUT, partition=month)
+                                    for month in stage.partitions(PARTITIONED_MODEL_INPUT)], ignore_index=True)
+        print("saving into model_input")
+        save_model_input(conn, compact_dtypes(df_model_input, model_input_dtypes), append=False)
+        watermark = max_created_date(created_dates.to_frame())
+        for table_name in tables + ['model_input']:
+            record_run(conn, table_name, watermark, fingerprints[table_name])
+        conn.commit()
@@ -0,0 +1,77 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+import os
+import tempfile
+import time
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+from Lead_scoring_training_pipeline.constants import model_config
+from Lead_scoring_inference_pipeline.tree_scorer import TreeScorer
+
+###############################################################################
+# Define the benchmark of the scoring backends of the inference pipeline
+# ##############################################################################
+
+
+def benchmark_tree_scorer(n_rows=200_000, n_leads=200, seed=0):
+    '''
+    This function trains the LightGBM model of the training pipeline, with
+    its model_config, on synthetic one hot encoded leads and scores them with
+    the scoring backends of get_models_prediction: the mlflow pyfunc model,
+    the LightGBM booster and the TreeScorer compiled from it. It prints the largest difference
+    of the probabilities, the throughput of scoring the whole batch and the
+    latency of scoring a single lead. Without mlflow, the pyfunc model is
+    replaced by what it runs once the schema is enforced: booster.predict on
+    a dataframe.
+
+
+    INPUTS
+        n_rows : number of leads of the batch
+        n_leads : number of single leads scored one by one
+        seed : seed of the synthetic leads
+
+
+    OUTPUT
+        Prints one line per scorer
+
+
+    SAMPLE USAGE
+        benchmark_tree_scorer(n_rows=50_000)
+    '''
+    rng = np.random.default_rng(seed)
+    X = (rng.random((n_rows, 40)) < 0.1).astype('uint8')
+    y = (X[:, :8].sum(axis=1) + rng.normal(0, 1, n_rows) > 1).astype(int)
+    booster = lgb.LGBMClassifier(**model_config, verbose=-1).fit(X, y).booster_
+    try:
+        import mlflow.lightgbm
+        import mlflow.pyfunc
+        model_path = os.path.join(tempfile.mkdtemp(), 'model')
+        mlflow.lightgbm.save_model(booster, model_path)
+        pyfunc_model = mlflow.pyfunc.load_model(model_path)
+        scorers = [('pyfunc', pyfunc_model.predict)]
+    except ImportError:
+        scorers = [('booster.predict(df)', lambda rows: booster.predict(pd.DataFrame(rows)))]
+    scorers.append(('booster.predict', booster.predict))
+    scorers.append(('TreeScorer', TreeScorer.from_booster(booster).predict))
+    reference = booster.predict(X)
+    for name, predict in scorers:
+        start = time.perf_counter()
+        scores = np.asarray(predict(X), dtype='float64')
+        batch_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(n_leads):
+            predict(X[i:i + 1])
+        lead_time = (time.perf_counter() - start) / n_leads
+        print(f'{name:>19} {len(booster.dump_model()["tree_info"])} trees: '
+              f'{n_rows / batch_time:10,.0f} leads/s batch, {lead_time * 1000:6.3f}ms per lead, '
+              f'max difference {np.abs(scores - reference).max():.1e}')
+
+
+if __name__ == '__main__':
+    benchmark_tree_scorer()
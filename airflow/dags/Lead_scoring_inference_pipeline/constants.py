@@ -7,11 +7,21 @@ FILE_PATH= "/home/airflow/dags/Lead_scoring_inference_pipeline/"
 
 TRACKING_URI = "http://0.0.0.0:6007"
 
-# experiment, model name and stage to load the model from mlflow model registry
-# MODEL_NAME = 
-# STAGE = 
+# experiment, model name and alias of the version to load from mlflow model
+# registry. If MODEL_NAME is None the model of MODEL_PATH is loaded instead
+MODEL_NAME = None
+MODEL_ALIAS = 'production'
 # EXPERIMENT = 
 MODEL_PATH ="/home/mlruns/1/b1645b3347414b2ea0346ef1e22a2cd3/artifacts/models/" 
+# local copies of the registered versions of MODEL_NAME, checked against the
+# sha256 of their artifacts. The MODEL_CACHE_SIZE most recently used versions
+# are kept on disk and as many models stay loaded in a long-lived process, so
+# that a model is only downloaded and loaded again once MODEL_ALIAS moves to
+# another version or its artifacts change (see model_cache.py). The local
+# copies only apply when MODEL_NAME is set, and the loaded models only help a
+# process which scores more than once: an airflow task runs in a new process
+MODEL_CACHE_DIRECTORY = '/home/airflow/dags/Lead_scoring_inference_pipeline/model_cache/'
+MODEL_CACHE_SIZE = 2
 # list of the features that needs to be there in the final encoded dataframe
 ONE_HOT_ENCODED_FEATURES = ['total_leads_droppped', 'referred_lead', 'city_tier_1.0',
        'city_tier_2.0', 'city_tier_3.0', 'first_platform_c_Level0',
@@ -35,3 +45,31 @@ ONE_HOT_ENCODED_FEATURES = ['total_leads_droppped', 'referred_lead', 'city_tier_
 
 # list of features that need to be one-hot encoded
 FEATURES_TO_ENCODE = ['city_tier','first_platform_c','first_utm_medium_c','first_utm_source_c']
+# encode the features as a scipy.sparse CSR matrix, which only stores the few
+# non-zero values of every row, instead of a dense one. The 'features_inference'
+# table is then not written, the matrix is only published in the feature store
+SPARSE_FEATURES = False
+# score a model trained with CATEGORICAL_FEATURES set in the training pipeline:
+# FEATURES_TO_ENCODE are coded with the code dictionaries read from the
+# metadata of the model instead of being one hot encoded
+CATEGORICAL_FEATURES = False
+# number of rows of 'predicted_data' built and written at a time
+PREDICTION_CHUNK_SIZE = 50000
+# the models are LightGBM boosters predicting the probability that the lead
+# completes the application, a lead is predicted 1 above the threshold
+PREDICTION_THRESHOLD = 0.5
+# cpu budget of the scoring task (see Lead_scoring_common/cpu_budget.py): the
+# cores available to the worker are shared by the CPU_POOL_SLOTS tasks of its
+# airflow pool which may run at once, at most MAX_THREADS_PER_TASK threads
+# (None for no cap)
+CPU_POOL_SLOTS = 1
+MAX_THREADS_PER_TASK = None
+# how get_models_prediction loads the model of MODEL_PATH and scores the leads:
+# 'pyfunc' with the mlflow pyfunc model, 'booster' with the LightGBM booster
+# (predict on the matrix, without the pyfunc wrapper and its dataframe) or
+# 'numpy' with the TreeScorer compiled from the booster (see tree_scorer.py),
+# which only needs numpy to score. 'booster' and 'numpy' require the model to
+# be a LightGBM model (logged with the lightgbm flavor, or a LGBMClassifier
+# logged with the sklearn flavor like the baseline model), the other models are
+# scored with 'pyfunc'. See benchmarks.py for their throughput and latency
+SCORING_BACKEND = 'pyfunc'
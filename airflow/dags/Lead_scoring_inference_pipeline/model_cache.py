@@ -0,0 +1,146 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+from Lead_scoring_inference_pipeline.constants import MODEL_CACHE_DIRECTORY, MODEL_CACHE_SIZE
+
+###############################################################################
+# Define the functions to keep the model of the inference pipeline on disk and
+# loaded between runs, until the version in production changes
+# ##############################################################################
+
+# file of a local copy of a model holding the sha256 of its artifacts
+CHECKSUM_FILE = 'artifacts.sha256'
+
+# models loaded by this process by cache key, the most recently used last
+loaded_models = OrderedDict()
+
+
+def artifacts_sha256(directory):
+    '''
+    Returns the sha256 of the artifacts of a model directory: the relative
+    paths and the content of its files, but CHECKSUM_FILE.
+    '''
+    digest = hashlib.sha256()
+    for root, directories, files in os.walk(directory):
+        directories.sort()
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            relative_path = os.path.relpath(path, directory)
+            if relative_path == CHECKSUM_FILE:
+                continue
+            digest.update(relative_path.encode())
+            with open(path, 'rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def artifacts_stat(directory):
+    '''
+    Returns the name, size and modification time of the files at the top of
+    a model directory (MLmodel, the model file, ...), a key which changes
+    with the model without reading its artifacts.
+    '''
+    return tuple(sorted((entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+                        for entry in os.scandir(directory) if entry.is_file()))
+
+
+def evict_model_directories(directory, keep):
+    '''
+    Removes the least recently used local copies of the models but the
+    'keep' most recently used ones.
+    '''
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if not name.startswith('.')]
+    for path in sorted(paths, key=os.path.getmtime)[:max(len(paths) - keep, 0)]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def cached_model_directory(model_name, version, download, directory=MODEL_CACHE_DIRECTORY):
+    '''
+    This function returns the local copy of a version of a registered model.
+    The first time a version is requested its artifacts are downloaded to a
+    temporary directory, their sha256 is written to CHECKSUM_FILE and the
+    directory is renamed to '<model_name>-<version>'. The later calls return
+    the local copy without downloading it again, as long as its artifacts
+    still match their sha256. Only the MODEL_CACHE_SIZE most recently used
+    versions are kept.
+
+
+    INPUTS
+        model_name, version : registered model name and version
+        download : function downloading the artifacts of the version into the
+                   directory it is given and returning the path of the model
+        directory : directory of the local copies, MODEL_CACHE_DIRECTORY by default
+
+
+    OUTPUT
+        Tuple of (path of the local copy, sha256 of its artifacts, True if it
+        was found in the cache)
+
+
+    SAMPLE USAGE
+        path, checksum, hit = cached_model_directory('LightGBM', 3, download)
+    '''
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{model_name}-{version}')
+    checksum_path = os.path.join(path, CHECKSUM_FILE)
+    if os.path.exists(checksum_path):
+        with open(checksum_path) as f:
+            checksum = f.read().strip()
+        if artifacts_sha256(path) == checksum:
+            os.utime(path)
+            return path, checksum, True
+        print(f"local copy of version {version} of model '{model_name}' does not match its checksum, "
+              f"downloading it again")
+    # downloaded next to the local copies first, a reader never sees a
+    # partial copy
+    download_directory = tempfile.mkdtemp(prefix='.download-', dir=directory)
+    try:
+        model_path = download(download_directory)
+        checksum = artifacts_sha256(model_path)
+        with open(os.path.join(model_path, CHECKSUM_FILE), 'w') as f:
+            f.write(checksum)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(model_path, path)
+    finally:
+        shutil.rmtree(download_directory, ignore_errors=True)
+    evict_model_directories(directory, MODEL_CACHE_SIZE)
+    return path, checksum, False
+
+
+def cached_model(key, load):
+    '''
+    This function returns the model loaded by this process under the key,
+    e.g. the name, version and sha256 of the model, and loads it with 'load'
+    if it is not. Only the MODEL_CACHE_SIZE most recently used models are
+    kept, which only helps a process scoring more than once (e.g. a
+    long-lived worker).
+
+
+    INPUTS
+        key : hashable key of the model, which must change with its artifacts
+        load : function returning the loaded model
+
+
+    OUTPUT
+        Tuple of (model, True if it was already loaded)
+
+
+    SAMPLE USAGE
+        predict, hit = cached_model(('LightGBM', 3, checksum), load_predict)
+    '''
+    if key in loaded_models:
+        loaded_models.move_to_end(key)
+        return loaded_models[key], True
+    model = load()
+    loaded_models[key] = model
+    while len(loaded_models) > MODEL_CACHE_SIZE:
+        loaded_models.popitem(last=False)
+    return model, False
@@ -0,0 +1,188 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+import numpy as np
+from scipy import sparse
+
+###############################################################################
+# Define the scorer evaluating a LightGBM booster with numpy, without the
+# mlflow pyfunc wrapper and the dataframes it builds
+# ##############################################################################
+
+# missing_type of the nodes of LightGBM's dump_model
+MISSING_TYPES = {'None': 0, 'Zero': 1, 'NaN': 2}
+# LightGBM treats the values in [-K_ZERO_THRESHOLD, K_ZERO_THRESHOLD] as zero
+K_ZERO_THRESHOLD = 1e-35
+
+
+class TreeScorer:
+    '''
+    Scorer of a binary LightGBM booster compiled into flat numpy arrays. The
+    splits of all the trees are numbered one after the other and every split
+    holds its feature, threshold, missing value handling and the indexes of
+    its two children, a leaf being stored as the bitwise complement of its
+    index in leaf_value. A batch is scored level by level: every (row, tree)
+    pair starts at the root of the tree and moves down one level per step,
+    the pairs reaching a leaf add its value to the raw score of their row and
+    are dropped, until no pair is left. The raw scores then go through the
+    sigmoid of the objective. Numerical splits follow LightGBM's
+    NumericalDecision and categorical splits (models trained with
+    CATEGORICAL_FEATURES) its CategoricalDecision, so that the probabilities
+    match booster.predict up to rounding.
+
+
+    INPUTS
+        model_dump : dictionary returned by booster.dump_model(), the best
+                     iteration of the booster is used if it has one
+
+
+    SAMPLE USAGE
+        scorer = TreeScorer.from_booster(mlflow.sklearn.load_model(MODEL_PATH))
+        y_pred = scorer.predict(X)
+    '''
+    def __init__(self, model_dump):
+        if model_dump.get('num_tree_per_iteration', 1) != 1 or not model_dump['objective'].startswith('binary'):
+            raise ValueError(f"only binary models can be compiled, not '{model_dump['objective']}'")
+        # e.g. 'binary sigmoid:1'
+        self.sigmoid = float(dict(option.split(':') for option in model_dump['objective'].split()[1:]
+                                  if ':' in option).get('sigmoid', 1))
+        self.n_features = model_dump['max_feature_idx'] + 1
+        splits, leaf_values, categories, roots = [], [], [], []
+        # the trees made of a single leaf add the same value to every row
+        self.base_score = 0.0
+        for tree in model_dump['tree_info']:
+            if 'leaf_value' in tree['tree_structure']:
+                self.base_score += tree['tree_structure']['leaf_value']
+            else:
+                roots.append(self.add_split(tree['tree_structure'], splits, leaf_values, categories))
+        self.roots = np.array(roots, dtype=np.intp)
+        columns = list(zip(*splits)) or [[]] * 6
+        self.feature = np.array(columns[0], dtype=np.intp)
+        self.threshold = np.array(columns[1], dtype=np.float64)
+        self.missing_type = np.array(columns[2], dtype=np.int8)
+        self.default_left = np.array(columns[3], dtype=bool)
+        # children of split i at 2 * i (left) and 2 * i + 1 (right)
+        self.children = np.array(columns[4], dtype=np.intp).reshape(-1)
+        # row of the categories going left of every split in self.categories,
+        # row 0 (no category) for the numerical splits
+        self.category_set = np.array(columns[5], dtype=np.intp)
+        self.leaf_value = np.array(leaf_values, dtype=np.float64)
+        width = max([max(category_set) + 1 for category_set in categories], default=1)
+        self.categories = np.zeros((len(categories) + 1, width), dtype=bool)
+        for j, category_set in enumerate(categories):
+            self.categories[j + 1, category_set] = True
+        self.is_categorical = self.category_set > 0
+        # the splits only compare the value to the threshold when there are no
+        # categorical splits, no zero missing type and no NaN in the batch
+        self.plain_splits = not self.is_categorical.any() and not (self.missing_type == MISSING_TYPES['Zero']).any()
+
+    @classmethod
+    def from_booster(cls, booster):
+        '''
+        Returns the TreeScorer of a lgb.Booster, or of the booster of a
+        LGBMClassifier.
+        '''
+        return cls(getattr(booster, 'booster_', booster).dump_model())
+
+    def add_split(self, node, splits, leaf_values, categories):
+        '''
+        Appends the split and the splits and leaves of its subtree to the
+        lists and returns its index, or the complement of the index of a leaf.
+        Every split is a tuple of (feature, threshold, missing type, default
+        left, (left child, right child), category set).
+        '''
+        if 'leaf_value' in node:
+            leaf_values.append(node['leaf_value'])
+            return ~(len(leaf_values) - 1)
+        if node.get('decision_type', '<=') == '==':
+            categories.append([int(category) for category in str(node['threshold']).split('||')])
+            threshold, category_set = 0.0, len(categories)
+        elif node.get('decision_type', '<=') == '<=':
+            threshold, category_set = float(node['threshold']), 0
+        else:
+            raise ValueError(f"unknown decision type '{node['decision_type']}'")
+        index = len(splits)
+        splits.append(None)
+        children = (self.add_split(node['left_child'], splits, leaf_values, categories),
+                    self.add_split(node['right_child'], splits, leaf_values, categories))
+        splits[index] = (node['split_feature'], threshold, MISSING_TYPES[node.get('missing_type', 'None')],
+                         node.get('default_left', True), children, category_set)
+        return index
+
+    def go_left(self, split, values):
+        '''
+        Returns whether the rows whose values of the split features are
+        'values' go to the left child of their current splits.
+        '''
+        is_nan = np.isnan(values)
+        missing_type = self.missing_type[split]
+        # NumericalDecision: NaN is 0 unless the missing type is NaN, the
+        # missing values then go the default way
+        numerical_values = np.where(is_nan & (missing_type != MISSING_TYPES['NaN']), 0.0, values)
+        missing = ((missing_type == MISSING_TYPES['Zero']) & (np.abs(numerical_values) <= K_ZERO_THRESHOLD)) | \
+                  ((missing_type == MISSING_TYPES['NaN']) & is_nan)
+        left = np.where(missing, self.default_left[split], numerical_values <= self.threshold[split])
+        is_categorical = self.is_categorical[split]
+        if is_categorical.any():
+            # CategoricalDecision: NaN, negative values and the categories
+            # not in the set of the split go right
+            codes = np.where(is_nan, -1, values).astype(np.intp)
+            known = (codes >= 0) & (codes < self.categories.shape[1])
+            in_set = known & self.categories[self.category_set[split], np.where(known, codes, 0)]
+            left = np.where(is_categorical, in_set, left)
+        return left
+
+    def predict_raw(self, X, chunk_rows=1000):
+        '''
+        This function returns the raw score (the sum of the leaf values of
+        all the trees) of every row of X, chunk_rows rows at a time so that
+        the arrays of the (row, tree) pairs stay small.
+
+
+        INPUTS
+            X : numpy (memory-mapped) matrix or CSR matrix, with the columns
+                the booster was trained on
+            chunk_rows : number of rows scored at a time
+
+
+        OUTPUT
+            1d float64 array of the raw scores
+
+
+        SAMPLE USAGE
+            raw_scores = scorer.predict_raw(X)
+        '''
+        if X.shape[1] != self.n_features:
+            raise ValueError(f'the model expects {self.n_features} features, got {X.shape[1]}')
+        raw_scores = np.full(X.shape[0], self.base_score, dtype=np.float64)
+        for start in range(0, X.shape[0], chunk_rows):
+            rows = X[start:start + chunk_rows]
+            rows = np.asarray(rows.toarray() if sparse.issparse(rows) else rows, dtype=np.float64)
+            plain_splits = self.plain_splits and not np.isnan(rows).any()
+            flat_rows = rows.reshape(-1)
+            # row of every pair and offset of the row in the flat view
+            row = np.repeat(np.arange(rows.shape[0], dtype=np.intp), len(self.roots))
+            offset = row * self.n_features
+            split = np.tile(self.roots, rows.shape[0])
+            chunk_scores = np.zeros(rows.shape[0], dtype=np.float64)
+            while split.size:
+                values = flat_rows[offset + self.feature[split]]
+                left = values <= self.threshold[split] if plain_splits else self.go_left(split, values)
+                split = self.children[2 * split + 1 - left]
+                leaf = split < 0
+                if leaf.any():
+                    chunk_scores += np.bincount(row[leaf], weights=self.leaf_value[~split[leaf]],
+                                                minlength=rows.shape[0])
+                    pending = ~leaf
+                    split, row, offset = split[pending], row[pending], offset[pending]
+            raw_scores[start:start + rows.shape[0]] += chunk_scores
+        return raw_scores
+
+    def predict(self, X, chunk_rows=1000):
+        '''
+        Returns the probability of the positive class of every row of X, like
+        booster.predict, see predict_raw.
+        '''
+        return 1.0 / (1.0 + np.exp(-self.sigmoid * self.predict_raw(X, chunk_rows)))
@@ -1,6 +1,6 @@
 '''
 filename: utils.py
-functions: encode_features, load_model
+functions: encode_features, model_directory, load_scorer, load_model
 creator: shashank.gupta
 version: 1
 '''
@@ -10,18 +10,49 @@ version: 1
 # ##############################################################################
 
 import mlflow
+import mlflow.lightgbm
 import mlflow.sklearn
+from mlflow.exceptions import MlflowException
+from mlflow.models import Model
+from mlflow.tracking import MlflowClient
+import numpy as np
 import pandas as pd
 
-import sqlite3
-
 import os
 import logging
+import time
 
 from datetime import datetime
 
 from Lead_scoring_inference_pipeline.constants import *
+from scipy import sparse
+
+from Lead_scoring_data_pipeline.connection import get_connection, table_writer, write_table, drop_table
+from Lead_scoring_data_pipeline.feature_store import publish_matrix, publish_sparse_matrix, open_matrix
+from Lead_scoring_data_pipeline.schema import model_input_dtypes
+from Lead_scoring_data_pipeline.encoding import OneHotEncoder, CategoricalEncoder
+from Lead_scoring_data_pipeline.transforms import compact_dtypes
+from Lead_scoring_common.cpu_budget import cpu_budget
+from Lead_scoring_inference_pipeline.tree_scorer import TreeScorer
+from Lead_scoring_inference_pipeline.model_cache import artifacts_stat, cached_model_directory, cached_model
+
+# maps every level of FEATURES_TO_ENCODE to its column of ONE_HOT_ENCODED_FEATURES
+encoder = OneHotEncoder(FEATURES_TO_ENCODE, ONE_HOT_ENCODED_FEATURES)
+
 
+def load_categorical_encoder():
+    '''
+    Returns the CategoricalEncoder of the model of model_directory, built
+    from the code dictionaries logged in its metadata by the training
+    pipeline so that the levels get the codes the model was trained with.
+    '''
+    model_path = model_directory()[0]
+    code_dictionaries = (Model.load(model_path).metadata or {}).get('category_codes')
+    if code_dictionaries is None:
+        raise ValueError(f"the model of {model_path} has no category codes, "
+                         f"it was not trained with CATEGORICAL_FEATURES")
+    return CategoricalEncoder(code_dictionaries['categorical_features'],
+                              [column for j, column in encoder.passthrough], code_dictionaries['categories'])
 ###############################################################################
 # Define the function to train the model
 # ##############################################################################
@@ -38,43 +69,142 @@ def encode_features():
         db_path : path where the db file should be
         ONE_HOT_ENCODED_FEATURES : list of the features that needs to be there in the final encoded dataframe
         FEATURES_TO_ENCODE: list of features  from cleaned data that need to be one-hot encoded
+        encoder : OneHotEncoder built once from FEATURES_TO_ENCODE and
+                  ONE_HOT_ENCODED_FEATURES, see encoding.py
+        SPARSE_FEATURES : if True the features are encoded and published as a
+                          CSR matrix and the 'features_inference' table is
+                          dropped, so that a table of an earlier dense run
+                          is not read as current
+        CATEGORICAL_FEATURES : if True FEATURES_TO_ENCODE are coded with the
+                               code dictionaries of the model instead, see
+                               load_categorical_encoder
         **NOTE : You can modify the encode_featues function used in heart disease's inference
         pipeline for this.
 
     OUTPUT
         1. Save the encoded features in a table - features
+        2. Publish them as a memory-mapped matrix with its manifest in
+           FEATURE_STORE_DIRECTORY, read by get_models_prediction (see
+           feature_store.py)
 
     SAMPLE USAGE
         encode_features()
     '''
-    conn = sqlite3.connect(DB_PATH+DB_FILE_NAME)
-    if conn:
-        model_input_data = pd.read_sql_query("select * from model_input",conn)
-        df_encoded = pd.DataFrame(columns=ONE_HOT_ENCODED_FEATURES)
-        df_placeholder= pd.DataFrame()
-        for feature in FEATURES_TO_ENCODE:
-            if feature in model_input_data.columns:
-                encode = pd.get_dummies(model_input_data[feature])
-                encode = encode.add_prefix(feature+'_')
-                df_placeholder = pd.concat([df_placeholder,encode],axis=1)
-            else:
-                print("feature not found")
-        
-        for feature in ONE_HOT_ENCODED_FEATURES:
-            if feature in df_placeholder.columns:
-                df_encoded[feature]= df_placeholder[feature]
-            if feature in model_input_data.columns:
-                df_encoded[feature]=model_input_data[feature]
-                
-        df_encoded=df_encoded.fillna(0)
-        df_encoded.to_sql('features_inference',con=conn,index=False,if_exists='replace')
-
-    conn.close()
+    with get_connection(DB_PATH+DB_FILE_NAME) as conn:
+        model_input_data = compact_dtypes(pd.read_sql_query("select * from model_input",conn), model_input_dtypes)
+        if CATEGORICAL_FEATURES:
+            categorical_encoder = load_categorical_encoder()
+            df_encoded = categorical_encoder.transform(model_input_data)
+            write_table(conn, 'features_inference', df_encoded)
+            publish_matrix('features_inference', df_encoded, metadata=categorical_encoder.code_dictionaries())
+        elif SPARSE_FEATURES:
+            drop_table(conn, 'features_inference')
+            publish_sparse_matrix('features_inference', encoder.encode_sparse(model_input_data), encoder.columns)
+        else:
+            df_encoded = encoder.transform(model_input_data)
+            write_table(conn, 'features_inference', df_encoded)
+            publish_matrix('features_inference', df_encoded)
 
 ###############################################################################
 # Define the function to load the model from mlflow model registry
 # ##############################################################################
 
+def model_directory():
+    '''
+    This function returns the local directory of the model to score with and
+    the key identifying it. If MODEL_NAME is set, the version of MODEL_NAME
+    with MODEL_ALIAS is looked up in the mlflow model registry and its local
+    copy in MODEL_CACHE_DIRECTORY is returned, the version is only downloaded
+    if it is not there yet (see cached_model_directory). Otherwise it is
+    MODEL_PATH, identified by the size and modification time of its files
+    instead of the sha256 of its artifacts so that it is not read twice.
+
+    INPUTS
+        MODEL_NAME, MODEL_ALIAS : registered model and alias of the version
+                                  to score with, MODEL_PATH is used if
+                                  MODEL_NAME is None
+        MODEL_CACHE_DIRECTORY : directory of the local copies of the versions
+
+    OUTPUT
+        Tuple of (path of the model, tuple of its name, version and the sha256
+        of its artifacts, or MODEL_PATH, None and its artifacts_stat)
+
+    SAMPLE USAGE
+        path, key = model_directory()
+    '''
+    if MODEL_NAME is None:
+        return MODEL_PATH, (MODEL_PATH, None, artifacts_stat(MODEL_PATH))
+    mlflow.set_tracking_uri(TRACKING_URI)
+    try:
+        version = MlflowClient().get_model_version_by_alias(MODEL_NAME, MODEL_ALIAS).version
+    except MlflowException as e:
+        raise ValueError(f"no version of model '{MODEL_NAME}' has alias '{MODEL_ALIAS}'") from e
+    start = time.perf_counter()
+    path, checksum, hit = cached_model_directory(
+        MODEL_NAME, version,
+        lambda directory: mlflow.artifacts.download_artifacts(artifact_uri=f"models:/{MODEL_NAME}/{version}",
+                                                              dst_path=directory))
+    print(f"model cache {'hit' if hit else 'miss'}: version {version} of model '{MODEL_NAME}' "
+          f"{'found' if hit else 'downloaded'} in {time.perf_counter() - start:.2f}s")
+    return path, (MODEL_NAME, version, checksum)
+
+
+def load_backend(model_path):
+    '''
+    Loads the model of model_path with the SCORING_BACKEND and returns the
+    function scoring a matrix with it: the predict method of the mlflow
+    pyfunc model ('pyfunc'), of the LightGBM booster ('booster'), or of the
+    TreeScorer compiled from the booster ('numpy'). The booster is loaded with
+    the lightgbm flavor of the model if it has one, else from the
+    LGBMClassifier of its sklearn flavor; a model which is neither is scored
+    with its pyfunc model.
+    '''
+    if SCORING_BACKEND not in ('pyfunc', 'booster', 'numpy'):
+        raise ValueError(f"unknown SCORING_BACKEND '{SCORING_BACKEND}'")
+    if SCORING_BACKEND == 'pyfunc':
+        return mlflow.pyfunc.load_model(model_path).predict
+    # the booster of a model logged with mlflow.lightgbm, or of a
+    # LGBMClassifier logged with mlflow.sklearn, which has no lightgbm flavor
+    flavors = Model.load(model_path).flavors
+    if 'lightgbm' in flavors:
+        booster = mlflow.lightgbm.load_model(model_path)
+    elif 'sklearn' in flavors:
+        booster = getattr(mlflow.sklearn.load_model(model_path), 'booster_', None)
+    else:
+        booster = None
+    if booster is None:
+        print(f"the model of {model_path} is not a LightGBM model, scoring it with 'pyfunc' "
+              f"instead of '{SCORING_BACKEND}'")
+        return mlflow.pyfunc.load_model(model_path).predict
+    if SCORING_BACKEND == 'booster':
+        return booster.predict
+    return TreeScorer.from_booster(booster).predict
+
+
+def load_scorer():
+    '''
+    This function returns the function scoring a matrix with the model of
+    model_directory, loaded with the SCORING_BACKEND (see load_backend). A
+    process keeps the models it loaded, so that a long-lived worker only
+    loads the model again once its version or artifacts change.
+
+    INPUTS
+        SCORING_BACKEND : 'pyfunc', 'booster' or 'numpy'
+        MODEL_CACHE_SIZE : number of models kept loaded
+
+    OUTPUT
+        Function returning the scores of the rows of a numpy or CSR matrix
+
+    SAMPLE USAGE
+        y_pred = load_scorer()(X)
+    '''
+    path, key = model_directory()
+    start = time.perf_counter()
+    predict, hit = cached_model(key + (SCORING_BACKEND,), lambda: load_backend(path))
+    print(f"model cache {'hit' if hit else 'miss'}: {SCORING_BACKEND} model of {path} "
+          f"{'already loaded' if hit else 'loaded'} in {time.perf_counter() - start:.2f}s")
+    return predict
+
 def get_models_prediction():
     '''
     This function loads the model which is in production from mlflow registry and 
@@ -84,9 +214,22 @@ def get_models_prediction():
     INPUTS
         db_file_name : Name of the database file
         db_path : path where the db file should be
+        FEATURE_STORE_DIRECTORY : directory of the 'features_inference' matrix
+                                  published by encode_features, which is
+                                  memory-mapped instead of read from the db
+                                  and scored directly if it is a CSR matrix
+        PREDICTION_CHUNK_SIZE : number of rows written to 'predicted_data' at
+                                a time
+        PREDICTION_THRESHOLD : probability above which a lead is predicted 1
+        CPU_POOL_SLOTS, MAX_THREADS_PER_TASK : the model scores with the
+                                cpu_budget of the task instead of all the cores
+        SCORING_BACKEND : how the model is loaded and scores, see load_scorer
         model from mlflow model registry
         model name: name of the model to be loaded
         stage: stage from which the model needs to be loaded i.e. production
+        MODEL_CACHE_DIRECTORY : the version is only downloaded and loaded again
+                                once MODEL_ALIAS moves to another version,
+                                see model_directory
 
 
     OUTPUT
@@ -95,13 +238,22 @@ def get_models_prediction():
     SAMPLE USAGE
         load_model()
     '''
-    conn = sqlite3.connect(DB_PATH+DB_FILE_NAME)
-    df_new_data = pd.read_sql_query("select * from features_inference",conn)
-    load_model = mlflow.pyfunc.load_model(MODEL_PATH)
-    y_pred = load_model.predict(df_new_data)
-    df_new_data['app_complete_flag']=y_pred
-    df_new_data.to_sql("predicted_data",conn,if_exists='replace',index=False)
-    conn.close()
+    X, manifest = open_matrix('features_inference')
+    predict = load_scorer()
+    with cpu_budget(CPU_POOL_SLOTS, MAX_THREADS_PER_TASK):
+        y_pred = np.asarray(predict(X))
+    # a LightGBM booster predicts the probability of the positive class, an
+    # sklearn classifier its label, which the threshold leaves unchanged
+    y_pred = (y_pred > PREDICTION_THRESHOLD).astype('int8')
+    # the dataframes are only built to save the predictions along with the
+    # input, a chunk of rows at a time so that a CSR matrix is never dense
+    with get_connection(DB_PATH+DB_FILE_NAME) as conn:
+        with table_writer(conn, 'predicted_data') as write_chunk:
+            for start in range(0, max(X.shape[0], 1), PREDICTION_CHUNK_SIZE):
+                rows = X[start:start+PREDICTION_CHUNK_SIZE]
+                df_new_data = pd.DataFrame(rows.toarray() if sparse.issparse(rows) else rows, columns=manifest['columns'])
+                df_new_data['app_complete_flag']=y_pred[start:start+PREDICTION_CHUNK_SIZE]
+                write_chunk(df_new_data)
 
 ###############################################################################
 # Define the function to check the distribution of output column
@@ -129,8 +281,8 @@ def prediction_ratio_check():
     SAMPLE USAGE
         prediction_col_check()
     '''
-    conn = sqlite3.connect(DB_PATH+DB_FILE_NAME)
-    df_predicted = pd.read_sql_query("select * from predicted_data",conn)
+    with get_connection(DB_PATH+DB_FILE_NAME) as conn:
+        df_predicted = pd.read_sql_query("select * from predicted_data",conn)
     per_value=df_predicted['app_complete_flag'].value_counts(normalize=True)
     ct = datetime.now()
     text = str(ct) +" % of 1="+str(per_value[0])+ " % of 0 =" + str(per_value[1])
@@ -148,10 +300,12 @@ def input_features_check():
     columns in input data.
 
     INPUTS
-        db_file_name : Name of the database file
-        db_path : path where the db file should be
+        FEATURE_STORE_DIRECTORY : directory of the 'features_inference' matrix,
+                                  only the columns of its manifest are read
         ONE_HOT_ENCODED_FEATURES: List of all the features which need to be present
         in our input data.
+        CATEGORICAL_FEATURES : if True the columns are checked against the
+                               ones coded with the model's code dictionaries
 
     OUTPUT
         It writes the output in a log file based on whether all the columns are present
@@ -162,9 +316,9 @@ def input_features_check():
     SAMPLE USAGE
         input_col_check()
     '''
-    conn = sqlite3.connect(DB_PATH+DB_FILE_NAME)
-    df_new_data = pd.read_sql_query("select * from features_inference",conn)
-    if(set(df_new_data)==set(ONE_HOT_ENCODED_FEATURES)):
+    columns = open_matrix('features_inference')[1]['columns']
+    expected_columns = load_categorical_encoder().columns if CATEGORICAL_FEATURES else ONE_HOT_ENCODED_FEATURES
+    if(set(columns)==set(expected_columns)):
         print("All the models input are present")
     else:
         print("Some of the models inputs are missing")
@@ -0,0 +1,141 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import train_test_split
+
+from Lead_scoring_training_pipeline.constants import FEATURES_TO_ENCODE, ONE_HOT_ENCODED_FEATURES, model_config
+from Lead_scoring_data_pipeline.schema import encoding_dtypes
+from Lead_scoring_data_pipeline.encoding import OneHotEncoder, CategoricalEncoder
+from Lead_scoring_common.cpu_budget import available_cores, thread_budget
+
+###############################################################################
+# Define the benchmark of the native categorical features of LightGBM
+# ##############################################################################
+
+
+def benchmark_native_categorical(n_rows=500_000, seed=0):
+    '''
+    This function trains the LightGBM model of the training pipeline, with
+    its model_config, once on the one hot encoded features and once on the
+    categorical codes of CategoricalEncoder, and compares the training time,
+    the size of the model, the latency of scoring the test set and a single
+    lead, and the test AUC. The synthetic model_input has the levels of the
+    training pipeline and a label drawn from an effect of every level.
+
+
+    INPUTS
+        n_rows : number of leads to benchmark with, 30% of them are the
+                 test set like in get_trained_model
+        seed : seed of the synthetic leads
+
+
+    OUTPUT
+        Prints one line per encoding
+
+
+    SAMPLE USAGE
+        benchmark_native_categorical(n_rows=100_000)
+    '''
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'total_leads_droppped': rng.integers(0, 20, n_rows).astype('int16'),
+                       'referred_lead': rng.integers(0, 2, n_rows).astype('int8')})
+    logit = 0.05 * df['total_leads_droppped'].to_numpy() - 1.0
+    for feature in FEATURES_TO_ENCODE:
+        dtype = encoding_dtypes[feature]
+        codes = rng.integers(0, len(dtype.categories), n_rows)
+        df[feature] = pd.Categorical.from_codes(codes, dtype=dtype)
+        logit = logit + rng.normal(0, 1, len(dtype.categories))[codes]
+    df['app_complete_flag'] = (rng.random(n_rows) < 1 / (1 + np.exp(-logit))).astype('int8')
+    one_hot_encoder = OneHotEncoder(FEATURES_TO_ENCODE, ONE_HOT_ENCODED_FEATURES)
+    categorical_encoder = CategoricalEncoder(FEATURES_TO_ENCODE, [column for j, column in one_hot_encoder.passthrough])
+    for name, encoder in [('one hot', one_hot_encoder), ('native', categorical_encoder)]:
+        df_encoded = encoder.transform(df)
+        X = df_encoded.drop('app_complete_flag', axis=1)
+        categorical_feature = [j for j, column in enumerate(X.columns) if column in FEATURES_TO_ENCODE] \
+            if encoder is categorical_encoder else 'auto'
+        X_train, X_test, y_train, y_test = train_test_split(X.to_numpy(), df_encoded['app_complete_flag'].to_numpy(),
+                                                            test_size=0.3, random_state=0)
+        clf = lgb.LGBMClassifier(**model_config, verbose=-1)
+        start = time.perf_counter()
+        clf.fit(X_train, y_train, categorical_feature=categorical_feature)
+        train_time = time.perf_counter() - start
+        start = time.perf_counter()
+        scores = clf.predict_proba(X_test)[:, 1]
+        batch_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(100):
+            clf.predict_proba(X_test[i:i + 1])
+        lead_time = (time.perf_counter() - start) / 100
+        model_size = len(clf.booster_.model_to_string().encode())
+        print(f'{name:>8} {X.shape[1]:>3} columns {n_rows:>8} rows: train {train_time:6.2f}s, '
+              f'model {model_size / 1024:7.1f} KB, score {batch_time:5.2f}s / {lead_time * 1000:5.2f}ms per lead, '
+              f'test auc {roc_auc_score(y_test, scores):.4f}')
+
+
+###############################################################################
+# Define the benchmark of the cpu budget of concurrent LightGBM tasks
+# ##############################################################################
+
+
+def train_task(n_rows, threads, seed=0):
+    '''
+    Trains a LightGBM model with 'threads' threads on synthetic one hot
+    features, as a training task would, and returns the time.time() at which
+    the training started and ended. Run in the processes of
+    benchmark_thread_budget.
+    '''
+    rng = np.random.default_rng(seed)
+    X = (rng.random((n_rows, 40)) < 0.1).astype('float32')
+    y = (X[:, :8].sum(axis=1) + rng.normal(0, 1, n_rows) > 1).astype(int)
+    train_set = lgb.Dataset(X, y, params={'verbose': -1}).construct()
+    start = time.time()
+    lgb.train({'objective': 'binary', 'num_threads': threads, 'verbose': -1}, train_set, num_boost_round=100)
+    return start, time.time()
+
+
+def benchmark_thread_budget(task_counts=(1, 2, 4), n_rows=200_000, unbudgeted_threads=None):
+    '''
+    This function runs 1, 2 and 4 LightGBM training tasks at once, in as many
+    processes, once with every task using all the cores (n_jobs=-1, the
+    default of model_config) and once with the thread_budget of the tasks,
+    and compares the throughput of both.
+
+
+    INPUTS
+        task_counts : numbers of tasks run at once
+        n_rows : number of leads every task trains on
+        unbudgeted_threads : threads of a task without budget, the
+                             available_cores by default. A larger value
+                             emulates a worker with more cores than this one
+
+
+    OUTPUT
+        Prints one line per number of tasks and budget
+
+
+    SAMPLE USAGE
+        benchmark_thread_budget(task_counts=[1, 4], unbudgeted_threads=8)
+    '''
+    unbudgeted_threads = unbudgeted_threads or available_cores()
+    for task_count in task_counts:
+        for name, threads in [('all cores', unbudgeted_threads), ('budget', thread_budget(task_count))]:
+            with ProcessPoolExecutor(max_workers=task_count) as executor:
+                spans = list(executor.map(train_task, [n_rows] * task_count, [threads] * task_count,
+                                          range(task_count)))
+            elapsed = max(end for start, end in spans) - min(start for start, end in spans)
+            print(f'{task_count} tasks {name:>9} ({threads:>2} threads each, {available_cores()} cores): '
+                  f'{elapsed:6.2f}s, {task_count / elapsed * 60:6.1f} models/minute')
+
+
+if __name__ == '__main__':
+    benchmark_native_categorical()
+    benchmark_thread_budget()
@@ -29,6 +29,73 @@ ONE_HOT_ENCODED_FEATURES = ['total_leads_droppped', 'referred_lead', 'app_comple
 
 # list of features that need to be one-hot encoded
 FEATURES_TO_ENCODE = ['city_tier','first_platform_c','first_utm_medium_c','first_utm_source_c']
+# encode the features as a scipy.sparse CSR matrix, which only stores the few
+# non-zero values of every row, instead of a dense one. The 'features' table
+# is then not written, the matrix is only published in the feature store
+SPARSE_FEATURES = False
+# keep FEATURES_TO_ENCODE as integer codes which LightGBM splits on natively
+# instead of one hot encoding them. The code dictionaries are logged with the
+# model, in the 'category_codes' entry of its metadata, for the inference pipeline
+CATEGORICAL_FEATURES = False
+# binary lgb.Datasets of the train split, the DATASET_CACHE_SIZE most recently
+# used ones are kept (see dataset_cache.py)
+DATASET_CACHE_DIRECTORY = '/home/airflow/dags/Lead_scoring_training_pipeline/dataset_cache/'
+DATASET_CACHE_SIZE = 4
+# train/test split of get_trained_model, the test split is also the held-out
+# split the tuning trials early stop on
+TRAIN_TEST_SPLIT = {'test_size': 0.3, 'random_state': 0}
+# successive halving search of tune_hyperparameters (see tuning.py).
+# TUNING_CONFIGS configurations are drawn from TUNING_SEARCH_SPACE and trained
+# for TUNING_MIN_ROUNDS rounds, the best 1/TUNING_ETA are trained again with
+# TUNING_ETA times as many rounds, up to TUNING_MAX_ROUNDS. The parameters of
+# the search space must not change the bins of the Dataset (no max_bin,
+# min_child_samples, ...) as it is shared by the trials
+TUNE_HYPERPARAMETERS = True
+TUNING_SEARCH_SPACE = {'num_leaves': [7, 15, 31, 63, 127],
+                       'learning_rate': [0.02, 0.05, 0.1, 0.2],
+                       'colsample_bytree': [0.6, 0.8, 1.0],
+                       'reg_lambda': [0.0, 1.0, 10.0],
+                       'min_split_gain': [0.0, 0.01]}
+TUNING_CONFIGS = 27
+TUNING_MIN_ROUNDS = 50
+TUNING_MAX_ROUNDS = 1000
+TUNING_ETA = 3
+EARLY_STOPPING_ROUNDS = 20
+# wall-clock budget of the search in seconds
+TUNING_TIME_BUDGET = 1800
+# processes running the trials (None fills the thread budget of the task, see
+# CPU_POOL_SLOTS) and threads of each trial, the search uses
+# TUNING_WORKERS * TRIAL_THREADS cores
+TUNING_WORKERS = None
+TRIAL_THREADS = 1
+TUNED_CONFIG_FILE = '/home/airflow/dags/Lead_scoring_training_pipeline/tuned_config.json'
+# continue boosting the latest registered model with INCREMENTAL_TREES trees
+# trained on the leads which arrived since, instead of training from scratch
+# (see warm_start_model). A full training is made every FULL_RETRAIN_EVERY + 1
+# runs, when fewer than MIN_INCREMENTAL_ROWS leads arrived since (too few to
+# split into train and test leads and measure the AUC on), or when the drift
+# score of the new leads (largest standardized difference of the means of a
+# column) is above DRIFT_THRESHOLD
+INCREMENTAL_TRAINING = False
+INCREMENTAL_TREES = 10
+FULL_RETRAIN_EVERY = 6
+MIN_INCREMENTAL_ROWS = 1000
+DRIFT_THRESHOLD = 0.2
+# artifact of every run holding the column_stats of the leads its model was
+# trained on, the drift of the new leads is measured against them
+TRAINING_PROFILE_FILE = 'training_profile.json'
+# cpu budget of the training tasks (see Lead_scoring_common/cpu_budget.py): the
+# cores available to the worker (cpu affinity and cgroup quota) are shared by
+# the CPU_POOL_SLOTS tasks which may run at once, i.e. the slots of their
+# airflow pool, and LightGBM, OpenMP and BLAS use that many threads, at most
+# MAX_THREADS_PER_TASK (None for no cap) instead of all the cores (n_jobs=-1)
+CPU_POOL_SLOTS = 1
+MAX_THREADS_PER_TASK = None
 EXPERIMENT_NAME = "Lead_scoring_mlflow_production"
 TRACKING_URI = "http://0.0.0.0:6006"
+# name of the registered model
+MODEL_NAME = 'LightGBM'
+# train and register a new model version even if a run of the experiment
+# already trained one from the same features, target and model_config
+RETRAIN_UNCHANGED = False
 model_config ={'boosting_type': 'gbdt', 'class_weight': None, 'colsample_bytree': 1.0, 'importance_type': 'split', 'learning_rate': 0.1, 'max_depth': -1, 'min_child_samples': 20, 'min_child_weight': 0.001, 'min_split_gain': 0.0, 'n_estimators': 100, 'n_jobs': -1, 'num_leaves': 31, 'objective': None, 'random_state': 42, 'reg_alpha': 0.0, 'reg_lambda': 0.0, 'silent': 'warn', 'subsample': 1.0, 'subsample_for_bin': 200000, 'subsample_freq': 0}
@@ -0,0 +1,133 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+import hashlib
+import json
+import os
+import time
+
+import lightgbm as lgb
+
+from Lead_scoring_training_pipeline.constants import DATASET_CACHE_DIRECTORY, DATASET_CACHE_SIZE
+
+###############################################################################
+# Define the functions to train LightGBM on a binary Dataset built once per
+# version of the features and reused by the later runs
+# ##############################################################################
+
+# parameters of model_config (or their lgb.train names) used to build the bins
+# of a Dataset, a Dataset built with other values can not be reused
+DATASET_PARAMS = ['max_bin', 'max_bin_by_feature', 'min_data_in_bin', 'subsample_for_bin',
+                  'bin_construct_sample_cnt', 'min_child_samples', 'min_data_in_leaf', 'feature_pre_filter',
+                  'use_missing', 'zero_as_missing', 'linear_tree', 'random_state', 'seed', 'data_random_seed']
+
+
+def booster_params(config):
+    '''
+    This function translates the parameters of a LGBMClassifier, like
+    model_config, into the parameters and number of boosting rounds of
+    lgb.train, the way LGBMClassifier.fit does for a binary label, so that
+    lgb.train builds the same model.
+
+
+    INPUTS
+        config : dictionary of LGBMClassifier parameters
+
+
+    OUTPUT
+        Tuple of (dictionary of lgb.train parameters, number of boosting rounds)
+
+
+    SAMPLE USAGE
+        params, num_boost_round = booster_params(model_config)
+    '''
+    params = {key: value for key, value in config.items()
+              if key not in ['n_estimators', 'importance_type', 'class_weight', 'silent']}
+    params['objective'] = params.get('objective') or 'binary'
+    params.setdefault('metric', 'binary_logloss')
+    if params.get('n_jobs') is not None and params['n_jobs'] < 0:
+        params['n_jobs'] = max(os.cpu_count() + 1 + params['n_jobs'], 1)
+    params.setdefault('verbose', -1)
+    return params, config.get('n_estimators', 100)
+
+
+def dataset_key(fingerprints, params, **dataset_args):
+    '''
+    Returns the sha256 identifying a Dataset: the fingerprints of its
+    content (e.g. the sha256 of the manifests of the 'features' and 'target'
+    matrices and the parameters of the train/test split), its binning
+    parameters (see DATASET_PARAMS) and the other arguments it is built with.
+    '''
+    binning_params = {key: params[key] for key in DATASET_PARAMS if key in params}
+    content = json.dumps([fingerprints, binning_params, dataset_args], sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def dataset_path(fingerprints, params, feature_name='auto', categorical_feature='auto',
+                 directory=DATASET_CACHE_DIRECTORY):
+    '''
+    Returns the path in the cache of the binary Dataset cached_dataset builds
+    with the same arguments, whether it exists or not.
+    '''
+    key = dataset_key(fingerprints, params, feature_name=feature_name, categorical_feature=categorical_feature)
+    return os.path.join(directory, key + '.bin')
+
+
+def evict_datasets(directory, keep):
+    '''
+    Removes the least recently used Datasets of the cache but the 'keep' most
+    recently used ones.
+    '''
+    paths = [os.path.join(directory, file) for file in os.listdir(directory) if file.endswith('.bin')]
+    for path in sorted(paths, key=os.path.getmtime)[:max(len(paths) - keep, 0)]:
+        os.remove(path)
+
+
+def cached_dataset(X, y, fingerprints, params, feature_name='auto', categorical_feature='auto',
+                   reference=None, directory=DATASET_CACHE_DIRECTORY):
+    '''
+    This function returns the constructed lgb.Dataset of X and y. The first
+    time a Dataset is built it is saved in LightGBM's binary format, under
+    the dataset_key of the fingerprints, binning parameters and arguments,
+    and the later calls with the same key load the binary file instead of
+    binning X again. Only the DATASET_CACHE_SIZE most recently used Datasets
+    are kept.
+
+
+    INPUTS
+        X, y : features and label, X can be a numpy array or a CSR matrix
+        fingerprints : json serializable fingerprints of the content of X and y,
+                       which must change whenever X or y change
+        params : lgb.train parameters, see booster_params
+        feature_name, categorical_feature : arguments of lgb.Dataset
+        reference : Dataset whose bins are used, for a validation Dataset. It
+                    is not part of the key, the fingerprints must tell
+                    validation Datasets apart
+        directory : directory of the binary Datasets
+
+
+    OUTPUT
+        Tuple of (constructed lgb.Dataset, seconds taken to build or load it,
+        True if it was loaded from the cache)
+
+
+    SAMPLE USAGE
+        train_set, seconds, hit = cached_dataset(X_train, y_train, [manifest['sha256']], params)
+    '''
+    os.makedirs(directory, exist_ok=True)
+    path = dataset_path(fingerprints, params, feature_name, categorical_feature, directory)
+    start = time.perf_counter()
+    hit = os.path.exists(path)
+    if hit:
+        dataset = lgb.Dataset(path, params=params, reference=reference).construct()
+        os.utime(path)
+    else:
+        dataset = lgb.Dataset(X, y, params=params, feature_name=feature_name, categorical_feature=categorical_feature,
+                              reference=reference, free_raw_data=False).construct()
+        # saved under a temporary name first, a reader never sees a partial file
+        dataset.save_binary(path + '.tmp')
+        os.replace(path + '.tmp', path)
+        evict_datasets(directory, DATASET_CACHE_SIZE)
+    return dataset, time.perf_counter() - start, hit
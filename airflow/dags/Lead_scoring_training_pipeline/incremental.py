@@ -0,0 +1,87 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+import numpy as np
+from scipy import sparse
+
+###############################################################################
+# Define the functions to profile the features a model was trained on and
+# measure the drift of the newly arrived leads
+# ##############################################################################
+
+
+def column_stats(X, chunk_rows=100_000):
+    '''
+    This function returns the number of rows and the sums and sums of
+    squares of the columns of a matrix, read chunk_rows rows at a time. They
+    are all that is needed to compare the means of the columns of two
+    matrices and to update the statistics with new rows, see combine_stats.
+
+
+    INPUTS
+        X : numpy (memory-mapped) matrix or CSR matrix
+        chunk_rows : number of rows converted to float64 at a time
+
+
+    OUTPUT
+        Dictionary holding the 'rows' and the 'sums' and 'sums_sq' lists of
+        the columns
+
+
+    SAMPLE USAGE
+        stats = column_stats(X[trained_rows:])
+    '''
+    sums, sums_sq = np.zeros(X.shape[1]), np.zeros(X.shape[1])
+    for start in range(0, X.shape[0], chunk_rows):
+        chunk = X[start:start + chunk_rows]
+        if sparse.issparse(chunk):
+            sums += np.asarray(chunk.sum(axis=0, dtype='float64')).ravel()
+            sums_sq += np.asarray(chunk.multiply(chunk).sum(axis=0, dtype='float64')).ravel()
+        else:
+            chunk = np.asarray(chunk, dtype='float64')
+            sums += chunk.sum(axis=0)
+            sums_sq += np.square(chunk).sum(axis=0)
+    return {'rows': int(X.shape[0]), 'sums': sums.tolist(), 'sums_sq': sums_sq.tolist()}
+
+
+def combine_stats(stats, new_stats):
+    '''
+    Returns the column_stats of the rows of both statistics.
+    '''
+    return {'rows': stats['rows'] + new_stats['rows'],
+            'sums': (np.array(stats['sums']) + new_stats['sums']).tolist(),
+            'sums_sq': (np.array(stats['sums_sq']) + new_stats['sums_sq']).tolist()}
+
+
+def drift_score(stats, new_stats):
+    '''
+    This function returns the largest standardized difference of the means
+    of the columns between two column_stats, i.e. the difference of the means
+    divided by the standard deviation of both sets of rows pooled. A column
+    which is constant in both sets and changes value has an infinite score.
+
+
+    INPUTS
+        stats : column_stats of the rows the model was trained on
+        new_stats : column_stats of the newly arrived rows
+
+
+    OUTPUT
+        The drift score, 0 if there are no new rows
+
+
+    SAMPLE USAGE
+        drift = drift_score(profile, column_stats(X[trained_rows:]))
+    '''
+    if new_stats['rows'] == 0 or stats['rows'] == 0:
+        return 0.0
+    means, new_means = np.array(stats['sums']) / stats['rows'], np.array(new_stats['sums']) / new_stats['rows']
+    variances = np.maximum(np.array(stats['sums_sq']) / stats['rows'] - means ** 2, 0)
+    new_variances = np.maximum(np.array(new_stats['sums_sq']) / new_stats['rows'] - new_means ** 2, 0)
+    differences = np.abs(new_means - means)
+    deviations = np.sqrt((variances + new_variances) / 2)
+    scores = np.divide(differences, deviations, out=np.where(differences > 1e-12, np.inf, 0.0),
+                       where=deviations > 0)
+    return float(scores.max()) if scores.size else 0.0
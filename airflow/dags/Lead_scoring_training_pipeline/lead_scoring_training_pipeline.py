@@ -33,6 +33,12 @@ ML_training_dag = DAG(
 
 encoding_categorical_variables = PythonOperator(task_id='encoding_categorical_variables',python_callable=encode_features,dag=ML_training_dag)
 
+###############################################################################
+# Create a task for tune_hyperparameters() function with task_id 'tuning_hyperparameters'
+# ##############################################################################
+
+tuning_hyperparameters = PythonOperator(task_id='tuning_hyperparameters',python_callable=tune_hyperparameters,dag=ML_training_dag)
+
 ###############################################################################
 # Create a task for get_trained_model() function with task_id 'training_model'
 # ##############################################################################
@@ -43,4 +49,5 @@ training_model = PythonOperator(task_id='training_model',python_callable=get_tra
 # Define relations between tasks
 # ##############################################################################
 
-encoding_categorical_variables.set_downstream(training_model)
+encoding_categorical_variables.set_downstream(tuning_hyperparameters)
+tuning_hyperparameters.set_downstream(training_model)
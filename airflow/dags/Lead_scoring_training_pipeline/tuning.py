@@ -0,0 +1,166 @@
+##############################################################################
+# Import necessary modules
+# #############################################################################
+
+
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import lightgbm as lgb
+import numpy as np
+
+from Lead_scoring_training_pipeline.dataset_cache import DATASET_PARAMS
+
+###############################################################################
+# Define the functions of the successive halving search of the tuning stage
+# ##############################################################################
+
+
+def sample_configs(search_space, n_configs, seed=0):
+    '''
+    This function draws distinct configurations of the search space at
+    random, each parameter taking one of its listed values.
+
+
+    INPUTS
+        search_space : dictionary of parameter -> list of values, see
+                       TUNING_SEARCH_SPACE
+        n_configs : number of configurations to draw, fewer are returned if
+                    the search space does not hold as many
+        seed : seed of the draw
+
+
+    OUTPUT
+        List of dictionaries of parameter -> value
+
+
+    SAMPLE USAGE
+        configs = sample_configs({'num_leaves': [15, 31, 63]}, 3)
+    '''
+    binning = [parameter for parameter in search_space if parameter in DATASET_PARAMS]
+    if binning:
+        raise ValueError(f'{binning} change the bins of the Dataset shared by the trials, '
+                         f'they can not be part of the search space')
+    rng = np.random.default_rng(seed)
+    n_configs = min(n_configs, math.prod(len(values) for values in search_space.values()))
+    configs = []
+    while len(configs) < n_configs:
+        config = {parameter: values[rng.integers(len(values))] for parameter, values in search_space.items()}
+        config = {parameter: value.item() if isinstance(value, np.generic) else value
+                  for parameter, value in config.items()}
+        if config not in configs:
+            configs.append(config)
+    return configs
+
+
+def run_trial(train_path, valid_path, params, num_boost_round, early_stopping_rounds, deadline):
+    '''
+    This function trains a booster on the binary train Dataset with early
+    stopping on the AUC of the binary validation Dataset. Training also stops
+    at the deadline, keeping the best iteration so far.
+    It is run in the worker processes of successive_halving.
+
+
+    INPUTS
+        train_path, valid_path : paths of the binary Datasets, see
+                                 dataset_cache.dataset_path
+        params : lgb.train parameters of the trial
+        num_boost_round : maximum number of boosting rounds
+        early_stopping_rounds : number of rounds without improvement of the
+                                validation AUC after which training stops
+        deadline : time.time() after which training stops
+
+
+    OUTPUT
+        Dictionary holding the best 'valid_auc', its 'best_iteration' and the
+        'seconds' taken
+
+
+    SAMPLE USAGE
+        result = run_trial(train_path, valid_path, params, 100, 20, time.time() + 60)
+    '''
+    start = time.perf_counter()
+
+    # iteration and evaluation results of the best validation AUC so far,
+    # the iteration training ends on at the deadline
+    best = {}
+
+    def stop_at_deadline(env):
+        _, _, auc, _ = env.evaluation_result_list[0]
+        if not best or auc > best['auc']:
+            best.update(auc=auc, iteration=env.iteration, results=env.evaluation_result_list)
+        if time.time() > deadline:
+            raise lgb.callback.EarlyStopException(best['iteration'], best['results'])
+    stop_at_deadline.order = 40
+
+    train_set = lgb.Dataset(train_path, params=params)
+    valid_set = lgb.Dataset(valid_path, reference=train_set)
+    booster = lgb.train({**params, 'metric': 'auc'}, train_set, num_boost_round=num_boost_round,
+                        valid_sets=[valid_set],
+                        callbacks=[lgb.early_stopping(early_stopping_rounds, verbose=False), stop_at_deadline])
+    return {'valid_auc': float(booster.best_score['valid_0']['auc']),
+            'best_iteration': int(booster.best_iteration or booster.current_iteration()),
+            'seconds': time.perf_counter() - start}
+
+
+def successive_halving(train_path, valid_path, trial_params, configs, min_rounds, max_rounds, eta=3,
+                       early_stopping_rounds=20, workers=None, time_budget=None, log_trial=None):
+    '''
+    This function runs a successive halving search: every configuration is
+    trained for min_rounds boosting rounds, the best 1/eta of them (by
+    validation AUC) are trained again with eta times as many rounds, and so
+    on until one configuration is left or max_rounds is reached. The trials
+    of a rung run in a pool of 'workers' processes and all of them load the
+    same binary Datasets. Once time_budget is spent the trials not started
+    yet are cancelled, the running ones stop at their best iteration so far.
+    The best trial of all the rungs is returned.
+
+
+    INPUTS
+        train_path, valid_path : paths of the binary Datasets
+        trial_params : function returning the lgb.train parameters of a
+                       configuration
+        configs : configurations to search, see sample_configs
+        min_rounds, max_rounds : boosting rounds of the first and last rungs
+        eta : share of the configurations kept at every rung is 1/eta
+        early_stopping_rounds : see run_trial
+        workers : number of processes, None means one per cpu
+        time_budget : seconds after which the search stops, None for no limit
+        log_trial : function called in this process with every finished trial
+
+
+    OUTPUT
+        The best trial, a dictionary holding its 'config', 'rung',
+        'num_boost_round' and the result of run_trial. None if no trial
+        finished
+
+
+    SAMPLE USAGE
+        best = successive_halving(train_path, valid_path, params_of, configs, 50, 1000, workers=4)
+    '''
+    deadline = time.time() + time_budget if time_budget is not None else math.inf
+    best, rung, rounds = None, 0, min_rounds
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while configs and time.time() < deadline:
+            futures = {executor.submit(run_trial, train_path, valid_path, trial_params(config), rounds,
+                                       early_stopping_rounds, deadline): config for config in configs}
+            trials = []
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                trial = {'config': futures[future], 'rung': rung, 'num_boost_round': rounds, **future.result()}
+                trials.append(trial)
+                if log_trial is not None:
+                    log_trial(trial)
+                if time.time() > deadline:
+                    for pending in futures:
+                        pending.cancel()
+            trials.sort(key=lambda trial: (-trial['valid_auc'], trial['best_iteration']))
+            if trials and (best is None or trials[0]['valid_auc'] > best['valid_auc']):
+                best = trials[0]
+            if rounds >= max_rounds or len(configs) == 1:
+                break
+            configs = [trial['config'] for trial in trials[:max(len(configs) // eta, 1)]]
+            rung, rounds = rung + 1, min(rounds * eta, max_rounds)
+    return best
@@ -12,11 +12,12 @@ version: 1
 import pandas as pd
 import numpy as np
 
-import sqlite3
-from sqlite3 import Error
-
 import mlflow
 import mlflow.sklearn
+import mlflow.lightgbm
+from mlflow.tracking import MlflowClient
+import hashlib
+import json
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import roc_auc_score
 import lightgbm as lgb
@@ -24,7 +25,23 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score
 
 from Lead_scoring_training_pipeline.constants import *
+from Lead_scoring_data_pipeline.connection import get_connection, write_table, drop_table
+from Lead_scoring_data_pipeline.feature_store import publish_matrix, publish_sparse_matrix, open_matrix, prefix_sha256
+from Lead_scoring_data_pipeline.schema import model_input_dtypes
+from Lead_scoring_data_pipeline.encoding import OneHotEncoder, CategoricalEncoder
+from Lead_scoring_data_pipeline.transforms import compact_dtypes
+from Lead_scoring_common.cpu_budget import cpu_budget, thread_budget
+from Lead_scoring_training_pipeline.dataset_cache import booster_params, cached_dataset, dataset_path
+from Lead_scoring_training_pipeline.tuning import sample_configs, successive_halving
+from Lead_scoring_training_pipeline.incremental import column_stats, combine_stats, drift_score
+import time
+import os
 import logging
+
+# maps every level of FEATURES_TO_ENCODE to its column of ONE_HOT_ENCODED_FEATURES
+encoder = OneHotEncoder(FEATURES_TO_ENCODE, ONE_HOT_ENCODED_FEATURES)
+# codes FEATURES_TO_ENCODE and copies the other columns, if CATEGORICAL_FEATURES
+categorical_encoder = CategoricalEncoder(FEATURES_TO_ENCODE, [column for j, column in encoder.passthrough])
 ###############################################################################
 # Define the function to encode features
 # ##############################################################################
@@ -40,11 +57,23 @@ def encode_features():
         db_path : path where the db file should be
         ONE_HOT_ENCODED_FEATURES : list of the features that needs to be there in the final encoded dataframe
         FEATURES_TO_ENCODE: list of features  from cleaned data that need to be one-hot encoded
+        encoder : OneHotEncoder built once from FEATURES_TO_ENCODE and
+                  ONE_HOT_ENCODED_FEATURES, see encoding.py
+        SPARSE_FEATURES : if True the features are encoded and published as a
+                          CSR matrix and the 'features' table is dropped,
+                          so that a table of an earlier dense run is not
+                          read as current
+        CATEGORICAL_FEATURES : if True FEATURES_TO_ENCODE are coded by
+                               categorical_encoder instead, and the code
+                               dictionaries are added to the manifest
        
 
     OUTPUT
         1. Save the encoded features in a table - features
         2. Save the target variable in a separate table - target
+        3. Publish both as memory-mapped matrices with their manifests in
+           FEATURE_STORE_DIRECTORY, read by get_trained_model (see
+           feature_store.py)
 
 
     SAMPLE USAGE
@@ -53,32 +82,287 @@ def encode_features():
     **NOTE : You can modify the encode_featues function used in heart disease's inference
         pipeline from the pre-requisite module for this.
     '''
-    conn = sqlite3.connect(DB_PATH+DB_FILE_NAME)
-    if conn:
-        model_input_data = pd.read_sql_query("select * from model_input",conn)
-        df_encoded = pd.DataFrame(columns=ONE_HOT_ENCODED_FEATURES)
-        df_placeholder= pd.DataFrame()
-        for feature in FEATURES_TO_ENCODE:
-            if feature in model_input_data.columns:
-                encode = pd.get_dummies(model_input_data[feature])
-                encode = encode.add_prefix(feature+'_')
-                df_placeholder = pd.concat([df_placeholder,encode],axis=1)
-            else:
-                print("feature not found")
-        
-        for feature in ONE_HOT_ENCODED_FEATURES:
-            if feature in df_placeholder.columns:
-                df_encoded[feature]= df_placeholder[feature]
-            if feature in model_input_data.columns:
-                df_encoded[feature]=model_input_data[feature]
-                
-        df_encoded=df_encoded.fillna(0)
-        df_features = df_encoded.drop('app_complete_flag',axis=1)
-        df_target = df_encoded['app_complete_flag']
-        df_features.to_sql('features',con=conn,index=False,if_exists='replace')
-        df_target.to_sql('target',con=conn,index=False,if_exists='replace')
-
-    conn.close()
+    with get_connection(DB_PATH+DB_FILE_NAME) as conn:
+        model_input_data = compact_dtypes(pd.read_sql_query("select * from model_input",conn), model_input_dtypes)
+        if CATEGORICAL_FEATURES:
+            df_encoded = categorical_encoder.transform(model_input_data)
+            df_features = df_encoded.drop('app_complete_flag',axis=1)
+            df_target = df_encoded['app_complete_flag']
+            write_table(conn, 'features', df_features)
+            publish_matrix('features', df_features, metadata=categorical_encoder.code_dictionaries())
+        elif SPARSE_FEATURES:
+            drop_table(conn, 'features')
+            features = [j for j, column in enumerate(encoder.columns) if column != 'app_complete_flag']
+            publish_sparse_matrix('features', encoder.encode_sparse(model_input_data)[:, features],
+                                  [encoder.columns[j] for j in features])
+            df_target = model_input_data['app_complete_flag'].fillna(0)
+        else:
+            df_encoded = encoder.transform(model_input_data)
+            df_features = df_encoded.drop('app_complete_flag',axis=1)
+            df_target = df_encoded['app_complete_flag']
+            write_table(conn, 'features', df_features)
+            publish_matrix('features', df_features)
+        write_table(conn, 'target', df_target.to_frame())
+    publish_matrix('target', df_target)
+###############################################################################
+# Define the functions to find a model already trained on the same data
+# ##############################################################################
+
+def training_data_hash(manifest, target_manifest, config):
+    '''
+    Returns the sha256 of everything a model is trained from: the content
+    (sha256) and columns of the 'features' and 'target' matrices, including
+    the code dictionaries of the categorical features if any, the train/test
+    split TRAIN_TEST_SPLIT and the parameters in config.
+    '''
+    content = json.dumps([{key: value for key, value in manifest.items() if key not in ['format', 'nnz']},
+                          target_manifest, TRAIN_TEST_SPLIT, config], sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def find_registered_model(training_hash):
+    '''
+    This function looks up a finished run of EXPERIMENT_NAME tagged with the
+    training_hash whose model is registered as MODEL_NAME.
+
+
+    INPUTS
+        training_hash : hash returned by training_data_hash
+
+
+    OUTPUT
+        The registered model version, None if there is no such run
+
+
+    SAMPLE USAGE
+        model_version = find_registered_model(training_hash)
+    '''
+    client = MlflowClient()
+    experiment = client.get_experiment_by_name(EXPERIMENT_NAME)
+    if experiment is None:
+        return None
+    runs = client.search_runs([experiment.experiment_id],
+                              filter_string=f"tags.training_hash = '{training_hash}' and attributes.status = 'FINISHED'",
+                              order_by=['attributes.start_time DESC'])
+    for run in runs:
+        model_versions = client.search_model_versions(f"run_id = '{run.info.run_id}'")
+        for model_version in model_versions:
+            if model_version.name == MODEL_NAME:
+                return model_version
+    return None
+
+###############################################################################
+# Define the function to tune the hyperparameters
+# ##############################################################################
+
+def tuning_settings():
+    '''
+    Returns the settings of the search which decide its result, hashed with
+    the data to tell whether the tuned config is up to date.
+    '''
+    return {'model_config': model_config, 'search_space': TUNING_SEARCH_SPACE, 'configs': TUNING_CONFIGS,
+            'rounds': [TUNING_MIN_ROUNDS, TUNING_MAX_ROUNDS], 'eta': TUNING_ETA,
+            'early_stopping_rounds': EARLY_STOPPING_ROUNDS}
+
+
+def tuning_settings_hash():
+    '''
+    Returns the sha256 of the tuning_settings alone.
+    '''
+    return hashlib.sha256(json.dumps(tuning_settings(), sort_keys=True, default=str).encode()).hexdigest()
+
+
+def is_tuned_for(tuned, manifest, target_manifest):
+    '''
+    Tells whether the content of TUNED_CONFIG_FILE was tuned on the same data
+    with the same settings. With INCREMENTAL_TRAINING only the settings have
+    to be the same: a config tuned on the data of every day would make every
+    training a full one, see warm_start_model.
+    '''
+    if INCREMENTAL_TRAINING:
+        return tuned['settings_hash'] == tuning_settings_hash()
+    return tuned['tuning_hash'] == training_data_hash(manifest, target_manifest, tuning_settings())
+
+
+def tuned_config(manifest, target_manifest):
+    '''
+    Returns model_config updated with the best parameters found by
+    tune_hyperparameters on the same data and settings (see is_tuned_for), or
+    model_config itself if TUNE_HYPERPARAMETERS is not set or there is no
+    such result.
+    '''
+    if not TUNE_HYPERPARAMETERS or not os.path.exists(TUNED_CONFIG_FILE):
+        return model_config
+    with open(TUNED_CONFIG_FILE) as f:
+        tuned = json.load(f)
+    if not is_tuned_for(tuned, manifest, target_manifest):
+        print(f"{TUNED_CONFIG_FILE} was tuned on other data or settings, training with model_config")
+        return model_config
+    return {**model_config, **tuned['config']}
+
+
+def tune_hyperparameters():
+    '''
+    This function searches the hyperparameters of the LightGBM model with
+    successive halving (see tuning.py): TUNING_CONFIGS configurations of
+    TUNING_SEARCH_SPACE are trained in a pool of TUNING_WORKERS processes,
+    early stopping on the AUC of the test split, and the best ones are kept
+    and trained longer rung after rung. All the trials load the same binary
+    train and test Datasets of the Dataset cache, which get_trained_model
+    then reuses. The search stops once TUNING_TIME_BUDGET is spent.
+
+    INPUTS
+        FEATURE_STORE_DIRECTORY : directory of the 'features' and 'target'
+                                  matrices published by encode_features
+        TUNING_SEARCH_SPACE, TUNING_CONFIGS, TUNING_MIN_ROUNDS,
+        TUNING_MAX_ROUNDS, TUNING_ETA, EARLY_STOPPING_ROUNDS : search settings
+        TUNING_TIME_BUDGET : wall-clock budget of the search in seconds
+        TUNING_WORKERS, TRIAL_THREADS : processes running the trials and
+                                        threads of each trial, the search uses
+                                        TUNING_WORKERS * TRIAL_THREADS cores.
+                                        If TUNING_WORKERS is None they fill
+                                        the thread_budget of the task
+
+
+    OUTPUT
+        Tracks the search as a run named 'tuning' in EXPERIMENT_NAME, with
+        every trial logged as a child run
+        Writes the best parameters, with n_estimators set to the best
+        iteration, to TUNED_CONFIG_FILE for get_trained_model. Nothing is
+        searched if the file already holds the result for the same data and
+        settings (see is_tuned_for), or if TUNE_HYPERPARAMETERS is not set
+
+    SAMPLE USAGE
+        tune_hyperparameters()
+    '''
+    if not TUNE_HYPERPARAMETERS:
+        print("TUNE_HYPERPARAMETERS is not set, training with model_config")
+        return
+    X, manifest = open_matrix('features')
+    y, target_manifest = open_matrix('target')
+    tuning_hash = training_data_hash(manifest, target_manifest, tuning_settings())
+    if os.path.exists(TUNED_CONFIG_FILE):
+        with open(TUNED_CONFIG_FILE) as f:
+            if is_tuned_for(json.load(f), manifest, target_manifest):
+                print("features, target and tuning settings are unchanged, keeping the tuned config")
+                return
+    X_train,X_test,y_train,y_test = train_test_split(X,y[:, 0],**TRAIN_TEST_SPLIT)
+    params = booster_params(model_config)[0]
+    fingerprints = [manifest['sha256'], target_manifest['sha256'], TRAIN_TEST_SPLIT]
+    dataset_args = {'feature_name': manifest['columns'],
+                    'categorical_feature': manifest.get('categorical_features', 'auto')}
+    train_set = cached_dataset(X_train, y_train, fingerprints, params, **dataset_args)[0]
+    cached_dataset(X_test, y_test, fingerprints + ['test'], params, reference=train_set)
+
+    def trial_params(config):
+        return booster_params({**model_config, **config, 'n_jobs': TRIAL_THREADS})[0]
+    workers = TUNING_WORKERS or max(thread_budget(CPU_POOL_SLOTS, MAX_THREADS_PER_TASK) // TRIAL_THREADS, 1)
+
+    mlflow.set_tracking_uri(TRACKING_URI)
+    try:
+        mlflow.create_experiment(EXPERIMENT_NAME)
+    except:
+        pass
+    mlflow.set_experiment(EXPERIMENT_NAME)
+    with mlflow.start_run(run_name='tuning') as run:
+        def log_trial(trial):
+            with mlflow.start_run(run_name=f"trial rung {trial['rung']}", nested=True):
+                mlflow.log_params({**trial['config'], 'num_boost_round': trial['num_boost_round']})
+                mlflow.log_metrics({key: trial[key] for key in ['valid_auc', 'best_iteration', 'seconds']})
+
+        best = successive_halving(dataset_path(fingerprints, params, **dataset_args),
+                                  dataset_path(fingerprints + ['test'], params),
+                                  trial_params, sample_configs(TUNING_SEARCH_SPACE, TUNING_CONFIGS),
+                                  TUNING_MIN_ROUNDS, TUNING_MAX_ROUNDS, TUNING_ETA, EARLY_STOPPING_ROUNDS,
+                                  workers, TUNING_TIME_BUDGET, log_trial)
+        if best is None:
+            print("no trial finished within TUNING_TIME_BUDGET, training with model_config")
+            return
+        config = {**best['config'], 'n_estimators': best['best_iteration']}
+        mlflow.log_params(config)
+        mlflow.log_metric('best_valid_auc', best['valid_auc'])
+    with open(TUNED_CONFIG_FILE + '.tmp', 'w') as f:
+        json.dump({'tuning_hash': tuning_hash, 'settings_hash': tuning_settings_hash(), 'config': config,
+                   'valid_auc': best['valid_auc'], 'run_id': run.info.run_id}, f)
+    os.replace(TUNED_CONFIG_FILE + '.tmp', TUNED_CONFIG_FILE)
+    print(f"best config {config} with a validation auc of {best['valid_auc']:.4f}")
+
+###############################################################################
+# Define the functions to continue boosting the latest model on the new leads
+# ##############################################################################
+
+def setup_hash(manifest, config):
+    '''
+    Returns the sha256 of what a model can only be warm started from if it
+    is unchanged: the columns of the features, including the code
+    dictionaries of the categorical features if any, and the parameters.
+    '''
+    content = json.dumps([manifest['columns'], manifest.get('categories'), config], sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def warm_start_model(X, y, manifest, config):
+    '''
+    This function decides whether the latest registered version of MODEL_NAME
+    can be trained further on the leads which arrived since it was trained,
+    i.e. the rows of 'features' past the number of rows it was trained on
+    ('model_input' only grows in INCREMENTAL_MODE of the data pipeline). It
+    can not if it was not trained by this pipeline with the same columns and
+    config, if the first rows of 'features' or 'target' changed since (they
+    are hashed and compared with the sha256 of the matrices it was trained
+    on), if FULL_RETRAIN_EVERY incremental runs were made since its last full
+    training, if fewer than MIN_INCREMENTAL_ROWS leads arrived since, or if
+    the drift_score of the new leads against the leads it was trained on is
+    above DRIFT_THRESHOLD.
+
+
+    INPUTS
+        X, y : 'features' and 'target' matrices returned by open_matrix
+        manifest : manifest of the 'features' matrix
+        config : parameters of the model, see tuned_config
+
+
+    OUTPUT
+        Tuple of (dictionary holding the 'booster', its 'version', the number
+        of 'trained_rows', the 'incremental_runs' since the last full
+        training, the column_stats 'profile' of the trained rows and the
+        'new_stats' of the new ones, reason of the full retrain). Either item
+        is None
+
+
+    SAMPLE USAGE
+        previous, reason = warm_start_model(X, y, manifest, config)
+    '''
+    client = MlflowClient()
+    model_versions = client.search_model_versions(f"name = '{MODEL_NAME}'")
+    if not model_versions:
+        return None, f"no version of model '{MODEL_NAME}' is registered"
+    model_version = max(model_versions, key=lambda model_version: int(model_version.version))
+    run = client.get_run(model_version.run_id)
+    tags = run.data.tags
+    if 'trained_rows' not in tags or tags.get('setup_hash') != setup_hash(manifest, config):
+        return None, f"version {model_version.version} was trained on other columns or with another config"
+    incremental_runs = int(tags['incremental_runs'])
+    if incremental_runs + 1 > FULL_RETRAIN_EVERY:
+        return None, f"{incremental_runs} incremental runs since the last full training"
+    trained_rows = int(tags['trained_rows'])
+    if trained_rows >= X.shape[0] or prefix_sha256(X, trained_rows) != tags['features_sha256'] \
+            or prefix_sha256(y, trained_rows) != tags['target_sha256']:
+        return None, f"the {trained_rows} leads version {model_version.version} was trained on changed"
+    if X.shape[0] - trained_rows < MIN_INCREMENTAL_ROWS:
+        return None, f"{X.shape[0] - trained_rows} leads arrived since version {model_version.version} " \
+                     f"was trained, fewer than MIN_INCREMENTAL_ROWS"
+    with open(mlflow.artifacts.download_artifacts(run_id=run.info.run_id, artifact_path=TRAINING_PROFILE_FILE)) as f:
+        profile = json.load(f)
+    new_stats = column_stats(X[trained_rows:])
+    drift = drift_score(profile, new_stats)
+    mlflow.log_metric('drift', drift)
+    if drift > DRIFT_THRESHOLD:
+        return None, f"drift of the new leads {drift:.3f} is above DRIFT_THRESHOLD"
+    booster = mlflow.lightgbm.load_model(f"models:/{MODEL_NAME}/{model_version.version}")
+    return {'booster': booster, 'version': model_version.version, 'trained_rows': trained_rows,
+            'incremental_runs': incremental_runs, 'profile': profile, 'new_stats': new_stats}, None
+
 ###############################################################################
 # Define the function to train the model
 # ##############################################################################
@@ -92,43 +376,110 @@ def get_trained_model():
     recorded as a metric in mlflow run.   
 
     INPUTS
-        db_file_name : Name of the database file
-        db_path : path where the db file should be
+        FEATURE_STORE_DIRECTORY : directory of the 'features' and 'target'
+                                  matrices published by encode_features, which
+                                  are memory-mapped instead of read from the db.
+                                  LightGBM is trained on the CSR matrix directly
+                                  if the features were published as one, and
+                                  splits natively on the categorical features
+                                  listed in the manifest if any
+        DATASET_CACHE_DIRECTORY : directory of the binary lgb.Dataset of the
+                                  train split, reused as long as the sha256 of
+                                  the matrices and the binning parameters of
+                                  model_config are the same (see
+                                  dataset_cache.py)
+        TUNED_CONFIG_FILE : parameters found by tune_hyperparameters, which
+                            update model_config if TUNE_HYPERPARAMETERS is set
+        CPU_POOL_SLOTS, MAX_THREADS_PER_TASK : LightGBM uses the cpu_budget
+                            of the task instead of all the cores
 
 
     OUTPUT
         Tracks the run in experiment named 'Lead_Scoring_Training_Pipeline'
-        Logs the trained model into mlflow model registry with name 'LightGBM'
-        Logs the metrics and parameters into mlflow run
+        Logs the trained model into mlflow model registry with name 'LightGBM',
+        with the code dictionaries of the categorical features in the
+        'category_codes' entry of its metadata
+        Logs the metrics and parameters into mlflow run, including the time
+        taken to build (or load) the Dataset and whether it was cached
+        Tags the run with the training_data_hash of its inputs. If a run with
+        the same hash already registered a model, nothing is trained and that
+        model version is kept, unless RETRAIN_UNCHANGED is set
+        Tags the run with its 'training_mode', 'full' or 'incremental', and
+        the reason of a full training. If INCREMENTAL_TRAINING is set and
+        warm_start_model allows it, the latest model is boosted with
+        INCREMENTAL_TREES more trees on the new leads only, which are also
+        the leads the metrics are computed on
         Calculate auc from the test data and log into mlflow run  
 
     SAMPLE USAGE
         get_trained_model()
     '''
-    conn = sqlite3.connect(DB_PATH+DB_FILE_NAME)
-    if conn:
-        X = pd.read_sql("select * from features",conn)
-        y = pd.read_sql("select * from target",conn)
-        X_train,X_test,y_train,y_test = train_test_split(X,y,test_size=0.3,random_state=0)
-        mlflow.set_tracking_uri(TRACKING_URI)
-        try:
-            logging.info("creating mlflow experiment")
-            mlflow.create_experiment(EXPERIMENT_NAME)
-        except:
-            pass
-        logging.info("setting mlflow experiment")
-        mlflow.set_experiment(EXPERIMENT_NAME)
-        with mlflow.start_run(run_name=EXPERIMENT_NAME) as run:
-            clf = lgb.LGBMClassifier()
-            clf.set_params(**model_config)
-            clf.fit(X_train,y_train)
-            mlflow.sklearn.log_model(sk_model=clf,artifact_path="models",registered_model_name='LightGBM')
-            mlflow.log_params(model_config)
-            y_pred = clf.predict(X_test)
-            acc = accuracy_score(y_pred,y_test)
-            auc = roc_auc_score(y_pred,y_test)
-            mlflow.log_metric('test_accouracy',acc)
-            mlflow.log_metric('test_auc',auc)
-            runID = run.info.run_uuid
-            print("Inside MLflow Run with id {}".format(runID))
-   
+    X, manifest = open_matrix('features')
+    y, target_manifest = open_matrix('target')
+    config = tuned_config(manifest, target_manifest)
+    training_hash = training_data_hash(manifest, target_manifest, config)
+    mlflow.set_tracking_uri(TRACKING_URI)
+    if not RETRAIN_UNCHANGED:
+        model_version = find_registered_model(training_hash)
+        if model_version is not None:
+            print(f"features, target and config are unchanged, keeping version {model_version.version} "
+                  f"of model '{MODEL_NAME}' trained in run {model_version.run_id}")
+            return
+    params, num_boost_round = booster_params(config)
+    dataset_args = {'feature_name': manifest['columns'],
+                    'categorical_feature': manifest.get('categorical_features', 'auto')}
+    try:
+        logging.info("creating mlflow experiment")
+        mlflow.create_experiment(EXPERIMENT_NAME)
+    except:
+        pass
+    logging.info("setting mlflow experiment")
+    mlflow.set_experiment(EXPERIMENT_NAME)
+    with cpu_budget(CPU_POOL_SLOTS, MAX_THREADS_PER_TASK) as threads, \
+            mlflow.start_run(run_name=EXPERIMENT_NAME) as run:
+        mlflow.set_tag('training_hash', training_hash)
+        mlflow.log_metric('num_threads', threads)
+        params['n_jobs'] = threads
+        previous, reason = warm_start_model(X, y, manifest, config) if INCREMENTAL_TRAINING \
+            else (None, "INCREMENTAL_TRAINING is not set")
+        if previous is None:
+            print(f"full training: {reason}")
+            mlflow.set_tags({'training_mode': 'full', 'full_training_reason': reason, 'incremental_runs': 0})
+            X_train,X_test,y_train,y_test = train_test_split(X,y[:, 0],**TRAIN_TEST_SPLIT)
+            train_set, dataset_seconds, cached = cached_dataset(
+                X_train, y_train, [manifest['sha256'], target_manifest['sha256'], TRAIN_TEST_SPLIT], params,
+                **dataset_args)
+            booster = lgb.train(params, train_set, num_boost_round=num_boost_round)
+            profile = column_stats(X)
+        else:
+            # only the new leads are split, boosted on and evaluated on
+            new_rows = slice(previous['trained_rows'], None)
+            print(f"incremental training of version {previous['version']} on {X.shape[0] - new_rows.start} new leads")
+            mlflow.set_tags({'training_mode': 'incremental', 'base_version': previous['version'],
+                             'incremental_runs': previous['incremental_runs'] + 1})
+            X_train,X_test,y_train,y_test = train_test_split(X[new_rows],y[new_rows, 0],**TRAIN_TEST_SPLIT)
+            start = time.perf_counter()
+            # the raw data is kept for the predictions of the model continued
+            train_set = lgb.Dataset(X_train, y_train, params=params, free_raw_data=False, **dataset_args).construct()
+            dataset_seconds, cached = time.perf_counter() - start, False
+            booster = lgb.train(params, train_set, num_boost_round=INCREMENTAL_TREES, init_model=previous['booster'])
+            profile = combine_stats(previous['profile'], previous['new_stats'])
+        mlflow.set_tags({'trained_rows': X.shape[0], 'features_sha256': manifest['sha256'],
+                         'target_sha256': target_manifest['sha256'], 'setup_hash': setup_hash(manifest, config)})
+        mlflow.log_dict(profile, TRAINING_PROFILE_FILE)
+        # the code dictionaries are part of the model, so that they are
+        # downloaded with every registered version of it
+        metadata = {'category_codes': {key: manifest[key] for key in ['categorical_features', 'categories']}} \
+            if 'categorical_features' in manifest else None
+        mlflow.lightgbm.log_model(lgb_model=booster,artifact_path="models",registered_model_name=MODEL_NAME,
+                                  metadata=metadata)
+        mlflow.log_params(config)
+        mlflow.log_metric('dataset_construction_seconds',dataset_seconds)
+        mlflow.log_metric('dataset_cached',int(cached))
+        y_pred = (booster.predict(X_test) > 0.5).astype(int)
+        acc = accuracy_score(y_pred,y_test)
+        auc = roc_auc_score(y_pred,y_test)
+        mlflow.log_metric('test_accouracy',acc)
+        mlflow.log_metric('test_auc',auc)
+        runID = run.info.run_uuid
+        print("Inside MLflow Run with id {}".format(runID))